@@ -1,27 +1,30 @@
+from datetime import timedelta
+
 from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.exceptions import PermissionDenied
+from django.template.response import TemplateResponse
+from django.utils import timezone
+from django.utils.html import format_html
+
+from . import bulk, reporting
 from .models import (
-    Item, OrderItem, Order, Address, Payment, Coupon,
-    Refund, Category, Rating, Wishlist
+    Item, OrderItem, Order, Address, Payment, Coupon, Refund, Category, Rating,
+    Wishlist, Task, Stock, Reservation, DailySales, BulkJob, AuditLog
 )
 
 
-def refund_accepted(modeladmin, request, queryset):
-    queryset.update(refund_requested=False, refund_granted=True)
-
-
-refund_accepted.short_description = 'Update to Refund granted'
-
-
-def received(modeladmin, request, queryset):
-    queryset.update(received=True)
-
-
-received.short_descritpion = 'Update to Received'
+class StockInline(admin.StackedInline):
+    model = Stock
+    fields = ['on_hand', 'reserved']
+    readonly_fields = ['reserved']
 
 
 class ItemAdmin(admin.ModelAdmin):
+    inlines = [StockInline]
     prepopulated_fields = {'slug': ('title',)}
-    list_display = ['title', 'price', 'discount_price', 'category']
+    list_display = ['title', 'price', 'discount_price', 'category',
+                    'rating_average', 'rating_count']
     search_fields = ['title', ]
     list_filter = ['category']
     list_display_links = ('title',)
@@ -35,8 +38,27 @@ class AddressAdmin(admin.ModelAdmin):
                     'country']
 
 
+class UserFilter(admin.SimpleListFilter):
+    # Listing every user in the sidebar does not scale, so this only offers
+    # the user already picked, e.g. from the orders link on a row. Filtering
+    # on user_id is served by order_user_date_idx.
+    title = 'user'
+    parameter_name = 'user'
+
+    def lookups(self, request, model_admin):
+        if not (self.value() or '').isdigit():
+            return []
+        return User.objects.filter(pk=self.value()).values_list('pk', 'username')
+
+    def queryset(self, request, queryset):
+        if (self.value() or '').isdigit():
+            return queryset.filter(user_id=self.value())
+        return queryset
+
+
 class OrderAdmin(admin.ModelAdmin):
     list_display = ['user',
+                    'user_orders',
                     'ordered',
                     'ref_code',
                     'ordered_date',
@@ -44,19 +66,26 @@ class OrderAdmin(admin.ModelAdmin):
                     'refund_requested',
                     'refund_granted',
                     'received']
+    list_select_related = ['user', 'address']
+    autocomplete_fields = ['user']
     search_fields = ['user__username', 'ref_code']
     list_filter = [
-        'user',
+        UserFilter,
         'ordered',
         'received',
         'refund_requested',
         'refund_granted'
     ]
     actions = [
-        refund_accepted,
-        received
+        bulk.grant_refunds.admin_action(),
+        bulk.mark_received.admin_action()
     ]
 
+    def user_orders(self, order):
+        return format_html('<a href="?user={}">all orders</a>', order.user_id)
+
+    user_orders.short_description = 'orders'
+
 
 class RefundAdmin(admin.ModelAdmin):
     list_display = [
@@ -70,21 +99,26 @@ class PaymentAdmin(admin.ModelAdmin):
     list_display = ['user',
                     'charge_id',
                     'amount',
+                    'refund_id',
                     'timestamp']
 
 
 class RatingAdmin(admin.ModelAdmin):
     list_display = [
+        'item',
         'user',
         'value',
-        'message'
+        'message',
+        'created'
     ]
     list_filter = [
-        'user',
         'value'
     ]
+    list_select_related = ['item', 'user']
+    raw_id_fields = ['item', 'user']
     search_fields = [
-        'value'
+        'item__title',
+        'message'
     ]
 
 
@@ -92,6 +126,75 @@ class CouponAdmin(admin.ModelAdmin):
     list_display = ['code', 'amount']
 
 
+class ReservationAdmin(admin.ModelAdmin):
+    list_display = ['item', 'user', 'quantity', 'expires_at']
+    raw_id_fields = ['item', 'user']
+
+
+class ReadOnlyAdmin(admin.ModelAdmin):
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class SalesReportAdmin(ReadOnlyAdmin):
+    # A dashboard over the daily rollups instead of a change list; it never
+    # touches the order tables, see catalog.reporting.
+    change_list_template = 'admin/catalog/sales_report.html'
+    periods = [7, 30, 90, 365]
+
+    def changelist_view(self, request, extra_context=None):
+        if not self.has_view_or_change_permission(request):
+            raise PermissionDenied
+        days = request.GET.get('days', '30')
+        days = int(days) if days.isdigit() and int(days) in self.periods else 30
+        end = timezone.localdate()
+        start = end - timedelta(days=days - 1)
+        context = {
+            **self.admin_site.each_context(request),
+            **reporting.dashboard(start, end),
+            'title': 'Sales report',
+            'opts': self.model._meta,
+            'periods': self.periods,
+            'period': days,
+            'start': start,
+            'end': end,
+        }
+        return TemplateResponse(request, self.change_list_template, context)
+
+
+class BulkJobAdmin(ReadOnlyAdmin):
+    list_display = ['action', 'actor', 'status', 'progress_display', 'changed', 'created',
+                    'finished']
+    list_filter = ['status', 'action']
+    exclude = ['object_ids']
+    readonly_fields = ['progress_display']
+
+    def progress_display(self, job):
+        return f'{job.processed}/{job.total} ({job.progress}%)'
+
+    progress_display.short_description = 'progress'
+
+
+class AuditLogAdmin(ReadOnlyAdmin):
+    list_display = ['created', 'action', 'object_type', 'object_id', 'actor', 'job']
+    list_filter = ['action', 'object_type']
+    list_select_related = ['actor']
+    search_fields = ['=object_id']
+    date_hierarchy = 'created'
+
+
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ['name', 'status', 'attempts', 'run_after', 'created']
+    list_filter = ['status', 'name']
+    readonly_fields = ['last_error']
+
+
 admin.site.register(Item, ItemAdmin)
 admin.site.register(OrderItem)
 admin.site.register(Address, AddressAdmin)
@@ -102,3 +205,8 @@ admin.site.register(Category)
 admin.site.register(Wishlist)
 admin.site.register(Rating, RatingAdmin)
 admin.site.register(Refund, RefundAdmin)
+admin.site.register(Reservation, ReservationAdmin)
+admin.site.register(Task, TaskAdmin)
+admin.site.register(DailySales, SalesReportAdmin)
+admin.site.register(BulkJob, BulkJobAdmin)
+admin.site.register(AuditLog, AuditLogAdmin)
@@ -0,0 +1,19 @@
+import json
+
+from .models import AuditLog
+
+
+def record(action, model, object_ids, actor_id=None, job_id=None, **changes):
+    """Append one AuditLog entry per id in ``object_ids``, in one INSERT."""
+    payload = json.dumps(changes, sort_keys=True, default=str)
+    return AuditLog.objects.bulk_create([
+        AuditLog(action=action, actor_id=actor_id, job_id=job_id,
+                 object_type=model._meta.label_lower, object_id=object_id,
+                 changes=payload)
+        for object_id in object_ids
+    ])
+
+
+def history(obj):
+    return AuditLog.objects.filter(
+        object_type=obj._meta.label_lower, object_id=obj.pk).order_by('created', 'id')
@@ -0,0 +1,61 @@
+"""
+SQLite tuned for serving a shop from one file.
+
+Django's SQLite backend keeps the rollback journal, in which every writer
+locks readers out, and opens transactions with a deferred BEGIN. Two
+add_to_cart calls then both start reading, one upgrades to a write lock
+and the other fails with "database is locked" at once, since a deferred
+transaction cannot wait for a lock it would deadlock on.
+
+This backend sets PRAGMAS on every new connection. WAL lets readers run
+alongside the writer, and busy_timeout makes a waiting writer retry for a
+while rather than fail. Transactions start with BEGIN IMMEDIATE, taking
+the write lock up front, where waiting for it is safe. Override pragmas
+with OPTIONS = {'pragmas': {...}}.
+
+journal_mode is persistent: a database file opened here once stays in WAL
+mode, with -wal and -shm files next to it while connections are open.
+
+Every atomic block starts with BEGIN IMMEDIATE, read-only ones included,
+since whether a block will write is not known when it starts. Such a block
+waits for the writer like any other, so run plain reads in autocommit
+(outside atomic), where WAL lets them proceed alongside it.
+"""
+from django.db.backends.sqlite3 import base, features
+from django.utils.functional import cached_property
+
+PRAGMAS = {
+    'journal_mode': 'wal',
+    # Safe in WAL mode: a power cut can lose the last commits, not corrupt.
+    'synchronous': 'normal',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    # Negative: KiB rather than pages.
+    'cache_size': -64 * 1024,
+    'temp_store': 'memory',
+}
+
+
+class DatabaseFeatures(features.DatabaseFeatures):
+    @cached_property
+    def serializes_write_transactions(self):
+        # Shared-cache memory databases fail a competing writer instead.
+        return not self.connection.is_in_memory_db()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    features_class = DatabaseFeatures
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        self.pragmas = {**PRAGMAS, **params.pop('pragmas', {})}
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
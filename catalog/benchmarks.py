@@ -0,0 +1,266 @@
+import time
+from contextlib import contextmanager
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Max
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .models import Category, Coupon, Item, Order, OrderItem
+
+
+@contextmanager
+def rolled_back(using='default'):
+    # Benchmarks seed into the configured database and throw it all away.
+    with transaction.atomic(using=using):
+        yield
+        transaction.set_rollback(True, using=using)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples):
+    return {
+        'count': len(samples),
+        'mean': sum(samples) / len(samples),
+        'p50': percentile(samples, 50),
+        'p95': percentile(samples, 95),
+        'p99': percentile(samples, 99),
+    }
+
+
+def time_calls(fn, args_list):
+    samples = []
+    for args in args_list:
+        start = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def next_id(model):
+    return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+
+def bulk_insert(model, objs, batch_size=5000):
+    for start in range(0, len(objs), batch_size):
+        model.objects.bulk_create(objs[start:start + batch_size])
+
+
+COLOURS = ['red', 'black', 'blue', 'green', 'white', 'grey', 'navy', 'olive',
+           'maroon', 'beige', 'yellow', 'pink']
+MATERIALS = ['denim', 'cotton', 'linen', 'leather', 'wool', 'silk', 'canvas',
+             'suede', 'nylon', 'bamboo', 'steel', 'ceramic', 'oak']
+PRODUCTS = ['shirt', 'jacket', 'trousers', 'skates', 'sneakers', 'hoodie',
+            'sweater', 'mirror', 'lamp', 'fan', 'kettle', 'mug', 'chair',
+            'table', 'backpack', 'wallet', 'scarf', 'toothpaste', 'blender',
+            'pillow', 'curtain', 'rug', 'watch', 'belt', 'cap']
+
+
+def synthetic_text(n):
+    colour = COLOURS[n % len(COLOURS)]
+    material = MATERIALS[n // len(COLOURS) % len(MATERIALS)]
+    product = PRODUCTS[n // (len(COLOURS) * len(MATERIALS)) % len(PRODUCTS)]
+    title = f'{colour.title()} {material.title()} {product.title()} {n}'
+    description = (f'A {colour} {product} made from {material}. Model {n} '
+                   f'from the {MATERIALS[n % len(MATERIALS)]} collection.')
+    return title, description
+
+
+def seed_catalog(count, categories=20):
+    """Add ``count`` items named bench-item-<id>; returns their ids."""
+    category_ids = []
+    for n in range(categories):
+        category_ids.append(
+            Category.objects.get_or_create(name=f'Bench category {n}')[0].pk)
+    first = next_id(Item)
+    ids = range(first, first + count)
+    bulk_insert(Item, [
+        Item(id=pk, title=synthetic_text(pk)[0], slug=f'bench-item-{pk}',
+             price=100 + pk % 900, discount_price=(90 + pk % 800) if pk % 3 else None,
+             description=synthetic_text(pk)[1],
+             category_id=category_ids[pk % categories],
+             label='PSD'[pk % 3])
+        for pk in ids])
+    return list(ids)
+
+
+def seed_coupons(count):
+    first = next_id(Coupon)
+    ids = range(first, first + count)
+    bulk_insert(Coupon, [
+        Coupon(id=pk, code=f'BENCH{pk}', amount=pk % 50) for pk in ids])
+    return list(ids)
+
+
+def seed_shoppers(count, item_ids, history=9):
+    """
+    Add ``count`` users, each with ``history`` completed single-line orders
+    and one open cart. Returns the new user ids.
+    """
+    first_user = next_id(User)
+    user_ids = range(first_user, first_user + count)
+    bulk_insert(User, [
+        User(id=pk, username=f'bench-user-{pk}', password='!') for pk in user_ids])
+
+    orders, lines, links = [], [], []
+    order_id, line_id = next_id(Order), next_id(OrderItem)
+    Link = Order.items.through
+    for user_id in user_ids:
+        for n in range(history + 1):
+            ordered = n < history
+            item_id = item_ids[(user_id * 7 + n) % len(item_ids)]
+            lines.append(OrderItem(
+                id=line_id, user_id=user_id, item_id=item_id, ordered=ordered))
+            orders.append(Order(
+                id=order_id, user_id=user_id, ordered=ordered,
+                ref_code=f'bench{order_id:015d}' if ordered else ''))
+            links.append(Link(order_id=order_id, orderitem_id=line_id))
+            order_id += 1
+            line_id += 1
+    bulk_insert(OrderItem, lines)
+    bulk_insert(Order, orders)
+    bulk_insert(Link, links)
+    return list(user_ids)
+
+
+def seed_open_orders(count, item_ids, lines):
+    """
+    Add ``count`` users, each with an open order of ``lines`` distinct items.
+    Returns ``[(order id, user id)]``.
+    """
+    first_user = next_id(User)
+    user_ids = range(first_user, first_user + count)
+    bulk_insert(User, [
+        User(id=pk, username=f'bench-user-{pk}', password='!') for pk in user_ids])
+
+    order_id, line_id = next_id(Order), next_id(OrderItem)
+    orders, order_lines, links = [], [], []
+    Link = Order.items.through
+    for user_id in user_ids:
+        orders.append(Order(id=order_id, user_id=user_id, ordered=False,
+                            subtotal=lines * 100, total=lines * 100))
+        for item_id in item_ids[:lines]:
+            order_lines.append(OrderItem(id=line_id, user_id=user_id, item_id=item_id))
+            links.append(Link(order_id=order_id, orderitem_id=line_id))
+            line_id += 1
+        order_id += 1
+    bulk_insert(OrderItem, order_lines)
+    bulk_insert(Order, orders)
+    bulk_insert(Link, links)
+    return [(order.id, order.user_id) for order in orders]
+
+
+# One shopper's visit, in order: (step, method, URL name, URL argument).
+# 'slug' stands for the slug of the item the shopper buys.
+STOREFRONT_FLOW = [
+    ('home', 'get', 'home', None),
+    ('shop', 'get', 'shop', None),
+    ('detail', 'get', 'detail', 'slug'),
+    ('add_to_cart', 'get', 'add_to_cart', 'slug'),
+    ('order_summary', 'get', 'order_summary', None),
+    ('checkout', 'get', 'checkout', None),
+    ('checkout_address', 'post', 'checkout', None),
+    ('payment', 'post', 'payment', 'stripe'),
+    ('profile', 'get', 'profile', None),
+]
+
+STEP_DATA = {
+    'checkout_address': {
+        'street_address': '1 Bench Street', 'apartment_address': 'Flat 2',
+        'country': 'KE', 'zip': '00100', 'payment_option': 'S',
+    },
+}
+
+
+def step_succeeded(step, response, user_id):
+    if step == 'payment':
+        return not Order.objects.filter(user_id=user_id, ordered=False).exists()
+    expected = 302 if step in ('add_to_cart', 'checkout_address') else 200
+    return response.status_code == expected
+
+
+def run_storefront_flows(user_ids, item_ids, flows, warmup=0):
+    """
+    Walk ``flows`` shoppers (cycling through ``user_ids``) through
+    STOREFRONT_FLOW with the test client, so every request goes through
+    the URLconf, middleware and templates. Returns, per step, the latency
+    samples, queries per request and failed requests, and the wall time of
+    the recorded flows.
+    """
+    steps = {step: {'samples': [], 'queries': [], 'errors': 0}
+             for step, *_ in STOREFRONT_FLOW}
+    users = User.objects.in_bulk(user_ids)
+    elapsed = 0
+    for n in range(warmup + flows):
+        user_id = user_ids[n % len(user_ids)]
+        item = Item.objects.only('slug').get(pk=item_ids[n * 7 % len(item_ids)])
+        client = Client()
+        client.force_login(users[user_id])
+        for step, method, url_name, arg in STOREFRONT_FLOW:
+            url = reverse(url_name, args=[] if arg is None else [
+                item.slug if arg == 'slug' else arg])
+            data = STEP_DATA.get(step)
+            if step == 'payment':
+                # A fresh card token per visit: PaymentView takes a reused
+                # one for a double submitted form.
+                data = {'stripeToken': f'tok_bench_{n}'}
+            # Keep the capture clear of the 9000 entry log cap.
+            connection.queries_log.clear()
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = getattr(client, method)(url, data)
+                latency = time.perf_counter() - start
+            if n < warmup:
+                continue
+            elapsed += latency
+            steps[step]['samples'].append(latency)
+            steps[step]['queries'].append(len(captured))
+            steps[step]['errors'] += not step_succeeded(step, response, user_id)
+    return steps, elapsed
+
+
+def storefront_report(scale, steps, elapsed):
+    report = {'scale': scale, 'throughput': scale['flows'] / elapsed, 'steps': {}}
+    for step, measured in steps.items():
+        stats = summarize(measured['samples'])
+        report['steps'][step] = {
+            'throughput': stats['count'] / sum(measured['samples']),
+            'p50': stats['p50'], 'p95': stats['p95'], 'p99': stats['p99'],
+            'queries': sum(measured['queries']) / stats['count'],
+            'max_queries': max(measured['queries']),
+            'errors': measured['errors'],
+        }
+    return report
+
+
+def regressions(report, baseline, tolerance):
+    """
+    What got worse than ``baseline``: any step running more queries per
+    request, or slower than its baseline p95 or throughput by more than
+    ``tolerance`` (a fraction).
+    """
+    found = []
+    if report['throughput'] < baseline['throughput'] * (1 - tolerance):
+        found.append(f"throughput fell from {baseline['throughput']:.1f} "
+                     f"to {report['throughput']:.1f} flows/s")
+    for step, before in baseline['steps'].items():
+        after = report['steps'].get(step)
+        if after is None:
+            continue
+        if after['errors'] > before['errors']:
+            found.append(f"{step}: {after['errors']} failed requests")
+        # Query counts are deterministic at a given scale: any increase counts.
+        if after['queries'] > before['queries'] + 1e-6:
+            found.append(f"{step}: {before['queries']:.2f} -> {after['queries']:.2f} "
+                         f"queries per request")
+        if after['p95'] > before['p95'] * (1 + tolerance):
+            found.append(f"{step}: p95 {before['p95'] * 1e3:.2f}ms -> "
+                         f"{after['p95'] * 1e3:.2f}ms")
+    return found
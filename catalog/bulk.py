@@ -0,0 +1,120 @@
+"""
+Admin actions that scale to any selection.
+
+The admin action itself only stores the selected ids on a BulkJob and
+queues it. The task worker then applies the change a chunk of
+BULK_ACTION_CHUNK_SIZE rows at a time. Each chunk runs in its own short
+transaction, which changes the rows, appends their audit entries, queues
+any follow-up work and advances the job's progress. No lock is held across
+the whole selection, and a worker that dies resumes after the last
+committed chunk.
+"""
+import json
+
+from django.conf import settings
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.html import format_html
+
+from . import reporting
+from .audit import record
+from .models import BulkJob, Order
+from .orders import refund_order
+from .tasks import enqueue, enqueue_many, task
+
+ACTIONS = {}
+
+
+class BulkAction:
+    """
+    Set ``changes`` on the selected rows of ``model``. Only rows matching
+    ``pending`` (by default: rows not already carrying the changes) are
+    touched and audited, and ``then(ids)`` is called with those ids inside
+    the chunk's transaction.
+    """
+
+    def __init__(self, name, description, model, changes, pending=None, then=None):
+        self.name = name
+        self.description = description
+        self.model = model
+        self.changes = changes
+        self.pending = pending
+        self.then = then
+
+    def apply(self, ids, job):
+        rows = self.model.objects.filter(pk__in=ids)
+        rows = rows.filter(**self.pending) if self.pending else rows.exclude(**self.changes)
+        changed = list(rows.select_for_update().values_list('pk', flat=True))
+        if changed:
+            self.model.objects.filter(pk__in=changed).update(**self.changes)
+            record(self.name, self.model, changed, actor_id=job.actor_id,
+                   job_id=job.pk, **self.changes)
+            if self.then:
+                self.then(changed)
+        return len(changed)
+
+    def admin_action(self):
+        def action(modeladmin, request, queryset):
+            job = start(self, queryset, request.user)
+            modeladmin.message_user(request, format_html(
+                'Queued "{}" for {} rows. <a href="{}">Follow its progress</a>.',
+                self.description, job.total,
+                reverse('admin:catalog_bulkjob_change', args=[job.pk])))
+
+        action.__name__ = self.name
+        action.short_description = self.description
+        return action
+
+
+def register(action):
+    ACTIONS[action.name] = action
+    return action
+
+
+def start(action, queryset, actor):
+    ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+    with transaction.atomic():
+        job = BulkJob.objects.create(
+            action=action.name, actor=actor, object_ids=json.dumps(ids), total=len(ids))
+        enqueue(run_bulk_job, job_id=job.pk)
+    return job
+
+
+@task
+def run_bulk_job(job_id):
+    job = BulkJob.objects.get(pk=job_id)
+    if job.status == BulkJob.DONE:
+        return
+    action = ACTIONS[job.action]
+    ids = json.loads(job.object_ids)
+    job.status = BulkJob.RUNNING
+    job.save(update_fields=['status'])
+    try:
+        while job.processed < job.total:
+            chunk = ids[job.processed:job.processed + settings.BULK_ACTION_CHUNK_SIZE]
+            with transaction.atomic():
+                job.changed += action.apply(chunk, job)
+                job.processed += len(chunk)
+                job.save(update_fields=['processed', 'changed'])
+    except Exception:
+        # The task is retried and picks up after the last committed chunk.
+        BulkJob.objects.filter(pk=job.pk).update(status=BulkJob.FAILED)
+        raise
+    job.status = BulkJob.DONE
+    job.finished = timezone.now()
+    job.save(update_fields=['status', 'finished'])
+
+
+def refunds_granted(order_ids):
+    reporting.refunds_granted(order_ids)
+    enqueue_many(refund_order, [{'order_id': order_id} for order_id in order_ids])
+
+
+grant_refunds = register(BulkAction(
+    'refund_accepted', 'Update to Refund granted', Order,
+    {'refund_requested': False, 'refund_granted': True},
+    pending={'refund_requested': True, 'refund_granted': False, 'ordered': True},
+    then=refunds_granted))
+mark_received = register(BulkAction(
+    'received', 'Update to Received', Order, {'received': True}))
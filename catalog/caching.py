@@ -0,0 +1,99 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from .cart import SessionCart
+from .metrics import count_cache_lookup
+
+CATALOG_VERSION_KEY = 'catalog_version'
+CATALOG_CHANGED_KEY = 'catalog_changed'
+
+
+def get_catalog_version():
+    # Every catalog cache key embeds this number; bumping it retires all of
+    # them at once instead of tracking which pages showed which rows.
+    cache.add(CATALOG_VERSION_KEY, 1, None)
+    return cache.get(CATALOG_VERSION_KEY, 1)
+
+
+def bump_catalog_version():
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.add(CATALOG_VERSION_KEY, 2, None)
+    # Until replicas have caught up with the change, catalog pages are read
+    # from the default database (see catalog.routers).
+    cache.set(CATALOG_CHANGED_KEY, time.time(), settings.DATABASE_REPLICA_PIN_SECONDS)
+
+
+def catalog_recently_changed():
+    return cache.get(CATALOG_CHANGED_KEY) is not None
+
+
+def catalog_key(*parts):
+    return ':'.join(['catalog', str(get_catalog_version()), *map(str, parts)])
+
+
+def get_or_set_catalog(key_parts, default):
+    key = catalog_key(*key_parts)
+    value = cache.get(key)
+    count_cache_lookup('lookup', value is not None)
+    if value is None:
+        value = default() if callable(default) else default
+        cache.set(key, value, settings.CATALOG_CACHE_TIMEOUT)
+    return value
+
+
+def is_anonymous_page_view(request):
+    # Only visitors whose page holds nothing personal share cached copies:
+    # anonymous, with an empty session cart and no flash messages.
+    return (
+        request.method in ('GET', 'HEAD')
+        and not request.user.is_authenticated
+        and not SessionCart(request.session)
+        and not get_messages(request)
+    )
+
+
+def page_cache_key(full_path):
+    return catalog_key('page', hashlib.md5(full_path.encode()).hexdigest())
+
+
+def cached_page(full_path):
+    """``(content, content_type)`` of the cached anonymous copy of a page."""
+    return cache.get(page_cache_key(full_path))
+
+
+def cache_catalog_page(view):
+    """
+    Full-page cache for anonymous catalog pages, keyed on the URL and the
+    catalog version. Cached copies are served without touching the ORM or
+    the template engine.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not is_anonymous_page_view(request):
+            return view(request, *args, **kwargs)
+
+        key = page_cache_key(request.get_full_path())
+        cached = cache.get(key)
+        count_cache_lookup('page', cached is not None)
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render'):
+            # Generic views return TemplateResponses, rendered only later.
+            response.render()
+        if response.status_code == 200 and not response.cookies \
+                and not request.META.get('CSRF_COOKIE_USED'):
+            cache.set(key, (response.content, response['Content-Type']),
+                      settings.CATALOG_CACHE_TIMEOUT)
+        return response
+    return wrapper
@@ -0,0 +1,219 @@
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.functional import cached_property
+
+from .models import Item, Order, OrderItem
+from .stock import release, reserve
+
+
+class CartError(Exception):
+    pass
+
+
+class NoActiveOrder(CartError):
+    pass
+
+
+class ItemNotInCart(CartError):
+    pass
+
+
+SESSION_CART_KEY = 'cart'
+
+
+class SessionCartLines:
+    # Quacks like the Order.items manager for cart.html.
+    def __init__(self, lines):
+        self.lines = lines
+
+    def all(self):
+        return self.lines
+
+    def count(self):
+        return len(self.lines)
+
+
+class SessionCart:
+    """
+    Cart for anonymous shoppers, kept as {item id: quantity} in the session
+    so browsing never writes to the catalog tables. merge_session_cart()
+    moves it into the shopper's open Order when they log in.
+    """
+
+    coupon = None
+    ordered_date = None
+
+    def __init__(self, session):
+        self.session = session
+        self.quantities = session.get(SESSION_CART_KEY, {})
+
+    def __bool__(self):
+        return bool(self.quantities)
+
+    def save(self):
+        self.session[SESSION_CART_KEY] = self.quantities
+        self.session.modified = True
+
+    def clear(self):
+        self.session.pop(SESSION_CART_KEY, None)
+        self.quantities = {}
+
+    def add(self, item):
+        key = str(item.pk)
+        self.quantities[key] = self.quantities.get(key, 0) + 1
+        self.save()
+        return self.quantities[key]
+
+    def remove(self, item, quantity=1):
+        key = str(item.pk)
+        if key not in self.quantities:
+            raise ItemNotInCart
+        if quantity is None or quantity >= self.quantities[key]:
+            del self.quantities[key]
+        else:
+            self.quantities[key] -= quantity
+        self.save()
+        return self.quantities.get(key, 0)
+
+    def count(self):
+        return len(self.quantities)
+
+    @cached_property
+    def items(self):
+        # Unsaved OrderItems so the cart templates render them unchanged.
+        items = Item.objects.select_related('category').in_bulk(
+            [int(pk) for pk in self.quantities])
+        return SessionCartLines([
+            OrderItem(item=items[int(pk)], quantity=quantity)
+            for pk, quantity in self.quantities.items() if int(pk) in items
+        ])
+
+    def get_total(self):
+        return sum(line.get_item_final_price() for line in self.items.all())
+
+
+def cart_item_count_key(user):
+    return f'cart_item_count:{user.pk}'
+
+
+def get_cart_item_count(user):
+    if not user.is_authenticated:
+        return 0
+    return cache.get_or_set(
+        cart_item_count_key(user),
+        lambda: OrderItem.objects.filter(
+            order__user=user, order__ordered=False).count())
+
+
+def invalidate_cart_item_count(user):
+    cache.delete(cart_item_count_key(user))
+
+
+def lock_open_order(user, create=False):
+    # Row lock on the open order: every cart mutation for a user takes it
+    # first, so their read-modify-write cycles run one at a time. The
+    # unique_open_order_per_user constraint settles racing creates.
+    try:
+        return Order.objects.select_for_update().get(user=user, ordered=False)
+    except ObjectDoesNotExist:
+        if not create:
+            raise NoActiveOrder
+    try:
+        with transaction.atomic():
+            return Order.objects.create(user=user, ordered=False)
+    except IntegrityError:
+        return Order.objects.select_for_update().get(user=user, ordered=False)
+
+
+def get_or_create_line(user, item):
+    try:
+        with transaction.atomic():
+            return OrderItem.objects.get_or_create(
+                user=user, item=item, ordered=False)[0]
+    except IntegrityError:
+        return OrderItem.objects.get(user=user, item=item, ordered=False)
+
+
+def add_item(user, item):
+    """
+    Add one ``item`` to the user's open order, creating the order or line as
+    needed, and reserve the unit if the item is stock tracked (OutOfStock
+    if there is none left). Returns ``(order, line)`` with the stored
+    quantity and totals.
+    """
+    with transaction.atomic():
+        order = lock_open_order(user, create=True)
+        reserve(user, item)
+        line = order.items.filter(item=item).first()
+        new_line = line is None
+        if new_line:
+            line = get_or_create_line(user, item)
+            order.items.add(line)
+            order.adjust_totals(line.quantity * item.get_final_price())
+        else:
+            OrderItem.objects.filter(pk=line.pk).update(quantity=F('quantity') + 1)
+            line.quantity += 1
+            order.adjust_totals(item.get_final_price())
+    if new_line:
+        invalidate_cart_item_count(user)
+    return order, line
+
+
+def remove_item(user, item, quantity=1):
+    """
+    Take ``quantity`` of ``item`` out of the open order, or the whole line if
+    ``quantity`` is None. A line that reaches zero is deleted. Returns
+    ``(order, line)``; ``line.quantity`` is 0 once the line is gone.
+    """
+    with transaction.atomic():
+        order = lock_open_order(user)
+        line = order.items.filter(item=item).first()
+        if line is None:
+            raise ItemNotInCart
+        if quantity is None or quantity >= line.quantity:
+            removed = line.quantity
+            line.delete()
+            line.quantity = 0
+        else:
+            removed = quantity
+            OrderItem.objects.filter(pk=line.pk).update(
+                quantity=F('quantity') - quantity)
+            line.quantity -= quantity
+        order.adjust_totals(-removed * item.get_final_price())
+        release(user, item, removed)
+    if line.quantity == 0:
+        invalidate_cart_item_count(user)
+    return order, line
+
+
+def merge_session_cart(session, user):
+    """
+    Fold the anonymous session cart into ``user``'s open order: existing
+    lines have their quantities bumped and missing ones are created, each in
+    a single bulk statement.
+    """
+    session_cart = SessionCart(session)
+    if not session_cart:
+        return None
+    quantities = {int(pk): quantity for pk, quantity in session_cart.quantities.items()}
+    item_ids = set(Item.objects.filter(pk__in=quantities).values_list('pk', flat=True))
+
+    with transaction.atomic():
+        order = lock_open_order(user, create=True)
+        lines = OrderItem.objects.filter(user=user, ordered=False, item__in=item_ids)
+        existing = list(lines)
+        for line in existing:
+            line.quantity += quantities[line.item_id]
+        OrderItem.objects.bulk_update(existing, ['quantity'])
+        OrderItem.objects.bulk_create([
+            OrderItem(user=user, item_id=item_id, quantity=quantities[item_id])
+            for item_id in item_ids - {line.item_id for line in existing}
+        ])
+        order.items.add(*lines.all())
+        order.reconcile_totals()
+
+    session_cart.clear()
+    invalidate_cart_item_count(user)
+    return order
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+
+from .caching import get_catalog_version
+from .cart import SessionCart, get_cart_item_count
+
+
+def cart(request):
+    def cart_item_count():
+        if request.user.is_authenticated:
+            return get_cart_item_count(request.user)
+        return SessionCart(request.session).count()
+
+    # Lazy so pages that never render the navbar badge never look it up.
+    return {
+        'cart_item_count': SimpleLazyObject(cart_item_count),
+    }
+
+
+def catalog(request):
+    # For {% cache %} blocks of catalog data: vary on the catalog version.
+    return {
+        'catalog_version': SimpleLazyObject(get_catalog_version),
+        'CATALOG_CACHE_TIMEOUT': settings.CATALOG_CACHE_TIMEOUT,
+    }
@@ -0,0 +1,114 @@
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+
+class FakeStripe:
+    """
+    Local stand-in for the parts of the Stripe API checkout uses, for tests
+    and for exercising timeouts and outages by hand. Point STRIPE_API_BASE
+    at ``url``.
+
+    ``fail(status, times)`` makes the next calls answer with an error status
+    and ``delay`` stalls every response. The ``tok_chargeDeclined`` test
+    token is declined like on Stripe. Replayed idempotency keys get the
+    original response.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.delay = 0
+        self.failures = deque()
+        self.responses = {}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def fail(self, status, times=1):
+        self.failures.extend([status] * times)
+
+    def calls(self, path=None):
+        return [r for r in self.requests if path is None or r['path'] == path]
+
+    def respond(self, path, params, headers, client_address):
+        with self.lock:
+            self.requests.append({'path': path, 'params': params, 'headers': headers,
+                                  'client_address': client_address})
+            if self.failures:
+                status = self.failures.popleft()
+                return status, {'error': {
+                    'type': 'api_error', 'message': f'Fake failure {status}'}}
+            key = headers.get('Idempotency-Key')
+            if key and key in self.responses:
+                return self.responses[key]
+            count = len(self.requests)
+
+        if params.get('source') == 'tok_chargeDeclined':
+            response = 402, {'error': {
+                'type': 'card_error', 'code': 'card_declined',
+                'message': 'Your card was declined.'}}
+        elif path == '/v1/customers':
+            response = 200, {'id': f'cus_{count}', 'object': 'customer',
+                             'email': params.get('email')}
+        elif path == '/v1/charges':
+            response = 200, {'id': f'ch_{count}', 'object': 'charge',
+                             'amount': int(params['amount']), 'paid': True,
+                             'customer': params.get('customer')}
+        elif path == '/v1/refunds':
+            response = 200, {'id': f're_{count}', 'object': 'refund',
+                             'amount': int(params['amount']), 'charge': params['charge'],
+                             'status': 'succeeded'}
+        else:
+            response = 404, {'error': {
+                'type': 'invalid_request_error', 'message': f'No route {path}'}}
+        if key:
+            with self.lock:
+                self.responses[key] = response
+        return response
+
+    def handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                params = dict(parse_qsl(self.rfile.read(length).decode()))
+                status, body = fake.respond(
+                    self.path, params, dict(self.headers), self.client_address)
+                if fake.delay:
+                    time.sleep(fake.delay)
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                try:
+                    self.wfile.write(payload)
+                except OSError:
+                    # The client gave up waiting.
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
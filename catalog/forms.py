@@ -1,6 +1,8 @@
 from django import forms
 from django_countries.fields import CountryField
 from django_countries.widgets import CountrySelectWidget
+from .models import LABEL_CHOICES
+from .pagination import MAX_INT
 
 
 PAYMENT_CHOICES = (
@@ -8,6 +10,16 @@ PAYMENT_CHOICES = (
     ('P', 'Paypal'),
     ('M', 'M-pesa')
 )
+SORT_CHOICES = (
+    ('id', 'Oldest'),
+    ('-id', 'Newest'),
+    ('price', 'Price: low to high'),
+    ('-price', 'Price: high to low'),
+    ('-rating_average', 'Top rated'),
+    ('-rating_count', 'Most reviewed'),
+)
+SHOP_PAGE_SIZE = 12
+SHOP_MAX_PAGE_SIZE = 48
 
 
 class AddressForm(forms.Form):
@@ -36,3 +48,20 @@ class RefundForm(forms.Form):
     code = forms.CharField(max_length=20)
     email = forms.EmailField()
     reason = forms.CharField(widget=forms.Textarea())
+
+
+class ShopFilterForm(forms.Form):
+    sort = forms.ChoiceField(choices=SORT_CHOICES, required=False)
+    size = forms.IntegerField(min_value=1, required=False)
+    category = forms.IntegerField(min_value=1, max_value=MAX_INT, required=False)
+    label = forms.ChoiceField(choices=LABEL_CHOICES, required=False)
+    min_price = forms.IntegerField(min_value=0, max_value=MAX_INT, required=False)
+    max_price = forms.IntegerField(min_value=0, max_value=MAX_INT, required=False)
+    min_rating = forms.IntegerField(min_value=1, max_value=5, required=False)
+    after = forms.CharField(required=False)
+    before = forms.CharField(required=False)
+
+    def clean_size(self):
+        # Larger pages are served at the largest size, not refused.
+        size = self.cleaned_data['size']
+        return min(size, SHOP_MAX_PAGE_SIZE) if size else size
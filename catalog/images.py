@@ -0,0 +1,102 @@
+import hashlib
+import logging
+import posixpath
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_DIR = 'derivatives'
+DERIVATIVE_WIDTHS = (80, 160, 320, 640, 1280)
+DERIVATIVE_FORMATS = {
+    # format: (extension, Pillow save options)
+    'webp': ('webp', {'quality': 78, 'method': 4}),
+    'jpeg': ('jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+DIGEST_LENGTH = 12
+
+
+def file_digest(fileobj):
+    sha = hashlib.sha256()
+    for chunk in iter(lambda: fileobj.read(64 * 1024), b''):
+        sha.update(chunk)
+    return sha.hexdigest()[:DIGEST_LENGTH]
+
+
+def derivative_name(source_name, digest, width, fmt):
+    # product_images/denim.jpg -> derivatives/product_images/denim.3f2a9c0d1e4b.320w.webp
+    # The digest changes with the source bytes, so derivatives can be served
+    # with far-future cache headers and a re-upload never shows a stale copy.
+    stem = posixpath.splitext(source_name)[0]
+    return (f'{DERIVATIVE_DIR}/{stem}.{digest}.{width}w.'
+            f'{DERIVATIVE_FORMATS[fmt][0]}')
+
+
+def derivative_url(source_name, digest, width, fmt):
+    return default_storage.url(derivative_name(source_name, digest, width, fmt))
+
+
+def render_derivative(image, width, fmt):
+    if image.width > width:
+        height = round(image.height * width / image.width)
+        image = image.resize((width, height), Image.LANCZOS)
+    if fmt == 'jpeg' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, fmt.upper(), **DERIVATIVE_FORMATS[fmt][1])
+    return buffer.getvalue()
+
+
+def generate_derivatives(source_name, storage=default_storage, force=False):
+    """
+    Write every width and format of ``source_name`` next to each other under
+    ``derivatives/`` and return the source digest their names embed. Widths
+    above the source are stored at the source size rather than upscaled.
+    """
+    with storage.open(source_name, 'rb') as source:
+        digest = file_digest(source)
+        source.seek(0)
+        image = ImageOps.exif_transpose(Image.open(source))
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+
+    for width in DERIVATIVE_WIDTHS:
+        for fmt in DERIVATIVE_FORMATS:
+            name = derivative_name(source_name, digest, width, fmt)
+            if storage.exists(name):
+                if not force:
+                    continue
+                storage.delete(name)
+            storage.save(name, ContentFile(render_derivative(image, width, fmt)))
+    return digest
+
+
+def safe_generate_derivatives(source_name, **kwargs):
+    # Pages fall back to the original file, so a broken or missing upload
+    # must not fail the save that triggered it.
+    storage = kwargs.get('storage', default_storage)
+    if not storage.exists(source_name):
+        return ''
+    try:
+        return generate_derivatives(source_name, **kwargs)
+    # DecompressionBombError is neither: Pillow refuses images too large
+    # to decode safely.
+    except (OSError, ValueError, Image.DecompressionBombError):
+        logger.warning('Could not generate derivatives of %s', source_name,
+                       exc_info=True)
+        return ''
+
+
+IMAGE_FIELDS = {
+    # model label: (image field, digest field)
+    'catalog.Item': ('image', 'image_digest'),
+    'catalog.Category': ('thumbnail', 'thumbnail_digest'),
+}
+
+
+def image_fields(model):
+    return IMAGE_FIELDS[model._meta.label]
@@ -0,0 +1,140 @@
+"""
+Drive the same URLs through different serving stacks and time them.
+
+In process, the WSGI handler, Django's ASGI handler and the ASGI handler
+behind CachedCatalogPages are called directly, leaving server overhead out
+of the comparison. ``run_http`` hits a real server instead, e.g. gunicorn
+for ecom.wsgi and uvicorn for ecom.asgi:django_application or
+ecom.asgi:application.
+"""
+import asyncio
+import http.client
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.test import RequestFactory
+
+HOST = 'localhost'
+
+
+class Result:
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.elapsed = 0
+        self.lock = threading.Lock()
+
+    def add(self, latency, ok):
+        with self.lock:
+            self.latencies.append(latency)
+            self.errors += not ok
+
+    @property
+    def throughput(self):
+        return len(self.latencies) / self.elapsed if self.elapsed else 0
+
+
+def schedule(paths, requests):
+    return list(itertools.islice(itertools.cycle(paths), requests))
+
+
+def run_threads(call, paths, requests, concurrency):
+    result = Result()
+
+    def timed(path):
+        start = time.perf_counter()
+        ok = call(path)
+        result.add(time.perf_counter() - start, ok)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(timed, schedule(paths, requests)))
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def run_wsgi(application, paths, requests, concurrency):
+    factory = RequestFactory(HTTP_HOST=HOST)
+
+    def call(path):
+        path, _, query = path.partition('?')
+        environ = factory._base_environ(
+            PATH_INFO=path, QUERY_STRING=query, REQUEST_METHOD='GET')
+        statuses = []
+        body = application(environ, lambda status, headers, exc_info=None:
+                           statuses.append(status))
+        try:
+            b''.join(body)
+        finally:
+            getattr(body, 'close', lambda: None)()
+        return statuses[0].startswith('200')
+
+    return run_threads(call, paths, requests, concurrency)
+
+
+def asgi_scope(path):
+    path, _, query = path.partition('?')
+    return {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'GET', 'scheme': 'http', 'path': path, 'root_path': '',
+        'query_string': query.encode(), 'headers': [(b'host', HOST.encode())],
+        'client': ('127.0.0.1', 0), 'server': (HOST, 80),
+    }
+
+
+async def asgi_request(application, path):
+    status = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await application(asgi_scope(path), receive, send)
+    return status == [200]
+
+
+def run_asgi(application, paths, requests, concurrency):
+    async def main():
+        result = Result()
+        queue = schedule(paths, requests)
+
+        async def worker():
+            while queue:
+                path = queue.pop()
+                start = time.perf_counter()
+                ok = await asgi_request(application, path)
+                result.add(time.perf_counter() - start, ok)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        result.elapsed = time.perf_counter() - start
+        return result
+
+    return asyncio.run(main())
+
+
+def run_http(base_url, paths, requests, concurrency):
+    parts = urlsplit(base_url)
+    local = threading.local()
+
+    def call(path):
+        # One keep-alive connection per client thread.
+        if getattr(local, 'conn', None) is None:
+            local.conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+        try:
+            local.conn.request('GET', parts.path.rstrip('/') + path)
+            response = local.conn.getresponse()
+            response.read()
+            return response.status == 200
+        except (OSError, http.client.HTTPException):
+            local.conn.close()
+            local.conn = None
+            return False
+
+    return run_threads(call, paths, requests, concurrency)
@@ -0,0 +1,68 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from catalog.benchmarks import rolled_back, seed_catalog, seed_open_orders, summarize
+from catalog.models import Order, Payment
+from catalog.orders import create_ref_code, finalize_order
+
+
+def per_line_finalize(order_id, user, charge_id, idempotency_key):
+    # The finalization PaymentView and payment_complete used to run inline.
+    order = Order.objects.get(pk=order_id, user=user, ordered=False)
+    payment = Payment.objects.create(
+        charge_id=charge_id, user=user, amount=order.get_total())
+    order_items = order.items.all()
+    order_items.update(ordered=True)
+    for item in order_items:
+        item.save()
+    order.ordered = True
+    order.payment = payment
+    order.ref_code = create_ref_code()
+    order.save()
+
+
+STRATEGIES = {
+    'per-line saves': per_line_finalize,
+    'finalize_order': finalize_order,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Time order finalization for orders of growing size, comparing "
+        "finalize_order with the old per-line saves. Rolled back afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', default='10,100,500',
+                            help='Comma separated order sizes.')
+        parser.add_argument('--orders', type=int, default=20,
+                            help='Orders finalized per size and strategy.')
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['lines'].split(','))
+        with rolled_back():
+            item_ids = seed_catalog(sizes[-1])
+            for size in sizes:
+                self.stdout.write(f"\n{size} lines per order")
+                for name, finalize in STRATEGIES.items():
+                    orders = seed_open_orders(options['orders'], item_ids, size)
+                    users = User.objects.in_bulk([user_id for _, user_id in orders])
+                    samples, queries = [], 0
+                    for order_id, user_id in orders:
+                        # Keep the capture clear of the 9000 entry log cap.
+                        connection.queries_log.clear()
+                        with CaptureQueriesContext(connection) as captured:
+                            start = time.perf_counter()
+                            finalize(order_id, users[user_id], f'ch_{order_id}',
+                                     f'bench:{order_id}')
+                            samples.append(time.perf_counter() - start)
+                        queries = len(captured)
+                    stats = summarize(samples)
+                    self.stdout.write(
+                        f"  {name:<16} {queries:5} queries"
+                        f"  p50 {stats['p50'] * 1e3:8.2f}ms"
+                        f"  p95 {stats['p95'] * 1e3:8.2f}ms")
@@ -0,0 +1,77 @@
+import random
+
+from django.core.management.base import BaseCommand
+
+from catalog.benchmarks import (
+    rolled_back, seed_catalog, seed_coupons, seed_shoppers, summarize, time_calls
+)
+from catalog.models import Coupon, Item, Order, OrderItem
+
+
+ACCESS_PATHS = {
+    'open order by user': lambda user_id, item_id: Order.objects.filter(
+        user=user_id, ordered=False),
+    'open line by user and item': lambda user_id, item_id: OrderItem.objects.filter(
+        item=item_id, user=user_id, ordered=False),
+    'item by slug': lambda slug: Item.objects.filter(slug=slug),
+    'order by ref_code': lambda ref_code: Order.objects.filter(
+        ref_code=ref_code, ordered=True),
+    'coupon by code': lambda code: Coupon.objects.filter(code=code),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the cart, product, refund and coupon lookups as the tables grow. "
+        "All seeded rows are rolled back afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='10000,100000,1000000',
+            help='Comma separated row counts to grow the tables to.')
+        parser.add_argument(
+            '--samples', type=int, default=500,
+            help='Lookups timed per access path and size.')
+        parser.add_argument(
+            '--explain', action='store_true',
+            help='Print the query plan of each lookup.')
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        samples = options['samples']
+        pick = random.Random(0)
+        item_ids, user_ids, coupon_ids = [], [], []
+
+        with rolled_back():
+            for size in sizes:
+                # Every user brings ten orders and lines, so each table
+                # reaches roughly ``size`` rows.
+                item_ids += seed_catalog(size - len(item_ids))
+                coupon_ids += seed_coupons(size - len(coupon_ids))
+                user_ids += seed_shoppers(size // 10 - len(user_ids), item_ids)
+
+                users = [pick.choice(user_ids) for _ in range(samples)]
+                open_lines = dict(OrderItem.objects.filter(
+                    ordered=False, user__in=users).values_list('user', 'item'))
+                refs = list(Order.objects.filter(
+                    ordered=True, user__in=users).values_list('ref_code', flat=True))
+                arguments = {
+                    'open order by user': [(u, open_lines[u]) for u in users],
+                    'open line by user and item': [(u, open_lines[u]) for u in users],
+                    'item by slug': [
+                        (f'bench-item-{pick.choice(item_ids)}',) for _ in range(samples)],
+                    'order by ref_code': [(pick.choice(refs),) for _ in range(samples)],
+                    'coupon by code': [
+                        (f'BENCH{pick.choice(coupon_ids)}',) for _ in range(samples)],
+                }
+
+                self.stdout.write(f"\n{size} rows per table")
+                for name, lookup in ACCESS_PATHS.items():
+                    stats = summarize(time_calls(
+                        lambda *args: lookup(*args).first(), arguments[name]))
+                    self.stdout.write(
+                        f"  {name:<28} p50 {stats['p50'] * 1e6:8.1f}us"
+                        f"  p95 {stats['p95'] * 1e6:8.1f}us")
+                    if options['explain']:
+                        plan = lookup(*arguments[name][0]).explain()
+                        self.stdout.write('    ' + plan.replace('\n', '\n    '))
@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog.benchmarks import rolled_back, seed_catalog, summarize, time_calls
+from catalog.models import Item
+from catalog.search import index_items, search, suggest
+
+QUERIES = [
+    'red', 'denim shirt', 'black leather jacket', 'wool', 'navy cotton sweater',
+    'sk', 'gre', 'linen tro', 'ceramic mug 42', 'bamboo',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a synthetic catalog, build the search index over it and time "
+        "searches and suggestions. Everything is rolled back afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with rolled_back():
+            start = time.perf_counter()
+            item_ids = seed_catalog(options['items'])
+            self.stdout.write(
+                f"Seeded {len(item_ids)} items in {time.perf_counter() - start:.1f}s")
+
+            start = time.perf_counter()
+            entries = 0
+            items = Item.objects.select_related('category').filter(pk__in=item_ids)
+            for offset in range(0, len(item_ids), 5000):
+                chunk = item_ids[offset:offset + 5000]
+                entries += index_items(items.filter(pk__range=(chunk[0], chunk[-1])))
+            self.stdout.write(
+                f"Indexed {entries} entries in {time.perf_counter() - start:.1f}s")
+
+            for name, fn in [('search', search), ('suggest', suggest)]:
+                for query in QUERIES:
+                    stats = summarize(time_calls(fn, [(query,)] * options['repeat']))
+                    self.stdout.write(
+                        f"  {name:<8} {query!r:<26} {len(fn(query)):3} hits"
+                        f"  p50 {stats['p50'] * 1e3:7.2f}ms"
+                        f"  p95 {stats['p95'] * 1e3:7.2f}ms")
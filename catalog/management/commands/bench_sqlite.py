@@ -0,0 +1,133 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from catalog.benchmarks import seed_catalog, summarize
+
+ENGINES = {
+    'journal': 'django.db.backends.sqlite3',
+    'wal': 'catalog.backends.sqlite3',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare Django's stock SQLite backend (rollback journal, deferred "
+        "transactions) with catalog.backends.sqlite3 (WAL, BEGIN IMMEDIATE) "
+        "under concurrent shoppers: writers adding to and removing from their "
+        "carts through the cart views while readers load product pages and "
+        "carts. Each backend runs in its own process on a fresh database file.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8)
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--seconds', type=float, default=10)
+        parser.add_argument('--engines', default=','.join(ENGINES),
+                            help='Comma separated, any of: ' + ', '.join(ENGINES))
+        parser.add_argument('--run', action='store_true',
+                            help='Run one measurement against the configured database '
+                                 'and print it as JSON.')
+
+    def handle(self, *args, **options):
+        if options['run']:
+            self.stdout.write(json.dumps(self.measure(options)))
+            return
+
+        engines = options['engines'].split(',')
+        unknown = set(engines) - set(ENGINES)
+        if unknown:
+            raise CommandError(f"Unknown engines: {', '.join(sorted(unknown))}")
+        self.stdout.write(
+            f"{options['writers']} writers, {options['readers']} readers, "
+            f"{options['seconds']}s per backend")
+        for name in engines:
+            with tempfile.TemporaryDirectory() as directory:
+                env = {**os.environ, 'DB_ENGINE': ENGINES[name],
+                       'DB_NAME': os.path.join(directory, 'bench.sqlite3')}
+                manage = [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py')]
+                subprocess.run([*manage, 'migrate', '--no-input', '-v0'], env=env, check=True)
+                output = subprocess.run(
+                    [*manage, 'bench_sqlite', '--run',
+                     f"--writers={options['writers']}", f"--readers={options['readers']}",
+                     f"--seconds={options['seconds']}"],
+                    env=env, check=True, stdout=subprocess.PIPE, text=True).stdout
+            result = json.loads(output)
+            for kind in ('writes', 'reads'):
+                stats = result[kind]
+                self.stdout.write(
+                    f"  {name:<8} {kind:<6} {stats['throughput']:8.1f} req/s"
+                    f"  p50 {stats['p50'] * 1e3:8.2f}ms"
+                    f"  p95 {stats['p95'] * 1e3:8.2f}ms"
+                    f"  p99 {stats['p99'] * 1e3:8.2f}ms"
+                    f"  locked {stats['locked']}")
+
+    def measure(self, options):
+        item_ids = seed_catalog(20, categories=4)
+        slugs = [f'bench-item-{pk}' for pk in item_ids]
+        users = [User.objects.create(username=f'bench-user-{n}', password='!')
+                 for n in range(options['writers'] + options['readers'])]
+        connection.close()
+        # Counted below rather than logged with a traceback each.
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+
+        deadline = time.perf_counter() + options['seconds']
+        results = {'writes': ([], [0]), 'reads': ([], [0])}
+        lock = threading.Lock()
+
+        def shopper(n):
+            client = Client()
+            client.force_login(users[n])
+            writer = n < options['writers']
+            samples, locked = results['writes' if writer else 'reads']
+            step = 0
+            try:
+                while time.perf_counter() < deadline:
+                    slug = slugs[(n + step) % len(slugs)]
+                    if writer:
+                        name = 'add_to_cart' if step % 2 == 0 else 'remove_single_from_cart'
+                        url = reverse(name, args=[slug])
+                    else:
+                        url = reverse('detail', args=[slug]) if step % 2 else reverse('api_cart')
+                    start = time.perf_counter()
+                    try:
+                        client.get(url)
+                    except OperationalError:
+                        # "database is locked": the request failed outright.
+                        with lock:
+                            locked[0] += 1
+                    else:
+                        with lock:
+                            samples.append(time.perf_counter() - start)
+                    step += 1
+            finally:
+                connection.close()
+
+        isolated = override_settings(
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                'LOCATION': 'bench-sqlite'}},
+        )
+        with isolated, ThreadPoolExecutor(len(users)) as pool:
+            start = time.perf_counter()
+            list(pool.map(shopper, range(len(users))))
+            elapsed = time.perf_counter() - start
+
+        report = {}
+        for kind, (samples, locked) in results.items():
+            stats = summarize(samples) if samples else {'p50': 0, 'p95': 0, 'p99': 0}
+            report[kind] = {'throughput': len(samples) / elapsed, 'locked': locked[0],
+                            'p50': stats['p50'], 'p95': stats['p95'], 'p99': stats['p99']}
+        return report
@@ -0,0 +1,89 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
+
+from catalog.benchmarks import summarize
+from catalog.loadtest import Result
+from catalog.models import Item, Stock
+
+
+def locked_read_modify_write(item_id):
+    # Read the row under a lock, check in Python, write it back.
+    with transaction.atomic():
+        stock = Stock.objects.select_for_update().get(pk=item_id)
+        if stock.available < 1:
+            return False
+        stock.reserved += 1
+        stock.save(update_fields=['reserved'])
+        return True
+
+
+def conditional_update(item_id):
+    # What catalog.stock.reserve does: check and increment in one statement.
+    return bool(Stock.objects.filter(
+        pk=item_id, on_hand__gte=F('reserved') + 1,
+    ).update(reserved=F('reserved') + 1))
+
+
+STRATEGIES = {
+    'select_for_update': locked_read_modify_write,
+    'conditional UPDATE': conditional_update,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Race many threads for the last units of one item, comparing a locked "
+        "read-modify-write with a conditional UPDATE. The benchmark item is "
+        "committed so every thread sees it, and deleted afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--units', type=int, default=100,
+                            help='Units on hand at the start of each run.')
+        parser.add_argument('--attempts', type=int, default=400,
+                            help='Purchase attempts per run.')
+        parser.add_argument('--threads', type=int, default=16)
+
+    def attempt(self, buy, item_id, result):
+        start = time.perf_counter()
+        try:
+            sold = buy(item_id)
+        except DatabaseError:
+            sold = None
+        finally:
+            connection.close()
+        result.add(time.perf_counter() - start, sold is not None)
+        return sold
+
+    def handle(self, *args, **options):
+        item = Item.objects.create(
+            title='Benchmark stock item', price=1, label='P',
+            slug=f'bench-stock-{time.time_ns()}', description='')
+        try:
+            self.stdout.write(
+                f"{options['attempts']} attempts on {options['units']} units, "
+                f"{options['threads']} threads")
+            for name, buy in STRATEGIES.items():
+                Stock.objects.update_or_create(
+                    item=item, defaults={'on_hand': options['units'], 'reserved': 0})
+                result = Result()
+                start = time.perf_counter()
+                with ThreadPoolExecutor(options['threads']) as pool:
+                    outcomes = list(pool.map(
+                        lambda _: self.attempt(buy, item.pk, result),
+                        range(options['attempts'])))
+                result.elapsed = time.perf_counter() - start
+                sold = outcomes.count(True)
+                reserved = Stock.objects.get(pk=item.pk).reserved
+                stats = summarize(result.latencies)
+                self.stdout.write(
+                    f"  {name:<20} {result.throughput:8.1f} attempts/s"
+                    f"  p50 {stats['p50'] * 1e3:7.2f}ms"
+                    f"  p95 {stats['p95'] * 1e3:7.2f}ms"
+                    f"  sold {sold}  oversold {max(0, reserved - options['units'])}"
+                    f"  lost updates {sold - reserved}  errors {result.errors}")
+        finally:
+            item.delete()
@@ -0,0 +1,97 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from catalog.benchmarks import (
+    regressions, rolled_back, run_storefront_flows, seed_catalog, seed_shoppers,
+    storefront_report,
+)
+from catalog.fake_stripe import FakeStripe
+
+# Machine specific, so not committed: record one with --save-baseline on
+# the machine the comparisons will run on, before the change to measure.
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'bench_storefront.json')
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a synthetic catalog, shoppers and order histories, walk shoppers "
+        "through home, shop, product, add to cart, cart, checkout, payment "
+        "(against a local Stripe stub) and profile, and report throughput, "
+        "latency and queries per request. Compares with a stored baseline and "
+        "fails on regressions; record the baseline on this machine first with "
+        "--save-baseline. Everything is rolled back afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=2000)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--history', type=int, default=9,
+                            help='Past orders per shopper.')
+        parser.add_argument('--flows', type=int, default=100,
+                            help='Shopper visits measured, after --warmup unmeasured ones.')
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                            help='JSON file to compare with, and to write with --save-baseline.')
+        parser.add_argument('--save-baseline', action='store_true',
+                            help='Store this run as the baseline instead of comparing.')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed slowdown in p95 and throughput, as a fraction.')
+
+    def handle(self, *args, **options):
+        scale = {name: options[name] for name in ('items', 'users', 'history', 'flows')}
+        baseline = None
+        if not options['save_baseline'] and os.path.exists(options['baseline']):
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            if baseline['scale'] != scale:
+                raise CommandError(
+                    f"{options['baseline']} was recorded at {baseline['scale']}; "
+                    f"run at that scale or pass --save-baseline.")
+
+        # The test client's host, and a cache of its own so cached pages and
+        # cart counts of the rolled back rows never reach the real one.
+        isolated = override_settings(
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+            CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'bench-storefront',
+            }},
+            EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+        )
+        with FakeStripe() as stripe_api, isolated, \
+                override_settings(STRIPE_API_BASE=stripe_api.url), rolled_back():
+            item_ids = seed_catalog(options['items'])
+            user_ids = seed_shoppers(options['users'], item_ids, options['history'])
+            steps, elapsed = run_storefront_flows(
+                user_ids, item_ids, options['flows'], options['warmup'])
+        report = storefront_report(scale, steps, elapsed)
+
+        self.stdout.write(
+            f"{options['flows']} shopper visits, {options['items']} items, "
+            f"{options['users']} shoppers with {options['history']} past orders: "
+            f"{report['throughput']:.1f} visits/s")
+        for step, stats in report['steps'].items():
+            self.stdout.write(
+                f"  {step:<17} {stats['throughput']:8.1f} req/s"
+                f"  p50 {stats['p50'] * 1e3:7.2f}ms"
+                f"  p95 {stats['p95'] * 1e3:7.2f}ms"
+                f"  p99 {stats['p99'] * 1e3:7.2f}ms"
+                f"  {stats['queries']:6.2f} queries (max {stats['max_queries']})"
+                f"  errors {stats['errors']}")
+
+        if options['save_baseline']:
+            with open(options['baseline'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+            self.stdout.write(self.style.SUCCESS(f"Saved the baseline to {options['baseline']}."))
+        elif baseline is None:
+            self.stdout.write(
+                f"No baseline at {options['baseline']}, nothing compared; run again with "
+                f"--save-baseline at the same scale to record one.")
+        else:
+            found = regressions(report, baseline, options['tolerance'])
+            if found:
+                raise CommandError('Regressed against the baseline:\n  ' + '\n  '.join(found))
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog import transfer
+
+
+class Command(BaseCommand):
+    help = (
+        "Write every item, category or coupon as CSV or JSON lines, in the "
+        "columns import_catalog reads back. Rows are streamed from the "
+        "database in chunks.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(transfer.EXPORTS))
+        parser.add_argument('-o', '--output', default='-', help="File to write, - for stdout.")
+        parser.add_argument('--format', choices=transfer.FORMATS,
+                            help='Defaults to the file extension, or csv on stdout.')
+        parser.add_argument('--chunk-size', type=int, default=transfer.EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['output']
+        fmt = options['format'] or ('csv' if path == '-' else path.rpartition('.')[2])
+        if fmt not in transfer.FORMATS:
+            raise CommandError(f"Pass --format, one of {', '.join(transfer.FORMATS)}.")
+
+        start = time.perf_counter()
+        rows = 0
+        stream = self.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        try:
+            for _ in transfer.export_catalog(options['kind'], stream, fmt, options['chunk_size']):
+                rows += 1
+        finally:
+            if path != '-':
+                stream.close()
+        elapsed = time.perf_counter() - start
+        self.stderr.write(self.style.SUCCESS(
+            f"Exported {rows} {options['kind']} in {elapsed:.1f}s "
+            f"({rows / elapsed if elapsed else 0:.0f} rows/s)."))
@@ -0,0 +1,59 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from django.core.management.base import BaseCommand
+
+from catalog.caching import bump_catalog_version
+from catalog.images import image_fields, safe_generate_derivatives
+from catalog.models import Category, Item
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate the resized JPEG and WebP variants of item images and "
+        "category thumbnails that do not have them yet.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Worker processes, defaults to the number of CPUs.')
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Regenerate every image, replacing existing derivatives.')
+
+    def handle(self, *args, **options):
+        # Many rows share an image (default.jpg above all), so work on the
+        # distinct files and write each digest back to all of their rows.
+        sources = {}
+        for model in (Item, Category):
+            image_field, digest_field = image_fields(model)
+            rows = model.objects.all()
+            if not options['force']:
+                rows = rows.filter(**{digest_field: ''})
+            for name in rows.values_list(image_field, flat=True).distinct():
+                if name:
+                    sources.setdefault(name, []).append(model)
+        if not sources:
+            self.stdout.write("Every image already has its derivatives.")
+            return
+
+        # Workers only touch storage and Pillow; the database is updated
+        # from this process as their results come in.
+        generate = partial(safe_generate_derivatives, force=options['force'])
+        names = sorted(sources)
+        done = failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            for name, digest in zip(names, pool.map(generate, names, chunksize=4)):
+                if not digest:
+                    failed += 1
+                    self.stderr.write(f"Skipped {name}")
+                    continue
+                for model in sources[name]:
+                    image_field, digest_field = image_fields(model)
+                    model.objects.filter(**{image_field: name}).update(
+                        **{digest_field: digest})
+                done += 1
+
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated derivatives for {done} images ({failed} skipped)."))
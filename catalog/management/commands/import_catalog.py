@@ -0,0 +1,56 @@
+import sys
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog import transfer
+
+
+class Command(BaseCommand):
+    help = (
+        "Create or update items (matched on slug), categories (on name) or "
+        "coupons (on code) from a CSV or JSON lines file, in batches. Existing "
+        "rows only take the columns the file has. Item "
+        "slugs left blank are made from the title like in the admin. Image "
+        "columns may hold URLs or local paths, fetched in parallel into media.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(transfer.IMPORTERS))
+        parser.add_argument('path', help="File to read, or - for stdin.")
+        parser.add_argument('--format', choices=transfer.FORMATS,
+                            help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=transfer.BATCH_SIZE)
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Parallel image downloads and copies.')
+        parser.add_argument('--skip-derivatives', action='store_true',
+                            help='Leave resizing imported images to generate_image_derivatives.')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or options['path'].rpartition('.')[2]
+        if fmt not in transfer.FORMATS:
+            raise CommandError(f"Pass --format, one of {', '.join(transfer.FORMATS)}.")
+
+        def progress(rows, elapsed):
+            self.stderr.write(f"  {rows} rows, {rows / elapsed:.0f} rows/s", ending='\r')
+
+        start = time.perf_counter()
+        stream = sys.stdin if options['path'] == '-' else open(
+            options['path'], newline='', encoding='utf-8')
+        with stream:
+            importer = transfer.import_catalog(
+                options['kind'], stream, fmt, batch_size=options['batch_size'],
+                workers=options['workers'], progress=progress)
+        elapsed = time.perf_counter() - start
+        self.stderr.write('')
+
+        for line, error in importer.errors:
+            self.stderr.write(f"Line {line}: {error}")
+        rows = importer.created + importer.updated + importer.failed
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {options['kind']}: {importer.created} created, "
+            f"{importer.updated} updated, {importer.failed} failed in {elapsed:.1f}s "
+            f"({rows / elapsed if elapsed else 0:.0f} rows/s)."))
+
+        if options['kind'] != 'coupons' and not options['skip_derivatives']:
+            call_command('generate_image_derivatives', stdout=self.stdout, stderr=self.stderr)
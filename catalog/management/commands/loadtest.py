@@ -0,0 +1,71 @@
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from catalog import loadtest
+from catalog.asgi import CachedCatalogPages
+from catalog.benchmarks import summarize
+from catalog.models import Item
+
+STACKS = {
+    'wsgi': lambda: (loadtest.run_wsgi, WSGIHandler()),
+    'asgi': lambda: (loadtest.run_asgi, ASGIHandler()),
+    'asgi-cached': lambda: (loadtest.run_asgi, CachedCatalogPages(ASGIHandler())),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the catalog read pages as an anonymous visitor under sync "
+        "WSGI, Django's ASGI handler and ASGI with cached pages served ahead "
+        "of Django; or against a running server with --url.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument(
+            '--stacks', default=','.join(STACKS),
+            help='Comma separated, any of: ' + ', '.join(STACKS))
+        parser.add_argument(
+            '--paths', default='',
+            help='Comma separated URLs; defaults to home, shop, shop list '
+                 'and a product page.')
+        parser.add_argument('--url', help='Base URL of a running server to test instead.')
+
+    def default_paths(self):
+        item = Item.objects.order_by('pk').first()
+        if item is None:
+            raise CommandError('Add an item (or pass --paths) first.')
+        return [reverse('home'), reverse('shop'), reverse('shop_list'),
+                reverse('detail', args=[item.slug])]
+
+    def handle(self, *args, **options):
+        paths = [p for p in options['paths'].split(',') if p] or self.default_paths()
+        if options['url']:
+            runs = {options['url']: lambda *run_args: loadtest.run_http(
+                options['url'], *run_args)}
+        else:
+            stacks = options['stacks'].split(',')
+            unknown = set(stacks) - set(STACKS)
+            if unknown:
+                raise CommandError(f"Unknown stacks: {', '.join(sorted(unknown))}")
+            runs = {}
+            for name in stacks:
+                run, application = STACKS[name]()
+                runs[name] = lambda *run_args, run=run, app=application: run(app, *run_args)
+
+        self.stdout.write(
+            f"{options['requests']} requests, {options['concurrency']} concurrent, "
+            f"over {', '.join(paths)}")
+        for name, run in runs.items():
+            # Warm up: fills the page cache and the connection pools.
+            run(paths, len(paths), 1)
+            result = run(paths, options['requests'], options['concurrency'])
+            stats = summarize(result.latencies)
+            self.stdout.write(
+                f"  {name:<12} {result.throughput:8.1f} req/s"
+                f"  p50 {stats['p50'] * 1e3:7.2f}ms"
+                f"  p95 {stats['p95'] * 1e3:7.2f}ms"
+                f"  p99 {stats['p99'] * 1e3:7.2f}ms"
+                f"  errors {result.errors}")
@@ -0,0 +1,25 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog import reporting
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the daily sales rollups behind the admin sales report from "
+        "the paid orders. Run once after deploying them, or with --since to "
+        "repair recent days.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='First day to rebuild, YYYY-MM-DD.')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError('--since must be a date like 2020-06-19.')
+        counted = reporting.rebuild(since)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the sales rollups from {counted} orders."))
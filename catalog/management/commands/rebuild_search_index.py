@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from catalog.models import Item
+from catalog.search import index_items
+
+
+class Command(BaseCommand):
+    help = "Rebuild the storefront search index for every item."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        items = Item.objects.select_related('category').order_by('pk')
+        last_pk, indexed, entries = 0, 0, 0
+        while True:
+            batch = list(items.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not batch:
+                break
+            entries += index_items(batch)
+            indexed += len(batch)
+            last_pk = batch[-1].pk
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {indexed} items ({entries} index entries)."))
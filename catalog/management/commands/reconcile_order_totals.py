@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+
+from catalog.models import Order, line_unit_price
+
+
+class Command(BaseCommand):
+    help = "Compare the stored Order totals with their lines and fix any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Also check completed orders (by default only open carts are checked).')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Report drifted orders without fixing them.')
+
+    def handle(self, *args, **options):
+        orders = Order.objects.select_related('coupon').annotate(
+            computed_subtotal=Coalesce(
+                Sum(F('items__quantity') * line_unit_price('items__')), 0)
+        )
+        if not options['all']:
+            orders = orders.filter(ordered=False)
+
+        checked = drifted = 0
+        for order in orders.iterator():
+            checked += 1
+            discount = order.coupon.amount if order.coupon else 0
+            expected = (order.computed_subtotal, discount,
+                        order.computed_subtotal - discount)
+            stored = (order.subtotal, order.discount, order.total)
+            if expected == stored:
+                continue
+            drifted += 1
+            self.stdout.write(
+                f"Order {order.pk}: stored {stored} expected {expected}")
+            if not options['dry_run']:
+                order.subtotal, order.discount, order.total = expected
+                order.save(update_fields=['subtotal', 'discount', 'total'])
+
+        action = 'found' if options['dry_run'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {checked} orders, {action} {drifted} with drifted totals."))
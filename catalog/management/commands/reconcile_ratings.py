@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from catalog.caching import bump_catalog_version
+from catalog.models import Item
+from catalog.reviews import AGGREGATE_FIELDS, drifted_items
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the rating aggregates stored on items with their reviews and "
+        "fix any drift, e.g. after bulk changes that skipped the signals.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Report drifted items without fixing them.')
+
+    def handle(self, *args, **options):
+        drifted = 0
+        for item, expected in drifted_items():
+            drifted += 1
+            stored = {field: getattr(item, field) for field in AGGREGATE_FIELDS}
+            self.stdout.write(f"Item {item.pk}: stored {stored} expected {expected}")
+            if not options['dry_run']:
+                Item.objects.filter(pk=item.pk).update(**expected)
+
+        if drifted and not options['dry_run']:
+            bump_catalog_version()
+        action = 'found' if options['dry_run'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {Item.objects.count()} items, {action} {drifted} with drifted ratings."))
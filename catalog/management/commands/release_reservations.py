@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog.stock import release_expired
+
+
+class Command(BaseCommand):
+    help = (
+        "Return stock held by expired cart reservations. Run it from cron, or "
+        "keep it running with --every.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--every', type=float, default=None,
+            help='Keep sweeping, pausing this many seconds between runs.')
+
+    def handle(self, *args, **options):
+        while True:
+            released = release_expired()
+            if released or options['every'] is None:
+                self.stdout.write(f"Released {released} expired reservations.")
+            if options['every'] is None:
+                return
+            time.sleep(options['every'])
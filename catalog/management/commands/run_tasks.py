@@ -0,0 +1,44 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from catalog import tasks
+
+
+class Command(BaseCommand):
+    help = "Run queued background tasks (order mail, receipts) as they come due."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once the queue is empty instead of polling.')
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument(
+            '--poll', type=float, default=1.0,
+            help='Seconds to sleep when no task is due.')
+        parser.add_argument(
+            '--stale-after', type=int, default=600,
+            help='Seconds after which a running task is assumed abandoned '
+                 'and queued again.')
+
+    def handle(self, *args, **options):
+        stale_after = timedelta(seconds=options['stale_after'])
+        total = 0
+        try:
+            while True:
+                if not connection.in_atomic_block:
+                    close_old_connections()
+                tasks.requeue_stale(stale_after)
+                ran = tasks.run_pending(options['batch_size'])
+                total += ran
+                if ran:
+                    self.stdout.write(f"Ran {ran} tasks")
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(options['poll'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"Worker stopped after {total} tasks."))
@@ -0,0 +1,252 @@
+"""
+Per-view request metrics, exported in the Prometheus text format at
+/metrics and logged as JSON lines to the catalog.metrics logger.
+
+InstrumentationMiddleware counts and times every request under its URL
+name. A METRICS_SAMPLE_RATE share of requests is also measured in detail:
+SQL queries and their time (through a connection execute_wrapper, so
+DEBUG is not needed), repeated statements, template rendering time
+(through the TimedDjangoTemplates backend) and catalog cache hits. Unsampled requests only pay for a clock read and a
+counter update.
+
+Metrics are kept in process memory. Each worker process serves its own
+numbers at /metrics, so scrape every process, or run one per container.
+"""
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+METRICS = {
+    'ecom_http_requests_total': (
+        'counter', 'Requests handled, by URL name and status code.'),
+    'ecom_http_request_duration_seconds': (
+        'histogram', 'Wall time spent in Django per request, by URL name.'),
+    'ecom_sampled_requests_total': (
+        'counter', 'Requests measured in detail, the denominator of the metrics below.'),
+    'ecom_db_queries_total': (
+        'counter', 'SQL queries run by sampled requests.'),
+    'ecom_db_query_seconds_total': (
+        'counter', 'Time sampled requests spent waiting on SQL queries.'),
+    'ecom_db_duplicate_queries_total': (
+        'counter', 'SQL queries of sampled requests repeating an earlier one with the same parameters.'),
+    'ecom_template_render_seconds_total': (
+        'counter', 'Time sampled requests spent rendering templates, queries included.'),
+    'ecom_cache_requests_total': (
+        'counter', 'Catalog cache lookups of sampled requests, by cache and result.'),
+}
+
+# Characters of a repeated statement kept in its log entry.
+REPEATED_SQL_SHOWN = 300
+
+_local = threading.local()
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class Registry:
+    """Thread-safe counters and histograms keyed on (name, labels)."""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, labels, amount=1):
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + amount
+
+    def observe(self, name, labels, value):
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            # One count per bucket, then +Inf, the sum and the total count.
+            state = series.setdefault(labels, [0] * (len(self.buckets) + 1) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            else:
+                state[len(self.buckets)] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        with self.lock:
+            counters = {name: dict(series) for name, series in self.counters.items()}
+            histograms = {name: {labels: list(state) for labels, state in series.items()}
+                          for name, series in self.histograms.items()}
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            series = (counters if kind == 'counter' else histograms).get(name)
+            if not series:
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in sorted(series.items()):
+                if kind == 'counter':
+                    lines.append(f'{name}{format_labels(labels)} {float(value)!r}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), value):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{format_labels(labels + (("le", bound),))} '
+                                 f'{cumulative}')
+                lines.append(f'{name}_sum{format_labels(labels)} {value[-2]!r}')
+                lines.append(f'{name}_count{format_labels(labels)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class RequestStats:
+    """What one sampled request did. Also its connections' execute_wrapper."""
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.statements = Counter()
+        self.distinct = set()
+        self.template_time = 0.0
+        self.rendering = False
+        self.cache = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.query_time += time.perf_counter() - start
+            self.queries += 1
+            self.statements[sql] += 1
+            self.distinct.add((sql, repr(params)))
+
+    @property
+    def duplicate_queries(self):
+        return self.queries - len(self.distinct)
+
+
+def current_stats():
+    return getattr(_local, 'stats', None)
+
+
+def count_cache_lookup(cache_name, hit):
+    stats = current_stats()
+    if stats is not None:
+        stats.cache[cache_name, 'hit' if hit else 'miss'] += 1
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        stats = current_stats()
+        # Templates rendered while rendering another, by a tag say, are
+        # part of the outermost one.
+        if stats is None or stats.rendering:
+            return super().render(context, request)
+        stats.rendering = True
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_time += time.perf_counter() - start
+            stats.rendering = False
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing renders for sampled requests."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else '<unresolved>'
+
+
+class InstrumentationMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.METRICS_SAMPLE_RATE:
+            start = time.perf_counter()
+            response = self.get_response(request)
+            self.record(request, response, time.perf_counter() - start)
+            return response
+
+        stats = _local.stats = RequestStats()
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(stats))
+                response = self.get_response(request)
+        finally:
+            _local.stats = None
+        self.record(request, response, time.perf_counter() - start, stats)
+        return response
+
+    def record(self, request, response, elapsed, stats=None):
+        view = (('view', view_name(request)),)
+        REGISTRY.inc('ecom_http_requests_total', view + (('status', response.status_code),))
+        REGISTRY.observe('ecom_http_request_duration_seconds', view, elapsed)
+        if stats is None:
+            return
+
+        REGISTRY.inc('ecom_sampled_requests_total', view)
+        REGISTRY.inc('ecom_db_queries_total', view, stats.queries)
+        REGISTRY.inc('ecom_db_query_seconds_total', view, stats.query_time)
+        REGISTRY.inc('ecom_db_duplicate_queries_total', view, stats.duplicate_queries)
+        REGISTRY.inc('ecom_template_render_seconds_total', view, stats.template_time)
+        for (cache_name, result), count in stats.cache.items():
+            REGISTRY.inc('ecom_cache_requests_total',
+                         view + (('cache', cache_name), ('result', result)), count)
+
+        entry = {
+            'view': view[0][1],
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(elapsed * 1000, 2),
+            'queries': stats.queries,
+            'query_ms': round(stats.query_time * 1000, 2),
+            'duplicate_queries': stats.duplicate_queries,
+            'template_ms': round(stats.template_time * 1000, 2),
+            'cache_hits': sum(n for (_, result), n in stats.cache.items() if result == 'hit'),
+            'cache_misses': sum(n for (_, result), n in stats.cache.items() if result == 'miss'),
+        }
+        level = logging.INFO
+        if stats.statements:
+            sql, count = stats.statements.most_common(1)[0]
+            if count >= settings.METRICS_REPEATED_QUERY_WARNING:
+                entry['repeated_query'] = {'sql': sql[:REPEATED_SQL_SHOWN], 'count': count}
+                level = logging.WARNING
+        logger.log(level, json.dumps(entry))
@@ -0,0 +1,42 @@
+# Generated by Django 3.0.5 on 2026-10-18 07:45
+
+from django.db import migrations, models
+
+
+def backfill_order_totals(apps, schema_editor):
+    Order = apps.get_model('catalog', 'Order')
+    for order in Order.objects.select_related('coupon').prefetch_related('items__item'):
+        subtotal = 0
+        for order_item in order.items.all():
+            price = order_item.item.discount_price or order_item.item.price
+            subtotal += price * order_item.quantity
+        order.subtotal = subtotal
+        order.discount = order.coupon.amount if order.coupon else 0
+        order.total = subtotal - order.discount
+        order.save(update_fields=['subtotal', 'discount', 'total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0002_auto_20200619_1342'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='discount',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='subtotal',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_order_totals, migrations.RunPython.noop),
+    ]
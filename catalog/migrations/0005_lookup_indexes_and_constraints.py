@@ -0,0 +1,96 @@
+# Generated by Django 3.0.5 on 2026-10-18 07:52
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def deduplicate(apps, schema_editor):
+    # Clear out rows that would violate the new unique constraints.
+    Order = apps.get_model('catalog', 'Order')
+    OrderItem = apps.get_model('catalog', 'OrderItem')
+    Item = apps.get_model('catalog', 'Item')
+    Coupon = apps.get_model('catalog', 'Coupon')
+
+    def duplicates(queryset, *fields):
+        rows = queryset.values(*fields).annotate(n=Count('id')).filter(n__gt=1)
+        return [{field: row[field] for field in fields} for row in rows]
+
+    # Orders whose lines changed, to have their totals recomputed.
+    touched = set()
+
+    # Keep the oldest open line per (user, item), add the other lines'
+    # quantities to it and point carts at it.
+    for row in duplicates(OrderItem.objects.filter(ordered=False), 'user', 'item'):
+        keep, *extra = OrderItem.objects.filter(ordered=False, **row).order_by('pk')
+        keep.quantity += sum(line.quantity for line in extra)
+        keep.save(update_fields=['quantity'])
+        touched.update(Order.objects.filter(items=keep).values_list('pk', flat=True))
+        for order in Order.objects.filter(items__in=extra).distinct():
+            order.items.remove(*extra)
+            order.items.add(keep)
+            touched.add(order.pk)
+        OrderItem.objects.filter(pk__in=[line.pk for line in extra]).delete()
+
+    # Keep the oldest open order per user and fold the others into it.
+    for row in duplicates(Order.objects.filter(ordered=False), 'user'):
+        keep, *extra = Order.objects.filter(ordered=False, **row).order_by('pk')
+        for order in extra:
+            keep.items.add(*order.items.all())
+            touched.discard(order.pk)
+            order.delete()
+        touched.add(keep.pk)
+
+    for order in Order.objects.filter(pk__in=touched):
+        subtotal = sum(
+            (line.item.discount_price or line.item.price) * line.quantity
+            for line in order.items.select_related('item'))
+        order.subtotal = subtotal
+        order.total = subtotal - order.discount
+        order.save(update_fields=['subtotal', 'total'])
+
+    for row in duplicates(Item.objects.all(), 'slug'):
+        for item in Item.objects.filter(**row).order_by('pk')[1:]:
+            item.slug = f'{item.slug[:40]}-{item.pk}'
+            item.save(update_fields=['slug'])
+
+    for row in duplicates(Coupon.objects.all(), 'code'):
+        for coupon in Coupon.objects.filter(**row).order_by('pk')[1:]:
+            coupon.code = f'{coupon.code[:12]}-{coupon.pk}'
+            coupon.save(update_fields=['code'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0004_item_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='coupon',
+            name='code',
+            field=models.CharField(max_length=20, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='item',
+            name='slug',
+            field=models.SlugField(unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-ordered_date'], name='order_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(ordered=True), fields=['ref_code'], name='order_ref_code_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(ordered=False), fields=('user',), name='unique_open_order_per_user'),
+        ),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(condition=models.Q(ordered=False), fields=('user', 'item'), name='unique_open_order_item'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.0.5 on 2026-10-18 08:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0006_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='thumbnail_digest',
+            field=models.CharField(blank=True, editable=False, max_length=12),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='image_digest',
+            field=models.CharField(blank=True, editable=False, max_length=12),
+        ),
+    ]
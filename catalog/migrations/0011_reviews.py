@@ -0,0 +1,141 @@
+# Generated by Django 3.0.5 on 2026-10-18 09:02
+
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def attach_ratings_to_items(apps, schema_editor):
+    # Each item pointed at one (often shared) Rating. Hand every item a
+    # review of its own: the first item keeps the row, the others get
+    # copies. Ratings without a usable star value are not carried over.
+    Item = apps.get_model('catalog', 'Item')
+    Rating = apps.get_model('catalog', 'Rating')
+    attached = set()
+    for item in Item.objects.select_related('rating').order_by('pk'):
+        rating = item.rating
+        if rating.value is None or not 1 <= rating.value <= 5:
+            continue
+        if rating.pk in attached:
+            Rating.objects.create(item=item, user_id=rating.user_id,
+                                  value=rating.value, message=rating.message)
+        else:
+            Rating.objects.filter(pk=rating.pk).update(item=item)
+            attached.add(rating.pk)
+
+
+def compute_rating_aggregates(apps, schema_editor):
+    Item = apps.get_model('catalog', 'Item')
+    Rating = apps.get_model('catalog', 'Rating')
+    Rating.objects.filter(item__isnull=True).delete()
+    for item in Item.objects.filter(reviews__isnull=False).distinct():
+        values = list(item.reviews.values_list('value', flat=True))
+        item.rating_count = len(values)
+        item.rating_total = sum(values)
+        item.rating_average = item.rating_total / item.rating_count
+        for stars in range(1, 6):
+            setattr(item, f'rating_{stars}', values.count(stars))
+        item.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('catalog', '0010_stock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rating',
+            name='item',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reviews', to='catalog.Item'),
+        ),
+        migrations.AddField(
+            model_name='rating',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='rating_total',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='rating_average',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(attach_ratings_to_items),
+        migrations.RemoveField(
+            model_name='item',
+            name='rating',
+        ),
+        migrations.RunPython(compute_rating_aggregates),
+        migrations.AlterField(
+            model_name='rating',
+            name='item',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reviews', to='catalog.Item'),
+        ),
+        migrations.AlterField(
+            model_name='rating',
+            name='value',
+            field=models.PositiveSmallIntegerField(validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(5)]),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['rating_average', 'id'], name='item_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['category', 'rating_average', 'id'], name='item_category_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['rating_count', 'id'], name='item_review_count_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(fields=['item', '-created'], name='rating_item_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='rating',
+            constraint=models.CheckConstraint(check=models.Q(('value__gte', 1), ('value__lte', 5)), name='rating_value_range'),
+        ),
+        migrations.AddConstraint(
+            model_name='rating',
+            constraint=models.UniqueConstraint(condition=models.Q(user__isnull=False), fields=('item', 'user'), name='one_review_per_user'),
+        ),
+    ]
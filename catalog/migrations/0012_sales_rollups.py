@@ -0,0 +1,79 @@
+# Generated by Django 3.0.5 on 2026-10-18 08:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0011_reviews'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.IntegerField(default=0)),
+                ('discount', models.IntegerField(default=0)),
+                ('refunds_requested', models.PositiveIntegerField(default=0)),
+                ('refunds_granted', models.PositiveIntegerField(default=0)),
+                ('refunded', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'sales report',
+                'verbose_name_plural': 'sales report',
+            },
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='reported',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='DailyItemSales',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.IntegerField(default=0)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='catalog.Item')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyCouponUsage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('uses', models.PositiveIntegerField(default=0)),
+                ('discount', models.IntegerField(default=0)),
+                ('coupon', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='catalog.Coupon')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyCategorySales',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='catalog.Category')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dailyitemsales',
+            constraint=models.UniqueConstraint(fields=('date', 'item'), name='unique_daily_item'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailycouponusage',
+            constraint=models.UniqueConstraint(fields=('date', 'coupon'), name='unique_daily_coupon'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailycategorysales',
+            constraint=models.UniqueConstraint(fields=('date', 'category'), name='unique_daily_category'),
+        ),
+    ]
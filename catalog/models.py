@@ -1,7 +1,11 @@
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
+from django.db.models import F, Prefetch, Q, Sum, Value
+from django.db.models.functions import Coalesce, NullIf
 from django_countries.fields import CountryField
 from django.shortcuts import reverse
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 
 LABEL_CHOICES = (
@@ -15,23 +19,74 @@ PAYMENT_CHOICES = (
 )
 
 
+def line_unit_price(prefix=''):
+    # Unit price of an OrderItem row as used by get_item_final_price(), for
+    # use in aggregates: the discount price unless it is missing or zero.
+    return Coalesce(
+        NullIf(f'{prefix}item__discount_price', Value(0)), f'{prefix}item__price')
+
+
 class Item(models.Model):
     title = models.CharField(max_length=150)
     price = models.IntegerField()
     discount_price = models.IntegerField(blank=True, null=True)
-    slug = models.SlugField()
+    slug = models.SlugField(unique=True)
     description = models.TextField()
     category = models.ForeignKey(
         "Category", on_delete=models.SET_NULL, blank=True, null=True)
     status = models.CharField(max_length=150, blank=True, null=True)
-    rating = models.ForeignKey("Rating", on_delete=models.CASCADE)
     label = models.CharField(choices=LABEL_CHOICES, max_length=2)
     image = models.ImageField(default='default.jpg',
                               upload_to='product_images')
+    # Digest of the image bytes that names its derivatives, see
+    # catalog.images. Blank until they have been generated.
+    image_digest = models.CharField(max_length=12, blank=True, editable=False)
+    # Aggregates of the item's reviews, kept in step with every Rating
+    # saved or deleted by catalog.reviews, so listings can sort and filter
+    # on them without a GROUP BY.
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_total = models.PositiveIntegerField(default=0, editable=False)
+    rating_average = models.FloatField(default=0, editable=False)
+    rating_1 = models.PositiveIntegerField(default=0, editable=False)
+    rating_2 = models.PositiveIntegerField(default=0, editable=False)
+    rating_3 = models.PositiveIntegerField(default=0, editable=False)
+    rating_4 = models.PositiveIntegerField(default=0, editable=False)
+    rating_5 = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        # Shop listings filter by category/label/price and seek on
+        # (sort key, id), see catalog.pagination.
+        indexes = [
+            models.Index(fields=['price', 'id'], name='item_price_idx'),
+            models.Index(fields=['category', 'id'], name='item_category_idx'),
+            models.Index(fields=['category', 'price', 'id'],
+                         name='item_category_price_idx'),
+            models.Index(fields=['label', 'id'], name='item_label_idx'),
+            models.Index(fields=['label', 'price', 'id'],
+                         name='item_label_price_idx'),
+            models.Index(fields=['rating_average', 'id'], name='item_rating_idx'),
+            models.Index(fields=['category', 'rating_average', 'id'],
+                         name='item_category_rating_idx'),
+            models.Index(fields=['rating_count', 'id'], name='item_review_count_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    @property
+    def rating_histogram(self):
+        # [(stars, reviews, percent of reviews)], five stars first.
+        return [
+            (stars, count, round(100 * count / self.rating_count) if self.rating_count else 0)
+            for stars in range(5, 0, -1)
+            for count in [getattr(self, f'rating_{stars}')]
+        ]
+
+    def get_final_price(self):
+        if self.discount_price:
+            return self.discount_price
+        return self.price
+
     def get_add_to_cart_url(self):
         return reverse('add_to_cart', kwargs={'slug': self.slug})
 
@@ -48,6 +103,14 @@ class OrderItem(models.Model):
     item = models.ForeignKey(Item, on_delete=models.CASCADE)
     quantity = models.IntegerField(default=1)
 
+    class Meta:
+        constraints = [
+            # The cart views look lines up by (user, item, ordered=False).
+            models.UniqueConstraint(
+                fields=['user', 'item'], condition=Q(ordered=False),
+                name='unique_open_order_item'),
+        ]
+
     def __str__(self):
         return f"{self.quantity} of {self.item.title}"
 
@@ -67,6 +130,15 @@ class OrderItem(models.Model):
             return self.get_item_price()
 
 
+class OrderQuerySet(models.QuerySet):
+    def with_details(self):
+        # Everything cart.html, order_snippet.html and profile.html touch, so
+        # rendering an order costs the same number of queries at any size.
+        return self.select_related('coupon', 'address', 'payment').prefetch_related(
+            Prefetch('items', queryset=OrderItem.objects.select_related(
+                'item__category').order_by('pk')))
+
+
 class Order(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     items = models.ManyToManyField(OrderItem)
@@ -83,17 +155,63 @@ class Order(models.Model):
     received = models.BooleanField(default=False)
     refund_requested = models.BooleanField(default=False)
     refund_granted = models.BooleanField(default=False)
+    subtotal = models.IntegerField(default=0)
+    discount = models.IntegerField(default=0)
+    total = models.IntegerField(default=0)
+    # Set once the paid order has been added to the sales rollups, see
+    # catalog.reporting.
+    reported = models.BooleanField(default=False)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user'], condition=Q(ordered=False),
+                name='unique_open_order_per_user'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-ordered_date'],
+                         name='order_user_date_idx'),
+            models.Index(fields=['ref_code'], condition=Q(ordered=True),
+                         name='order_ref_code_idx'),
+        ]
 
     def __str__(self):
         return self.user.username
 
     def get_total(self):
-        total = 0
-        for order_item in self.items.all():
-            total += order_item.get_item_final_price()
-        if self.coupon:
-            total -= self.coupon.amount
-        return total
+        return self.total
+
+    def adjust_totals(self, amount):
+        # Shift the stored totals by the value of the line(s) just added
+        # (positive) or removed (negative) without re-reading the cart.
+        Order.objects.filter(pk=self.pk).update(
+            subtotal=F('subtotal') + amount, total=F('total') + amount)
+        self.subtotal += amount
+        self.total += amount
+
+    def apply_coupon(self, coupon):
+        self.coupon = coupon
+        self.discount = coupon.amount if coupon else 0
+        self.total = self.subtotal - self.discount
+        self.save(update_fields=['coupon', 'discount', 'total'])
+
+    def calculate_totals(self):
+        subtotal = self.items.aggregate(
+            subtotal=Coalesce(Sum(F('quantity') * line_unit_price()), 0)
+        )['subtotal']
+        discount = self.coupon.amount if self.coupon else 0
+        return subtotal, discount, subtotal - discount
+
+    def reconcile_totals(self):
+        subtotal, discount, total = self.calculate_totals()
+        changed = (subtotal, discount, total) != (
+            self.subtotal, self.discount, self.total)
+        if changed:
+            self.subtotal, self.discount, self.total = subtotal, discount, total
+            self.save(update_fields=['subtotal', 'discount', 'total'])
+        return changed
 
 
 class Address(models.Model):
@@ -120,13 +238,19 @@ class Payment(models.Model):
         User, on_delete=models.SET_NULL, blank=True, null=True)
     amount = models.IntegerField()
     timestamp = models.DateTimeField(auto_now=True)
+    # Set by catalog.orders.finalize_order; a retried submission carrying
+    # the same key finds this payment instead of finalizing twice.
+    idempotency_key = models.CharField(
+        max_length=100, unique=True, blank=True, null=True)
+    # Stripe refund issued for this charge by catalog.orders.refund_order.
+    refund_id = models.CharField(max_length=50, blank=True)
 
     def __str__(self):
         return self.user.username
 
 
 class Coupon(models.Model):
-    code = models.CharField(max_length=20)
+    code = models.CharField(max_length=20, unique=True)
     amount = models.IntegerField()
 
     def __str__(self):
@@ -146,6 +270,7 @@ class Category(models.Model):
     name = models.CharField(max_length=200)
     thumbnail = models.ImageField(
         default='default.jpg', upload_to='static/cat_imgs')
+    thumbnail_digest = models.CharField(max_length=12, blank=True, editable=False)
 
     class Meta:
         verbose_name_plural = 'Categories'
@@ -155,13 +280,28 @@ class Category(models.Model):
 
 
 class Rating(models.Model):
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='reviews')
     user = models.ForeignKey(
         User, on_delete=models.SET_NULL, blank=True, null=True)
-    value = models.IntegerField(blank=True, null=True)
+    value = models.PositiveSmallIntegerField(
+        validators=[MinValueValidator(1), MaxValueValidator(5)])
     message = models.CharField(max_length=250, blank=True, null=True)
+    created = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['item', '-created'], name='rating_item_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                check=Q(value__gte=1, value__lte=5), name='rating_value_range'),
+            models.UniqueConstraint(
+                fields=['item', 'user'], condition=Q(user__isnull=False),
+                name='one_review_per_user'),
+        ]
 
     def __str__(self):
-        return self.message
+        return f"{self.value}/5 {self.message or ''}".rstrip()
 
 
 class Wishlist(models.Model):
@@ -170,3 +310,213 @@ class Wishlist(models.Model):
 
     def __str__(self):
         return f"{self.user.username}'s wishlist"
+
+
+class SearchIndexEntry(models.Model):
+    # Inverted index for storefront search, maintained by catalog.search.
+    term = models.CharField(max_length=40)
+    item = models.ForeignKey(
+        Item, on_delete=models.CASCADE, related_name='search_entries')
+    weight = models.PositiveIntegerField()
+
+    class Meta:
+        verbose_name_plural = 'Search index entries'
+        indexes = [
+            # Covers the term lookups and prefix ranges in catalog.search.
+            models.Index(fields=['term', 'item', 'weight'],
+                         name='search_term_idx'),
+        ]
+
+    def __str__(self):
+        return self.term
+
+
+class Stock(models.Model):
+    # Items without a Stock row are not stock tracked. See catalog.stock.
+    item = models.OneToOneField(
+        Item, on_delete=models.CASCADE, primary_key=True, related_name='stock')
+    on_hand = models.PositiveIntegerField(default=0)
+    reserved = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.item}: {self.on_hand} on hand, {self.reserved} reserved'
+
+    @property
+    def available(self):
+        return self.on_hand - self.reserved
+
+
+class Reservation(models.Model):
+    # Units of a stock tracked item held for a shopper's cart until
+    # ``expires_at``, after which the sweeper hands them back.
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    item = models.ForeignKey(
+        Item, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'item'],
+                                    name='unique_reservation'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='reservation_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.quantity} x {self.item} for {self.user}'
+
+
+class Task(models.Model):
+    # Background job row, queued and run by catalog.tasks.
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    name = models.CharField(max_length=100)
+    payload = models.TextField(default='{}')
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # The worker polls for due work; finished rows stay out of it.
+            models.Index(fields=['run_after', 'id'],
+                         condition=Q(status='queued'), name='task_due_idx'),
+            models.Index(fields=['locked_at'],
+                         condition=Q(status='running'), name='task_running_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} ({self.status})'
+
+
+# Daily rollups behind the admin sales dashboard, maintained by
+# catalog.reporting. Amounts are in the same units as Order.total.
+class DailySales(models.Model):
+    date = models.DateField(unique=True)
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.IntegerField(default=0)
+    discount = models.IntegerField(default=0)
+    refunds_requested = models.PositiveIntegerField(default=0)
+    refunds_granted = models.PositiveIntegerField(default=0)
+    refunded = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'sales report'
+        verbose_name_plural = 'sales report'
+
+    def __str__(self):
+        return str(self.date)
+
+
+class DailyItemSales(models.Model):
+    date = models.DateField()
+    item = models.ForeignKey(Item, on_delete=models.CASCADE)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'item'], name='unique_daily_item'),
+        ]
+
+
+class DailyCategorySales(models.Model):
+    date = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'category'],
+                                    name='unique_daily_category'),
+        ]
+
+
+class DailyCouponUsage(models.Model):
+    date = models.DateField()
+    coupon = models.ForeignKey(Coupon, on_delete=models.CASCADE)
+    uses = models.PositiveIntegerField(default=0)
+    discount = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'coupon'], name='unique_daily_coupon'),
+        ]
+
+
+class BulkJob(models.Model):
+    # An admin action over a large selection, run chunk by chunk by
+    # catalog.bulk.
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    action = models.CharField(max_length=100)
+    actor = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True)
+    object_ids = models.TextField(default='[]')
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    changed = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f'{self.action} ({self.processed}/{self.total})'
+
+    @property
+    def progress(self):
+        return round(100 * self.processed / self.total) if self.total else 100
+
+
+class AuditLog(models.Model):
+    # Append-only record of changes made through bulk actions and of their
+    # side effects, see catalog.audit.
+    created = models.DateTimeField(default=timezone.now, db_index=True)
+    actor = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True)
+    action = models.CharField(max_length=100)
+    job = models.ForeignKey(BulkJob, on_delete=models.SET_NULL, blank=True, null=True)
+    object_type = models.CharField(max_length=50)
+    object_id = models.PositiveIntegerField()
+    changes = models.TextField(default='{}')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['object_type', 'object_id'], name='audit_object_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.action} on {self.object_type} {self.object_id}'
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('Audit log entries cannot be changed.')
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError('Audit log entries cannot be deleted.')
@@ -0,0 +1,130 @@
+import logging
+import random
+import string
+
+from django.db import IntegrityError, transaction
+
+from .audit import record
+from .models import Order, OrderItem, Payment
+from .payments import get_gateway
+from .reporting import order_paid
+from .stock import consume_order
+from .tasks import enqueue, send_order_confirmation, task
+
+logger = logging.getLogger(__name__)
+
+
+class OrderFinalizationError(Exception):
+    pass
+
+
+class OrderAlreadyPaid(OrderFinalizationError):
+    pass
+
+
+class PaymentAlreadyUsed(OrderFinalizationError):
+    pass
+
+
+def create_ref_code():
+    return ''.join(random.choices(string.ascii_lowercase + string.digits, k=20))
+
+
+def paid_order(idempotency_key, **lookups):
+    """The order matching ``lookups`` already finalized under ``idempotency_key``, if any."""
+    return Order.objects.filter(payment__idempotency_key=idempotency_key, **lookups).first()
+
+
+def finalize_order(order_id, user, charge_id, idempotency_key):
+    """
+    Mark the open order ``order_id`` of ``user`` as paid: take its units out
+    of stock, record the Payment, flag every line as ordered, assign a
+    ref_code and queue the confirmation mail and the sales rollup update,
+    all in one transaction and a fixed number of statements however many
+    lines the order has. Raises OutOfStock if a tracked item ran out.
+
+    Returns ``(order, created)``. Calling it again with the same
+    ``idempotency_key`` returns the finalized order with ``created`` False
+    and changes nothing; a different key for a paid order raises
+    OrderAlreadyPaid, and a key that paid for another order raises
+    PaymentAlreadyUsed.
+    """
+    try:
+        with transaction.atomic():
+            order = Order.objects.select_for_update().get(pk=order_id, user=user)
+            if order.ordered:
+                existing = paid_order(idempotency_key, pk=order_id, user=user)
+                if existing is not None:
+                    return existing, False
+                raise OrderAlreadyPaid(order.ref_code)
+
+            consume_order(order)
+            order.payment = Payment.objects.create(
+                charge_id=charge_id, user=user, amount=order.get_total(),
+                idempotency_key=idempotency_key)
+            OrderItem.objects.filter(order=order).update(ordered=True)
+            order.ordered = True
+            order.ref_code = create_ref_code()
+            order.save(update_fields=['ordered', 'payment', 'ref_code', 'ordered_date'])
+            enqueue(send_order_confirmation, order_id=order.pk)
+            order_paid(order)
+    except IntegrityError:
+        # A concurrent submission with the same key won the race.
+        existing = paid_order(idempotency_key, pk=order_id, user=user)
+        if existing is not None:
+            return existing, False
+        if paid_order(idempotency_key) is not None:
+            raise PaymentAlreadyUsed(idempotency_key)
+        raise
+    return order, True
+
+
+@task
+def refund_order(order_id):
+    """
+    Refund the Stripe charge that paid for ``order_id``. Safe to retry: the
+    refund carries an idempotency key derived from the order, and a payment
+    with a recorded refund is left alone. Charges made elsewhere (PayPal)
+    are only logged, to be refunded by hand.
+    """
+    payment = Payment.objects.filter(order=order_id).first()
+    if payment is None or payment.refund_id:
+        return
+    if not payment.charge_id.startswith('ch_'):
+        logger.warning('Order %s was not paid through Stripe, refund it by hand', order_id)
+        record('refund_skipped', Payment, [payment.pk], order=order_id,
+               reason='not a Stripe charge')
+        return
+    refund = get_gateway().create_refund(
+        charge=payment.charge_id, amount=payment.amount * 100,
+        idempotency_key=f'refund:{order_id}')
+    with transaction.atomic():
+        Payment.objects.filter(pk=payment.pk).update(refund_id=refund['id'])
+        record('stripe_refund', Payment, [payment.pk], order=order_id,
+               refund_id=refund['id'], amount=payment.amount)
+
+
+@task
+def refund_charge(order_id, charge_id, amount):
+    """
+    Refund ``amount`` cents of ``charge_id``, taken for ``order_id`` but
+    never finalized because an item sold out after the customer paid. Safe
+    to retry: the refund's idempotency key is derived from the charge.
+    PayPal captures are only logged, to be refunded by hand.
+    """
+    if not charge_id.startswith('ch_'):
+        logger.warning('Payment %s for order %s was not finalized, refund it by hand',
+                       charge_id, order_id)
+        record('refund_skipped', Order, [order_id], charge=charge_id,
+               reason='not a Stripe charge')
+        return
+    refund = get_gateway().create_refund(
+        charge=charge_id, amount=amount, idempotency_key=f'refund:{charge_id}')
+    record('stripe_refund', Order, [order_id], charge=charge_id,
+           refund_id=refund['id'], amount=amount)
+
+
+def refund_unfinalized(order, charge_id):
+    """Queue the refund of ``charge_id``, paid for ``order`` that could not be finalized."""
+    enqueue(refund_charge, order_id=order.pk, charge_id=charge_id,
+            amount=int(order.get_total() * 100))
@@ -0,0 +1,117 @@
+import base64
+import binascii
+import json
+import math
+
+from django.db.models import Q
+from django.http import Http404
+
+
+# What a signed 64-bit integer column can hold.
+MAX_INT = 2 ** 63 - 1
+
+
+class InvalidCursor(Http404):
+    pass
+
+
+def valid_value(value):
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, int):
+        return -MAX_INT - 1 <= value <= MAX_INT
+    return isinstance(value, float) and math.isfinite(value)
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, ValueError):
+        raise InvalidCursor('Invalid page cursor')
+    if not isinstance(values, list) or not all(valid_value(v) for v in values):
+        raise InvalidCursor('Invalid page cursor')
+    return values
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+class KeysetPaginator:
+    """
+    Seek pagination over ``queryset`` ordered by ``sort_field`` with ``id``
+    as the tie breaker. Each page is a single indexed range scan of at most
+    ``per_page + 1`` rows, however deep into the listing it is.
+    """
+
+    def __init__(self, queryset, per_page, sort_field='id'):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.descending = sort_field.startswith('-')
+        self.field = sort_field.lstrip('-')
+
+    def key(self, obj):
+        if self.field == 'id':
+            return [obj.pk]
+        return [getattr(obj, self.field), obj.pk]
+
+    def seek(self, values, forward):
+        # Rows strictly after (forward) or before the cursor position in
+        # the listing order.
+        lookup = 'gt' if forward != self.descending else 'lt'
+        if self.field == 'id':
+            if len(values) != 1:
+                raise InvalidCursor('Invalid page cursor')
+            return Q(**{f'id__{lookup}': values[0]})
+        if len(values) != 2:
+            raise InvalidCursor('Invalid page cursor')
+        value, pk = values
+        return (Q(**{f'{self.field}__{lookup}': value})
+                | Q(**{self.field: value, f'id__{lookup}': pk}))
+
+    def ordering(self, forward):
+        prefix = '' if forward != self.descending else '-'
+        if self.field == 'id':
+            return [f'{prefix}id']
+        return [f'{prefix}{self.field}', f'{prefix}id']
+
+    def page(self, after=None, before=None):
+        forward = not before
+        queryset = self.queryset.order_by(*self.ordering(forward))
+        cursor = after if forward else before
+        if cursor:
+            queryset = queryset.filter(self.seek(decode_cursor(cursor), forward))
+
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+        if not rows:
+            return KeysetPage(rows)
+
+        first, last = encode_cursor(self.key(rows[0])), encode_cursor(self.key(rows[-1]))
+        if forward:
+            return KeysetPage(rows, last if has_more else None, first if cursor else None)
+        return KeysetPage(rows, last, first if has_more else None)
@@ -0,0 +1,218 @@
+import logging
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import lru_cache
+
+import requests
+import stripe
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+from stripe import api_requestor, util
+from stripe.http_client import RequestsClient
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(stripe.error.APIConnectionError):
+    """Raised without calling Stripe while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive provider failures. After ``threshold`` of them calls
+    fail fast for ``reset_timeout`` seconds, then a single trial call is let
+    through: success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30, clock=time.monotonic):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.trial_running or self.clock() - self.opened_at < self.reset_timeout:
+                return False
+            self.trial_running = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.threshold:
+                self.opened_at = self.clock()
+            self.trial_running = False
+
+
+class PooledClient(RequestsClient):
+    """
+    Stripe HTTP client sharing one keep-alive connection pool between all
+    threads. Socket timeouts are capped by the deadline of the call in
+    progress, so retries never run past it.
+    """
+
+    def __init__(self, pool_size=10, connect_timeout=3.05, read_timeout=10):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        super().__init__(timeout=(connect_timeout, read_timeout), session=session)
+        self.deadlines = threading.local()
+
+    @contextmanager
+    def deadline(self, at):
+        self.deadlines.at = at
+        try:
+            yield
+        finally:
+            self.deadlines.at = None
+
+    def remaining(self):
+        at = getattr(self.deadlines, 'at', None)
+        return None if at is None else at - time.monotonic()
+
+    @property
+    def _timeout(self):
+        remaining = self.remaining()
+        if remaining is None:
+            return self.timeouts
+        if remaining <= 0:
+            # Raised inside RequestsClient's error handling, which turns it
+            # into an APIConnectionError like any other timeout.
+            raise requests.exceptions.Timeout('Payment deadline exceeded')
+        return tuple(min(timeout, remaining) for timeout in self.timeouts)
+
+    @_timeout.setter
+    def _timeout(self, value):
+        self.timeouts = value
+
+    def _max_network_retries(self):
+        # StripeGateway does the retrying.
+        return 0
+
+
+# Errors that say nothing about the request itself; worth retrying and
+# counted against the provider's health.
+RETRYABLE_ERRORS = (stripe.error.RateLimitError, stripe.error.APIConnectionError)
+PROVIDER_ERRORS = RETRYABLE_ERRORS + (stripe.error.APIError,)
+
+
+class StripeGateway:
+    """
+    The Stripe calls checkout needs, made through a pooled client with a
+    deadline per call, bounded retries with jittered backoff for rate limits
+    and connection failures, and a circuit breaker in front.
+    """
+
+    def __init__(self, api_key, api_base=None, deadline=20, max_retries=2,
+                 backoff=0.25, max_backoff=2, client=None, breaker=None,
+                 sleep=time.sleep):
+        self.api_key = api_key
+        self.api_base = api_base
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.client = client or PooledClient()
+        self.breaker = breaker or CircuitBreaker()
+        self.sleep = sleep
+
+    def create_customer(self, **params):
+        return self.request('post', '/v1/customers', params)
+
+    def create_charge(self, idempotency_key=None, **params):
+        return self.request('post', '/v1/charges', params, idempotency_key)
+
+    def create_refund(self, idempotency_key=None, **params):
+        return self.request('post', '/v1/refunds', params, idempotency_key)
+
+    def request(self, method, url, params, idempotency_key=None):
+        if not self.breaker.allow():
+            raise CircuitOpenError('Stripe is unavailable, not calling it for now.')
+
+        # POSTs always carry a key so a retry can never create a second
+        # customer or charge.
+        if method == 'post' and idempotency_key is None:
+            idempotency_key = str(uuid.uuid4())
+        headers = util.populate_headers(idempotency_key)
+        requestor = api_requestor.APIRequestor(
+            self.api_key, client=self.client, api_base=self.api_base)
+        deadline = time.monotonic() + self.deadline
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self.client.deadline(deadline):
+                    response, api_key = requestor.request(method, url, params, headers)
+            except PROVIDER_ERRORS as exc:
+                self.breaker.record_failure()
+                delay = self.retry_delay(attempt, exc)
+                if (not isinstance(exc, RETRYABLE_ERRORS) or attempt == self.max_retries
+                        or self.breaker.is_open
+                        or time.monotonic() + delay >= deadline):
+                    raise
+                logger.info('Retrying Stripe %s %s in %.2fs: %s', method, url, delay, exc)
+                self.sleep(delay)
+            except stripe.error.StripeError:
+                # Declines and bad requests mean Stripe itself is fine.
+                self.breaker.record_success()
+                raise
+            except Exception:
+                # Whatever went wrong, a trial call must not stay running.
+                self.breaker.record_failure()
+                raise
+            else:
+                self.breaker.record_success()
+                return util.convert_to_stripe_object(response, api_key, None, None)
+
+    def retry_delay(self, attempt, exc):
+        # Full jitter: concurrent checkouts that failed together spread out
+        # instead of retrying in lockstep.
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        retry_after = (exc.headers or {}).get('Retry-After')
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, int(retry_after))
+        return delay
+
+
+@lru_cache(maxsize=None)
+def get_gateway():
+    return StripeGateway(
+        settings.STRIPE_SECRET_KEY,
+        api_base=settings.STRIPE_API_BASE,
+        deadline=settings.STRIPE_DEADLINE,
+        max_retries=settings.STRIPE_MAX_RETRIES,
+        client=PooledClient(
+            pool_size=settings.STRIPE_POOL_SIZE,
+            connect_timeout=settings.STRIPE_CONNECT_TIMEOUT,
+            read_timeout=settings.STRIPE_READ_TIMEOUT),
+        breaker=CircuitBreaker(
+            threshold=settings.STRIPE_BREAKER_THRESHOLD,
+            reset_timeout=settings.STRIPE_BREAKER_RESET),
+    )
+
+
+@receiver(setting_changed)
+def reset_gateway(setting, **kwargs):
+    if setting.startswith('STRIPE_'):
+        get_gateway.cache_clear()
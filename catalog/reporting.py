@@ -0,0 +1,209 @@
+"""
+Daily sales rollups for the admin dashboard.
+
+Finalizing an order, requesting a refund and granting one each queue a task
+that adds the event onto the rollup rows of the day it happened, so the
+payment path never waits on the hot per-day rows and the dashboard never
+scans orders. ``rebuild`` recomputes the rollups from the orders, for the
+first deployment and for repairs.
+"""
+from datetime import date
+
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import (
+    DailyCategorySales, DailyCouponUsage, DailyItemSales, DailySales, Order,
+    OrderItem, Refund, line_unit_price,
+)
+from .tasks import enqueue, enqueue_many, task
+
+ROLLUPS = [DailySales, DailyItemSales, DailyCategorySales, DailyCouponUsage]
+
+
+def by_key(key, amounts):
+    return Case(
+        *[When(**{key: value}, then=Value(amount)) for value, amount in amounts.items()],
+        default=Value(0), output_field=IntegerField())
+
+
+def add_to_day(day, **amounts):
+    changes = {field: F(field) + amount for field, amount in amounts.items()}
+    if not DailySales.objects.filter(date=day).update(**changes):
+        DailySales.objects.create(date=day, **amounts)
+
+
+def add_to_rollup(model, day, key, rows):
+    """
+    Add ``rows``, ``{key id: {field: amount}}`` with the same fields in
+    every row, onto ``model``'s rows for ``day``: one UPDATE for the keys
+    already there and one INSERT for the rest.
+    """
+    if not rows:
+        return
+    fields = next(iter(rows.values()))
+    existing = set(model.objects.filter(date=day, **{f'{key}__in': rows})
+                   .values_list(key, flat=True))
+    if existing:
+        model.objects.filter(date=day, **{f'{key}__in': existing}).update(**{
+            field: F(field) + by_key(key, {k: rows[k][field] for k in existing})
+            for field in fields})
+    model.objects.bulk_create([
+        model(date=day, **{f'{key}_id': k}, **amounts)
+        for k, amounts in rows.items() if k not in existing])
+
+
+def add_lines(day, lines):
+    """Add ``(item id, category id, units, revenue)`` lines to the item and category rollups."""
+    items, categories = {}, {}
+    for item_id, category_id, units, revenue in lines:
+        for rows, key in ((items, item_id), (categories, category_id)):
+            if key is None:
+                continue
+            row = rows.setdefault(key, {'units': 0, 'revenue': 0})
+            row['units'] += units
+            row['revenue'] += revenue
+    add_to_rollup(DailyItemSales, day, 'item', items)
+    add_to_rollup(DailyCategorySales, day, 'category', categories)
+
+
+def today():
+    return timezone.localdate().isoformat()
+
+
+@task
+def record_order_sales(order_id, day):
+    with transaction.atomic():
+        # Claiming the order makes a retried or duplicate task a no-op.
+        if not Order.objects.filter(pk=order_id, ordered=True, reported=False) \
+                .update(reported=True):
+            return
+        day = date.fromisoformat(day)
+        order = Order.objects.get(pk=order_id)
+        lines = [
+            (item_id, category_id, quantity, quantity * price)
+            for item_id, category_id, quantity, price in
+            OrderItem.objects.filter(order=order).annotate(price=line_unit_price())
+            .values_list('item', 'item__category', 'quantity', 'price')
+        ]
+        add_to_day(day, orders=1, units=sum(line[2] for line in lines),
+                   revenue=order.total, discount=order.discount)
+        add_lines(day, lines)
+        if order.coupon_id:
+            add_to_rollup(DailyCouponUsage, day, 'coupon', {
+                order.coupon_id: {'uses': 1, 'discount': order.discount}})
+
+
+@task
+def record_refund_request(order_id, day):
+    add_to_day(date.fromisoformat(day), refunds_requested=1)
+
+
+@task
+def record_refund_granted(order_id, day):
+    total = Order.objects.filter(pk=order_id).values_list('total', flat=True).first()
+    if total is not None:
+        add_to_day(date.fromisoformat(day), refunds_granted=1, refunded=total)
+
+
+def order_paid(order):
+    enqueue(record_order_sales, order_id=order.pk, day=today())
+
+
+def refund_requested(order):
+    enqueue(record_refund_request, order_id=order.pk, day=today())
+
+
+def refunds_granted(order_ids):
+    day = today()
+    enqueue_many(record_refund_granted, [
+        {'order_id': order_id, 'day': day} for order_id in order_ids])
+
+
+def rebuild(since=None):
+    """
+    Recompute the rollups from paid orders, for every day or from ``since``
+    on. Orders carry no refund timestamps, so refunds are counted on the
+    day of the order here rather than the day of the request or grant.
+    Returns the number of orders counted.
+    """
+    with transaction.atomic():
+        orders = Order.objects.filter(ordered=True)
+        for model in ROLLUPS:
+            rows = model.objects.all()
+            if since:
+                rows = rows.filter(date__gte=since)
+            rows.delete()
+        if since:
+            orders = orders.filter(ordered_date__date__gte=since)
+        orders = orders.annotate(day=TruncDate('ordered_date'))
+
+        days = {}
+        for row in orders.values('day').order_by().annotate(
+                count=Count('id'), revenue=Sum('total'), discount=Sum('discount')):
+            days[row['day']] = DailySales(
+                date=row['day'], orders=row['count'], revenue=row['revenue'],
+                discount=row['discount'])
+        for row in orders.filter(refund_granted=True).values('day').order_by().annotate(
+                count=Count('id'), total=Sum('total')):
+            days[row['day']].refunds_granted = row['count']
+            days[row['day']].refunded = row['total']
+        for row in Refund.objects.filter(order__in=orders).annotate(
+                day=TruncDate('order__ordered_date')).values('day').order_by().annotate(
+                count=Count('id')):
+            days[row['day']].refunds_requested = row['count']
+
+        lines = OrderItem.objects.filter(order__in=orders).annotate(
+            day=TruncDate('order__ordered_date')
+        ).values('day', 'item', 'item__category').order_by().annotate(
+            units=Sum('quantity'), revenue=Sum(F('quantity') * line_unit_price()))
+        items, categories = [], {}
+        for row in lines:
+            days[row['day']].units += row['units']
+            items.append(DailyItemSales(
+                date=row['day'], item_id=row['item'], units=row['units'],
+                revenue=row['revenue']))
+            if row['item__category'] is not None:
+                category = categories.setdefault(
+                    (row['day'], row['item__category']),
+                    DailyCategorySales(date=row['day'], category_id=row['item__category']))
+                category.units += row['units']
+                category.revenue += row['revenue']
+
+        coupons = [
+            DailyCouponUsage(date=row['day'], coupon_id=row['coupon'],
+                             uses=row['uses'], discount=row['discount'])
+            for row in orders.filter(coupon__isnull=False).values('day', 'coupon')
+            .order_by().annotate(uses=Count('id'), discount=Sum('discount'))
+        ]
+
+        DailySales.objects.bulk_create(days.values())
+        DailyItemSales.objects.bulk_create(items)
+        DailyCategorySales.objects.bulk_create(categories.values())
+        DailyCouponUsage.objects.bulk_create(coupons)
+        return orders.update(reported=True)
+
+
+def dashboard(start, end):
+    """Everything the admin sales dashboard shows for ``start`` to ``end``, from the rollups alone."""
+    days = DailySales.objects.filter(date__range=(start, end)).order_by('date')
+    in_range = {'date__range': (start, end)}
+    totals = days.aggregate(
+        orders=Sum('orders'), units=Sum('units'), revenue=Sum('revenue'),
+        discount=Sum('discount'), refunds_requested=Sum('refunds_requested'),
+        refunds_granted=Sum('refunds_granted'), refunded=Sum('refunded'))
+    return {
+        'days': list(days),
+        'totals': {key: value or 0 for key, value in totals.items()},
+        'top_items': DailyItemSales.objects.filter(**in_range)
+        .values('item', 'item__title').order_by()
+        .annotate(units=Sum('units'), revenue=Sum('revenue')).order_by('-revenue')[:20],
+        'categories': DailyCategorySales.objects.filter(**in_range)
+        .values('category', 'category__name').order_by()
+        .annotate(units=Sum('units'), revenue=Sum('revenue')).order_by('-revenue'),
+        'coupons': DailyCouponUsage.objects.filter(**in_range)
+        .values('coupon', 'coupon__code').order_by()
+        .annotate(uses=Sum('uses'), discount=Sum('discount')).order_by('-uses'),
+    }
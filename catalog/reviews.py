@@ -0,0 +1,78 @@
+from django.db import transaction
+from django.db.models import Case, Count, ExpressionWrapper, F, FloatField, Q, Sum, Value, When
+from django.db.models.functions import Cast
+
+from .models import Item, Rating
+
+STARS = range(1, 6)
+AGGREGATE_FIELDS = ['rating_count', 'rating_total', 'rating_average'] + [
+    f'rating_{stars}' for stars in STARS]
+
+
+def adjust(item_id, value, sign):
+    """
+    Add (``sign`` 1) or take away (-1) one review of ``value`` stars in the
+    item's stored aggregates. A single UPDATE computing from the current
+    columns, so concurrent reviews of one item cannot lose each other.
+    """
+    count = F('rating_count') + sign
+    total = F('rating_total') + sign * value
+    average = ExpressionWrapper(
+        Cast(total, FloatField()) / count, output_field=FloatField())
+    Item.objects.filter(pk=item_id).update(
+        rating_count=count,
+        rating_total=total,
+        rating_average=Case(
+            When(rating_count__lte=-sign, then=Value(0.0)),
+            default=average, output_field=FloatField()),
+        **{f'rating_{value}': F(f'rating_{value}') + sign})
+
+
+def review_saved(review, previous=None):
+    """``previous`` is the (item id, value) the review was stored with, if any."""
+    current = (review.item_id, review.value)
+    if previous == current:
+        return
+    with transaction.atomic():
+        if previous is not None:
+            adjust(*previous, -1)
+        adjust(*current, 1)
+
+
+def review_deleted(review):
+    adjust(review.item_id, review.value, -1)
+
+
+def computed_aggregates(items):
+    """{item id: {field: value}} counted from the Rating rows of ``items``."""
+    rows = Rating.objects.filter(item__in=items).values('item').order_by().annotate(
+        rating_count=Count('id'), rating_total=Sum('value'),
+        **{f'rating_{stars}': Count('id', filter=Q(value=stars)) for stars in STARS})
+    aggregates = {}
+    for row in rows:
+        item_id = row.pop('item')
+        row['rating_average'] = row['rating_total'] / row['rating_count']
+        aggregates[item_id] = row
+    return aggregates
+
+
+def drifted_items(items=None, chunk_size=1000):
+    """
+    Yield ``(item, expected aggregates)`` for every item whose stored
+    aggregates disagree with its reviews, for repairs after bulk updates or
+    deletes that bypassed the signals.
+    """
+    items = (items if items is not None else Item.objects.all()).order_by('pk')
+    empty = dict.fromkeys(AGGREGATE_FIELDS, 0)
+    last = 0
+    while True:
+        chunk = list(items.filter(pk__gt=last).only('pk', *AGGREGATE_FIELDS)[:chunk_size])
+        if not chunk:
+            return
+        computed = computed_aggregates([item.pk for item in chunk])
+        for item in chunk:
+            expected = computed.get(item.pk, empty)
+            if any(abs(getattr(item, field) - expected[field]) > 1e-9
+                   for field in AGGREGATE_FIELDS):
+                yield item, expected
+        last = chunk[-1].pk
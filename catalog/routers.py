@@ -0,0 +1,94 @@
+"""
+Read replica routing.
+
+Views wrapped in replica_reads read catalog rows (REPLICA_MODELS) from
+settings.DATABASE_REPLICA when one is configured, on GET and HEAD only.
+Everything else - carts, orders, payments, sessions, users and every
+write - goes to the default database.
+
+Replicas lag behind. A visitor whose request wrote anything gets the
+PIN_COOKIE for DATABASE_REPLICA_PIN_SECONDS and reads only from the default
+database meanwhile, so they see their own changes. Catalog edits keep every
+catalog page on the default database for as long (see
+catalog.caching.bump_catalog_version), so a stale copy is never cached
+under the new catalog version.
+"""
+import threading
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .caching import catalog_recently_changed
+
+PIN_COOKIE = 'primary_db'
+REPLICA_MODELS = {
+    'catalog.item', 'catalog.category', 'catalog.rating', 'catalog.searchindexentry',
+    'catalog.stock',
+}
+
+_state = threading.local()
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if getattr(_state, 'replica', None) and model._meta.label_lower in REPLICA_MODELS:
+            return _state.replica
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the default database.
+        return True
+
+
+def replica_reads(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or not settings.DATABASE_REPLICA \
+                or getattr(_state, 'pinned', False) or catalog_recently_changed():
+            return view(request, *args, **kwargs)
+        _state.replica = settings.DATABASE_REPLICA
+        try:
+            response = view(request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                # Lazy querysets of TemplateResponses run while rendering.
+                response.render()
+            return response
+        finally:
+            _state.replica = None
+    return wrapper
+
+
+class ReplicaPinningMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _state.pinned = PIN_COOKIE in request.COOKIES
+        _state.wrote = False
+        try:
+            response = self.get_response(request)
+            wrote = _state.wrote
+        finally:
+            _state.pinned = _state.wrote = False
+        if wrote and settings.DATABASE_REPLICA:
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=settings.DATABASE_REPLICA_PIN_SECONDS,
+                httponly=True, samesite='Lax')
+        return response
+
+
+def close_dead_connections():
+    """
+    Close persistent connections the server has dropped, so the request
+    reconnects instead of failing on its first query. Django 3.0 has no
+    CONN_HEALTH_CHECKS.
+    """
+    for connection in connections.all():
+        if connection.connection is not None and not connection.in_atomic_block \
+                and not connection.is_usable():
+            connection.close()
@@ -0,0 +1,116 @@
+import re
+import unicodedata
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, Count, IntegerField, Max, Q, Sum, When
+
+from .models import Item, SearchIndexEntry
+
+TITLE_WEIGHT = 5
+CATEGORY_WEIGHT = 3
+DESCRIPTION_WEIGHT = 1
+MAX_QUERY_TERMS = 8
+
+STOP_WORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in',
+    'is', 'it', 'of', 'on', 'or', 'that', 'the', 'to', 'with',
+}
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = text.encode('ascii', 'ignore').decode().lower()
+    return [
+        token[:SearchIndexEntry._meta.get_field('term').max_length]
+        for token in TOKEN_RE.findall(text) if token not in STOP_WORDS
+    ]
+
+
+def item_terms(item, category_name=None):
+    weights = Counter()
+    for field, weight in [(item.title, TITLE_WEIGHT),
+                          (category_name, CATEGORY_WEIGHT),
+                          (item.description, DESCRIPTION_WEIGHT)]:
+        for token in tokenize(field):
+            weights[token] += weight
+    return weights
+
+
+def index_items(items):
+    """
+    (Re)build the postings of ``items``: one row per distinct term per item
+    holding the term's weighted frequency across title, category and
+    description.
+    """
+    items = list(items)
+    entries = [
+        SearchIndexEntry(term=term, item_id=item.pk, weight=weight)
+        for item in items
+        for term, weight in item_terms(
+            item, item.category.name if item.category_id else None).items()
+    ]
+    with transaction.atomic():
+        SearchIndexEntry.objects.filter(item__in=[item.pk for item in items]).delete()
+        SearchIndexEntry.objects.bulk_create(entries)
+    return len(entries)
+
+
+def prefix_range(prefix):
+    # term >= 'shi' AND term < 'shj' is an index range scan on any backend,
+    # unlike LIKE 'shi%' which SQLite cannot serve from the index.
+    return Q(term__gte=prefix, term__lt=prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+
+def term_filters(query):
+    # Every word must match exactly except the last, which matches as a
+    # prefix so results follow along while the shopper is typing.
+    tokens = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    if not tokens:
+        return []
+    return [Q(term=token) for token in tokens[:-1]] + [prefix_range(tokens[-1])]
+
+
+def search(query, limit=20):
+    """
+    Items matching every word of ``query``, best first. Only the postings of
+    the query terms are read: an item's score is the summed weight of the
+    terms it matched.
+    """
+    filters = term_filters(query)
+    if not filters:
+        return []
+    any_term = Q()
+    for term_filter in filters:
+        any_term |= term_filter
+    matched_words = sum(
+        Max(Case(When(term_filter, then=1), default=0, output_field=IntegerField()))
+        for term_filter in filters
+    )
+    ranked = (
+        SearchIndexEntry.objects.filter(any_term)
+        .values('item')
+        .annotate(score=Sum('weight'), matched=matched_words)
+        .filter(matched=len(filters))
+        .order_by('-score', 'item')
+        .values_list('item', 'score')[:limit]
+    )
+    ranked = list(ranked)
+    items = Item.objects.select_related('category').in_bulk(
+        [item_id for item_id, score in ranked])
+    return [items[item_id] for item_id, score in ranked if item_id in items]
+
+
+def suggest(prefix, limit=8):
+    """The most common indexed terms starting with the last word of ``prefix``."""
+    tokens = tokenize(prefix)
+    if not tokens or len(tokens[-1]) < 2:
+        return []
+    return list(
+        SearchIndexEntry.objects.filter(prefix_range(tokens[-1]))
+        .values('term')
+        .annotate(items=Count('item'))
+        .order_by('-items', 'term')
+        .values_list('term', flat=True)[:limit]
+    )
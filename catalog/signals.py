@@ -0,0 +1,88 @@
+from allauth.account.signals import user_logged_in
+from django.conf import settings
+from django.core.signals import request_started
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .caching import bump_catalog_version
+from .cart import merge_session_cart
+from .images import image_fields, safe_generate_derivatives
+from .models import Category, Item, Rating
+from .reviews import review_deleted, review_saved
+from .routers import close_dead_connections
+from .search import index_items
+
+
+@receiver(request_started)
+def check_database_connections(sender, **kwargs):
+    if settings.DATABASE_HEALTH_CHECKS:
+        close_dead_connections()
+
+
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    merge_session_cart(request.session, user)
+
+
+@receiver(pre_save, sender=Item)
+@receiver(pre_save, sender=Category)
+def forget_replaced_image(sender, instance, raw=False, **kwargs):
+    image_field, digest_field = image_fields(sender)
+    if not raw and not getattr(instance, image_field)._committed:
+        setattr(instance, digest_field, '')
+
+
+# Registered ahead of invalidate_catalog_cache so pages re-rendered after the
+# version bump already pick up the new derivatives.
+@receiver(post_save, sender=Item)
+@receiver(post_save, sender=Category)
+def generate_image_derivatives(sender, instance, raw=False, **kwargs):
+    image_field, digest_field = image_fields(sender)
+    image = getattr(instance, image_field)
+    if raw or getattr(instance, digest_field) or not image:
+        return
+    digest = safe_generate_derivatives(image.name)
+    if digest:
+        setattr(instance, digest_field, digest)
+        sender.objects.filter(pk=instance.pk).update(**{digest_field: digest})
+
+
+@receiver(pre_save, sender=Rating)
+def remember_stored_review(sender, instance, raw=False, **kwargs):
+    if not raw and instance.pk:
+        instance._stored_review = Rating.objects.filter(
+            pk=instance.pk).values_list('item', 'value').first()
+
+
+# Also ahead of invalidate_catalog_cache, for the item's rating aggregates.
+@receiver(post_save, sender=Rating)
+def update_rating_aggregates(sender, instance, raw=False, **kwargs):
+    if not raw:
+        review_saved(instance, instance.__dict__.pop('_stored_review', None))
+
+
+@receiver(post_delete, sender=Rating)
+def remove_from_rating_aggregates(sender, instance, **kwargs):
+    review_deleted(instance)
+
+
+@receiver(post_save, sender=Item)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Item)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Rating)
+def invalidate_catalog_cache(sender, **kwargs):
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=Item)
+def index_item(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_items([instance])
+
+
+@receiver(post_save, sender=Category)
+def index_category_items(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_items(Item.objects.filter(category=instance).select_related('category'))
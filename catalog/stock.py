@@ -0,0 +1,180 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from .models import OrderItem, Reservation, Stock
+
+
+class OutOfStock(Exception):
+    def __init__(self, items):
+        self.items = items
+        super().__init__(', '.join(str(item) for item in items))
+
+
+def reservation_expiry():
+    return timezone.now() + timedelta(seconds=settings.STOCK_RESERVATION_TIMEOUT)
+
+
+def per_item(amounts):
+    # {item id: n} as one SQL expression, so a single UPDATE can move a
+    # different amount on every row it touches.
+    return Case(
+        *[When(pk=item_id, then=Value(amount)) for item_id, amount in amounts.items()],
+        default=Value(0), output_field=IntegerField())
+
+
+class PartialUpdate(Exception):
+    pass
+
+
+def update_all_or_none(item_ids, condition, **changes):
+    """
+    One UPDATE over the Stock rows of ``item_ids``, kept only if every one of
+    them matched ``condition``. Returns whether it was kept.
+    """
+    try:
+        with transaction.atomic():
+            updated = Stock.objects.filter(condition, pk__in=item_ids).update(**changes)
+            if updated != len(item_ids):
+                raise PartialUpdate
+    except PartialUpdate:
+        return False
+    return True
+
+
+def sold_out(amounts, reserved_by_user=None):
+    reserved_by_user = reserved_by_user or {}
+    return [
+        stock.item for stock in Stock.objects.select_related('item').filter(pk__in=amounts)
+        if stock.available + reserved_by_user.get(stock.pk, 0) < amounts[stock.pk]
+    ]
+
+
+def reserve(user, item, quantity=1):
+    """
+    Hold ``quantity`` more of ``item`` for ``user``'s cart. Raises OutOfStock
+    if not enough is available; untracked items are always available. Runs
+    in the caller's transaction, the cart mutation holding the order lock.
+
+    The check and the increment are one conditional UPDATE rather than a
+    locked read followed by a write, so a hot item's row is only locked for
+    the statement and commit, never across a round trip to Python.
+    """
+    held = Stock.objects.filter(
+        pk=item.pk, on_hand__gte=F('reserved') + quantity,
+    ).update(reserved=F('reserved') + quantity)
+    if not held:
+        if Stock.objects.filter(pk=item.pk).exists():
+            raise OutOfStock([item])
+        return
+    expires_at = reservation_expiry()
+    if not Reservation.objects.filter(user=user, item=item).update(
+            quantity=F('quantity') + quantity, expires_at=expires_at):
+        Reservation.objects.create(
+            user=user, item=item, quantity=quantity, expires_at=expires_at)
+
+
+def release(user, item, quantity=None):
+    """
+    Give back ``quantity`` (default: all) of ``user``'s hold on ``item``, in
+    the caller's transaction.
+    """
+    reservation = Reservation.objects.select_for_update() \
+        .filter(user=user, item=item).first()
+    if reservation is None:
+        return
+    if quantity is None or quantity >= reservation.quantity:
+        quantity = reservation.quantity
+        reservation.delete()
+    else:
+        Reservation.objects.filter(pk=reservation.pk).update(
+            quantity=F('quantity') - quantity)
+    Stock.objects.filter(pk=item.pk, reserved__gte=quantity).update(
+        reserved=F('reserved') - quantity)
+
+
+def tracked_lines(order):
+    return dict(
+        OrderItem.objects.filter(order=order, item__stock__isnull=False)
+        .values_list('item', 'quantity'))
+
+
+def held_by(user, item_ids):
+    # Locked, so release_expired cannot hand the same holds back to stock
+    # while the caller's transaction turns them into sales or renews them.
+    return dict(
+        Reservation.objects.select_for_update().filter(user=user, item__in=item_ids)
+        .values_list('item', 'quantity'))
+
+
+def reserve_order(order):
+    """
+    Make ``order.user``'s reservations match the order's lines exactly and
+    restart their clock, before the card is charged. Raises OutOfStock
+    naming the items that cannot be covered.
+    """
+    lines = tracked_lines(order)
+    if not lines:
+        return
+    with transaction.atomic():
+        held = held_by(order.user, lines)
+        change = {
+            item_id: quantity - held.get(item_id, 0)
+            for item_id, quantity in lines.items() if quantity != held.get(item_id, 0)
+        }
+        needed = per_item(change)
+        if change and not update_all_or_none(
+                change, Q(on_hand__gte=F('reserved') + needed),
+                reserved=F('reserved') + needed):
+            raise OutOfStock(sold_out(lines, held))
+        Reservation.objects.filter(user=order.user, item__in=lines).delete()
+        expires_at = reservation_expiry()
+        Reservation.objects.bulk_create([
+            Reservation(user=order.user, item_id=item_id, quantity=quantity,
+                        expires_at=expires_at)
+            for item_id, quantity in lines.items()
+        ])
+
+
+def consume_order(order):
+    """
+    Take the order's units off the shelf as it is finalized, turning the
+    user's reservations into sales. One conditional UPDATE covers every
+    tracked line and only succeeds if each has enough stock, counting the
+    units the user already holds. Must run inside the finalizing
+    transaction; raises OutOfStock otherwise.
+    """
+    lines = tracked_lines(order)
+    if not lines:
+        return
+    held = held_by(order.user, lines)
+    needed, released = per_item(lines), per_item(held)
+    if not update_all_or_none(
+            lines, Q(on_hand__gte=F('reserved') - released + needed),
+            on_hand=F('on_hand') - needed, reserved=F('reserved') - released):
+        raise OutOfStock(sold_out(lines, held))
+    Reservation.objects.filter(user=order.user, item__in=lines).delete()
+
+
+def release_expired(batch_size=1000):
+    """Hand expired reservations back to stock; returns how many were released."""
+    released = 0
+    while True:
+        with transaction.atomic():
+            expired = list(
+                Reservation.objects.select_for_update()
+                .filter(expires_at__lte=timezone.now())
+                .order_by('expires_at')
+                .values_list('pk', 'item', 'quantity')[:batch_size])
+            if not expired:
+                return released
+            totals = {}
+            for _, item_id, quantity in expired:
+                totals[item_id] = totals.get(item_id, 0) + quantity
+            Reservation.objects.filter(pk__in=[pk for pk, _, _ in expired]).delete()
+            Stock.objects.filter(pk__in=totals).update(
+                reserved=F('reserved') - per_item(totals))
+            released += len(expired)
@@ -0,0 +1,130 @@
+import json
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.db.models import F
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import Order, Task
+
+logger = logging.getLogger(__name__)
+
+REGISTRY = {}
+RETRY_DELAY = timedelta(seconds=30)
+MAX_RETRY_DELAY = timedelta(hours=1)
+
+
+def task(fn):
+    """Register ``fn`` so queued rows naming it can be run by the worker."""
+    REGISTRY[fn.__name__] = fn
+    return fn
+
+
+def enqueue(fn, delay=None, max_attempts=5, **kwargs):
+    """
+    Queue ``fn(**kwargs)`` for the worker. The row is written in the
+    caller's transaction, so work queued alongside an order change only
+    runs if that change commits.
+    """
+    if fn.__name__ not in REGISTRY:
+        raise ValueError(f'{fn.__name__} is not a registered task')
+    return Task.objects.create(
+        name=fn.__name__, payload=json.dumps(kwargs),
+        run_after=timezone.now() + (delay or timedelta()),
+        max_attempts=max_attempts)
+
+
+def enqueue_many(fn, kwargs_list, max_attempts=5):
+    """``enqueue`` for many calls of ``fn`` at once, in one INSERT."""
+    if fn.__name__ not in REGISTRY:
+        raise ValueError(f'{fn.__name__} is not a registered task')
+    now = timezone.now()
+    return Task.objects.bulk_create([
+        Task(name=fn.__name__, payload=json.dumps(kwargs), run_after=now,
+             max_attempts=max_attempts)
+        for kwargs in kwargs_list
+    ])
+
+
+def claim(limit):
+    """
+    Mark up to ``limit`` due tasks as running and return them. Each claim is
+    a conditional UPDATE, so concurrent workers never run the same row, and
+    it needs nothing beyond what SQLite offers.
+    """
+    now = timezone.now()
+    due = Task.objects.filter(status=Task.QUEUED, run_after__lte=now) \
+        .order_by('run_after', 'id').values_list('pk', flat=True)[:limit]
+    claimed = [
+        pk for pk in due
+        if Task.objects.filter(pk=pk, status=Task.QUEUED).update(
+            status=Task.RUNNING, locked_at=now, attempts=F('attempts') + 1)
+    ]
+    return list(Task.objects.filter(pk__in=claimed).order_by('run_after', 'id'))
+
+
+def retry_delay(attempts):
+    return min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+
+def run(task_row):
+    try:
+        REGISTRY[task_row.name](**json.loads(task_row.payload))
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning('Task %s failed on attempt %s', task_row, task_row.attempts,
+                       exc_info=True)
+        if task_row.attempts >= task_row.max_attempts:
+            task_row.status = Task.FAILED
+        else:
+            task_row.status = Task.QUEUED
+            task_row.run_after = timezone.now() + retry_delay(task_row.attempts)
+        task_row.last_error = error
+    else:
+        task_row.status = Task.DONE
+    task_row.locked_at = None
+    task_row.save(update_fields=['status', 'run_after', 'locked_at', 'last_error'])
+    return task_row.status == Task.DONE
+
+
+def requeue_stale(older_than):
+    """Hand back tasks whose worker died before finishing them."""
+    return Task.objects.filter(
+        status=Task.RUNNING, locked_at__lt=timezone.now() - older_than,
+    ).update(status=Task.QUEUED, locked_at=None)
+
+
+def run_pending(batch_size=20):
+    """Run due tasks until none are left; returns how many were run."""
+    count = 0
+    while True:
+        batch = claim(batch_size)
+        if not batch:
+            return count
+        for task_row in batch:
+            run(task_row)
+        count += len(batch)
+
+
+@task
+def send_order_confirmation(order_id):
+    order = Order.objects.with_details().select_related('user').get(pk=order_id)
+    if not order.user.email:
+        return
+    context = {'order': order, 'user': order.user}
+    message = EmailMultiAlternatives(
+        subject=f"Your Butek's Online order {order.ref_code}",
+        body=render_to_string('emails/order_confirmation.txt', context),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[order.user.email],
+    )
+    message.attach_alternative(
+        render_to_string('emails/order_confirmation.html', context), 'text/html')
+    message.attach(
+        f'receipt-{order.ref_code}.txt',
+        render_to_string('emails/receipt.txt', context), 'text/plain')
+    message.send()
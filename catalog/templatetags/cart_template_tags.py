@@ -1,12 +1,8 @@
 from django import template
-from catalog.models import Order
+from catalog.cart import get_cart_item_count
 
 register = template.Library()
 
 @register.filter
 def cart_item_count(user):
-    if user.is_authenticated:
-        order_qs = Order.objects.filter(user=user, ordered=False)
-        if order_qs.exists():
-            return order_qs[0].items.count()
-    return 0
+    return get_cart_item_count(user)
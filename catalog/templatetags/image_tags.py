@@ -0,0 +1,45 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from catalog.images import DERIVATIVE_WIDTHS, derivative_url, image_fields
+
+register = template.Library()
+
+
+def candidate_widths(width):
+    # Enough pixels for 2x screens at the displayed ``width``, nothing larger.
+    wanted = [w for w in DERIVATIVE_WIDTHS if w < width * 2]
+    larger = [w for w in DERIVATIVE_WIDTHS if w >= width * 2]
+    return wanted + larger[:1]
+
+
+def srcset(name, digest, widths, fmt):
+    return ', '.join(
+        f'{derivative_url(name, digest, w, fmt)} {w}w' for w in widths)
+
+
+@register.simple_tag
+def responsive_image(obj, width, alt='', **attrs):
+    """
+    ``<picture>`` for the image of an Item or Category shown ``width`` CSS
+    pixels wide: WebP with a JPEG fallback, each with a srcset the browser
+    picks from. Objects without derivatives yet get a plain ``<img>``.
+    """
+    image_field, digest_field = image_fields(type(obj))
+    image, digest = getattr(obj, image_field), getattr(obj, digest_field)
+    extra = format_html_join(' ', '{}="{}"', attrs.items())
+    if not digest:
+        return format_html('<img src="{}" alt="{}" {}>', image.url, alt, extra)
+
+    width = int(width)
+    widths = candidate_widths(width)
+    fallback = next(w for w in widths if w >= width or w == widths[-1])
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}px">'
+        '<img src="{}" srcset="{}" sizes="{}px" alt="{}" loading="lazy" {}>'
+        '</picture>',
+        srcset(image.name, digest, widths, 'webp'), width,
+        derivative_url(image.name, digest, fallback, 'jpeg'),
+        srcset(image.name, digest, widths, 'jpeg'), width, alt, extra,
+    )
@@ -0,0 +1,20 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+register = template.Library()
+
+
+def star_classes(average):
+    # Rounded to the nearest half star.
+    halves = round(average * 2)
+    return ['fas fa-star'] * (halves // 2) + ['fas fa-star-half-alt'] * (halves % 2) \
+        + ['far fa-star'] * (5 - (halves + 1) // 2)
+
+
+@register.simple_tag
+def star_rating(average, colour='text-primary'):
+    """Five Font Awesome stars showing ``average``, e.g. an item's rating_average."""
+    return format_html(
+        '<span title="{} out of 5">{}</span>', f'{average:.1f}',
+        format_html_join('', '<span><i class="{} {}"></i></span>',
+                         ((icon, colour) for icon in star_classes(average))))
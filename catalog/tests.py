@@ -1,3 +1,1557 @@
-from django.test import TestCase
+import base64
+import importlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import stripe
+from asgiref.sync import async_to_sync
+from django.apps import apps as django_apps
+from django.contrib.auth.models import Permission, User
+from django.contrib.messages import get_messages
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, OperationalError, connection, router, transaction
+from django.db.utils import load_backend
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test import (
+    RequestFactory, TestCase, TransactionTestCase, override_settings, skipUnlessAnyDBFeature,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from .pagination import encode_cursor
+from . import (
+    audit, benchmarks, bulk, cart, images, loadtest, metrics, orders, payments, reporting,
+    reviews, routers, search, stock, tasks, transfer,
+)
+from .asgi import CachedCatalogPages
+from .caching import CATALOG_CHANGED_KEY
+from .forms import SHOP_MAX_PAGE_SIZE
+from .fake_stripe import FakeStripe
+from .models import (
+    Address, AuditLog, BulkJob, Category, Coupon, DailyCategorySales, DailyCouponUsage,
+    DailyItemSales, DailySales, Item, Order, OrderItem, Payment, Rating, Refund, Reservation,
+    Stock, Task,
+)
+
+
+def make_item(title, price, discount_price=None, category=None):
+    return Item.objects.create(
+        title=title, slug=title.lower().replace(' ', '-'), price=price,
+        discount_price=discount_price, description=title, label='P',
+        category=category)
+
+
+def use_fake_stripe(test):
+    fake = FakeStripe().__enter__()
+    test.addCleanup(fake.__exit__)
+    settings_override = override_settings(STRIPE_API_BASE=fake.url)
+    settings_override.enable()
+    test.addCleanup(settings_override.disable)
+    return fake
+
+
+class OrderTotalsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('shopper', password='secret')
+        self.client.force_login(self.user)
+        category = Category.objects.create(name='Shirt')
+        self.shirt = make_item('Red Shirt', 250, 240, category)
+        self.skates = make_item('Skates', 300, category=category)
+
+    def order(self):
+        return Order.objects.get(user=self.user, ordered=False)
+
+    def assertTotals(self, order, subtotal, discount, total):
+        self.assertEqual(
+            (order.subtotal, order.discount, order.total),
+            (subtotal, discount, total))
+        self.assertEqual(order.calculate_totals(), (subtotal, discount, total))
+
+    def test_cart_mutations_maintain_totals(self):
+        self.client.get(reverse('add_to_cart', args=[self.shirt.slug]))
+        self.client.get(reverse('add_to_cart', args=[self.shirt.slug]))
+        self.client.get(reverse('add_to_cart', args=[self.skates.slug]))
+        self.assertTotals(self.order(), 780, 0, 780)
+
+        self.client.get(reverse('remove_single_from_cart', args=[self.shirt.slug]))
+        self.assertTotals(self.order(), 540, 0, 540)
+
+        self.client.get(reverse('remove_from_cart', args=[self.skates.slug]))
+        self.assertTotals(self.order(), 240, 0, 240)
+
+    def test_coupon_sets_discount(self):
+        Coupon.objects.create(code='FIRST_TIMER', amount=40)
+        self.client.get(reverse('add_to_cart', args=[self.skates.slug]))
+        self.client.post(reverse('add_coupon'), {'code': 'FIRST_TIMER'})
+        self.assertTotals(self.order(), 300, 40, 260)
+
+    def test_mutations_run_bounded_queries(self):
+        cart.add_item(self.user, self.shirt)
+        # Savepoint, order lock, stock reservation and its fallback check
+        # (the shirt is not stock tracked), line lookup, line and order
+        # updates, release.
+        with self.assertNumQueries(8):
+            order, line = cart.add_item(self.user, self.shirt)
+        self.assertEqual((line.quantity, order.total), (2, 480))
+        with self.assertNumQueries(8):
+            order, line = cart.remove_item(self.user, self.shirt, quantity=None)
+        self.assertEqual((line.quantity, order.total), (0, 0))
+
+    def test_one_open_order_per_user(self):
+        self.client.get(reverse('add_to_cart', args=[self.shirt.slug]))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Order.objects.create(user=self.user)
+        Order.objects.filter(user=self.user).update(ordered=True)
+        Order.objects.create(user=self.user)
+
+    def test_reconcile_fixes_drift(self):
+        self.client.get(reverse('add_to_cart', args=[self.skates.slug]))
+        Item.objects.filter(pk=self.skates.pk).update(price=350)
+
+        out = StringIO()
+        call_command('reconcile_order_totals', '--dry-run', stdout=out)
+        self.assertIn('found 1', out.getvalue())
+        self.assertEqual(self.order().total, 300)
+
+        call_command('reconcile_order_totals', stdout=out)
+        self.assertTotals(self.order(), 350, 0, 350)
+
+
+class DeduplicateMigrationTests(TestCase):
+    def setUp(self):
+        # Let the rows 0005 cleans up be created again; the test's
+        # transaction rollback restores the constraints.
+        with connection.cursor() as cursor:
+            for name in ('unique_open_order_item', 'unique_open_order_per_user'):
+                cursor.execute(f'DROP INDEX {connection.ops.quote_name(name)}')
+        self.shirt = make_item('Red Shirt', 250, 240)
+        self.skates = make_item('Skates', 300)
+
+    def open_order(self, user, *lines):
+        order = Order.objects.create(user=user)
+        order.items.add(*[
+            OrderItem.objects.create(user=user, item=item, quantity=quantity)
+            for item, quantity in lines])
+        return order
+
+    def test_duplicates_are_merged_and_totals_recomputed(self):
+        one, two = User.objects.create(username='one'), User.objects.create(username='two')
+        single = self.open_order(one, (self.shirt, 2), (self.shirt, 3))
+        first = self.open_order(two, (self.skates, 1))
+        second = self.open_order(two, (self.shirt, 1))
+        second.items.add(OrderItem.objects.create(user=two, item=self.skates, quantity=2))
+
+        migration = importlib.import_module(
+            'catalog.migrations.0005_lookup_indexes_and_constraints')
+        migration.deduplicate(django_apps, None)
+
+        single.refresh_from_db()
+        self.assertEqual(list(single.items.values_list('item', 'quantity')),
+                         [(self.shirt.pk, 5)])
+        self.assertEqual((single.subtotal, single.total), (1200, 1200))
+        self.assertEqual(list(Order.objects.filter(user=two)), [first])
+        first.refresh_from_db()
+        self.assertEqual(
+            sorted(first.items.values_list('item', 'quantity')),
+            [(self.shirt.pk, 1), (self.skates.pk, 3)])
+        self.assertEqual((first.subtotal, first.total), (1140, 1140))
+        self.assertEqual(OrderItem.objects.count(), 3)
+
+
+class OrderPageQueryBudgetTests(TestCase):
+    # Queries a page may run, whatever the cart size or order history length.
+    QUERY_BUDGET = 5
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('shopper', password='secret')
+        self.client.force_login(self.user)
+        self.category = Category.objects.create(name='Shirt')
+        self.coupon = Coupon.objects.create(code='FIRST_TIMER', amount=10)
+        self.address = Address.objects.create(
+            user=self.user, street_address='1 Main St', country='KE',
+            zip='00100', use_default=False, payment_option='S')
+
+    def fill_cart(self, count):
+        for i in range(count):
+            item = make_item(f'Item {Item.objects.count()}', 100, 90, self.category)
+            self.client.get(reverse('add_to_cart', args=[item.slug]))
+        Order.objects.filter(user=self.user, ordered=False).update(
+            coupon=self.coupon, address=self.address)
+
+    def place_orders(self, count):
+        for i in range(count):
+            self.fill_cart(3)
+            payment = Payment.objects.create(
+                user=self.user, charge_id=f'ch_{i}', amount=100)
+            order = Order.objects.get(user=self.user, ordered=False)
+            order.items.update(ordered=True)
+            Order.objects.filter(pk=order.pk).update(
+                ordered=True, payment=payment, ref_code=f'ref{i}')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertFlatQueryCount(self, url, grow):
+        grow(1)
+        small = self.count_queries(url)
+        grow(8)
+        large = self.count_queries(url)
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, self.QUERY_BUDGET)
+
+    def test_order_summary(self):
+        self.assertFlatQueryCount(reverse('order_summary'), self.fill_cart)
+
+    def test_checkout(self):
+        self.assertFlatQueryCount(reverse('checkout'), self.fill_cart)
+
+    def test_payment(self):
+        self.assertFlatQueryCount(
+            reverse('payment', args=['stripe']), self.fill_cart)
+
+    def test_profile(self):
+        self.assertFlatQueryCount(reverse('profile'), self.place_orders)
+
+
+class CartBadgeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('shopper', password='secret')
+        self.client.force_login(self.user)
+        self.shirt = make_item('Red Shirt', 250, 240)
+
+    def order_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, [
+            q['sql'] for q in queries if 'catalog_order' in q['sql']]
+
+    def test_count_is_cached_between_requests(self):
+        response, queries = self.order_queries(reverse('home'))
+        self.assertEqual(response.context['cart_item_count'], 0)
+        self.assertEqual(len(queries), 1)
+
+        response, queries = self.order_queries(reverse('home'))
+        self.assertEqual(response.context['cart_item_count'], 0)
+        self.assertEqual(queries, [])
+
+    def test_cart_mutations_invalidate_count(self):
+        self.client.get(reverse('home'))
+        self.client.get(reverse('add_to_cart', args=[self.shirt.slug]))
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response.context['cart_item_count'], 1)
+
+        self.client.get(reverse('remove_from_cart', args=[self.shirt.slug]))
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response.context['cart_item_count'], 0)
+
+
+class ShopPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.shirts = Category.objects.create(name='Shirt')
+        self.shoes = Category.objects.create(name='Shoes')
+        for i in range(10):
+            make_item(f'Shirt {i}', 100 + (i % 3) * 50, category=self.shirts)
+            make_item(f'Shoe {i}', 200, category=self.shoes)
+
+    def walk(self, params):
+        titles, query = [], params
+        while True:
+            response = self.client.get(reverse('shop') + '?' + query)
+            titles.extend(item.title for item in response.context['items'])
+            query = response.context.get('next_query')
+            if not query:
+                return titles, response
+
+    def test_pages_cover_listing_in_order(self):
+        titles, last = self.walk('size=3&sort=-price')
+        expected = [item.title for item in Item.objects.order_by('-price', '-id')]
+        self.assertEqual(titles, expected)
+
+        # Walking back from the last page returns the previous rows.
+        response = self.client.get(
+            reverse('shop') + '?' + last.context['previous_query'])
+        self.assertEqual(
+            [item.title for item in response.context['items']], expected[-5:-2])
+
+    def test_filters(self):
+        titles, _ = self.walk(
+            f'size=4&category={self.shirts.pk}&min_price=150&max_price=150')
+        self.assertEqual(titles, ['Shirt 1', 'Shirt 4', 'Shirt 7'])
+
+    def test_page_size_is_capped(self):
+        for i in range(30):
+            make_item(f'Hat {i}', 50)
+        response = self.client.get(reverse('shop_list') + '?size=1000')
+        self.assertEqual(len(response.context['items']), SHOP_MAX_PAGE_SIZE)
+
+    def test_page_is_single_bounded_query(self):
+        cursor = encode_cursor([150, 5])
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('shop') + f'?sort=price&after={cursor}')
+        item_queries = [q['sql'] for q in queries if 'catalog_item' in q['sql']]
+        self.assertEqual(len(item_queries), 1)
+        self.assertIn('LIMIT 13', item_queries[0])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('shop') + '?after=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+    def test_out_of_range_numbers_are_rejected(self):
+        huge = '1' + '0' * 30
+        for query in (f'min_price={huge}', f'max_price={huge}', f'category={huge}',
+                      f'category=-{huge}'):
+            response = self.client.get(reverse('shop') + '?' + query)
+            self.assertEqual(response.status_code, 200, query)
+        cursors = ([10 ** 30], [1.5, 10 ** 25], [True, 1])
+        for values in cursors:
+            response = self.client.get(
+                reverse('shop') + f'?sort=price&after={encode_cursor(values)}')
+            self.assertEqual(response.status_code, 404, values)
+        for raw in (b'[NaN,1]', b'[Infinity,1]', b'[-Infinity,1]'):
+            cursor = base64.urlsafe_b64encode(raw).decode().rstrip('=')
+            response = self.client.get(reverse('shop') + f'?sort=price&after={cursor}')
+            self.assertEqual(response.status_code, 404, raw)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite backend')
+class SQLiteBackendTests(TestCase):
+    def test_file_databases_use_wal_and_immediate_transactions(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings_dict = {**connection.settings_dict,
+                         'NAME': os.path.join(directory, 'shop.sqlite3'),
+                         'OPTIONS': {'pragmas': {'busy_timeout': 0}}}
+        backend = load_backend('catalog.backends.sqlite3')
+        first, second = (backend.DatabaseWrapper(settings_dict, alias) for alias in 'ab')
+        self.addCleanup(second.close)
+        self.addCleanup(first.close)
+        with first.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone(), ('wal',))
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone(), (1,))
+        self.assertTrue(first.features.serializes_write_transactions)
+
+        # The write lock is taken by BEGIN itself, before any statement.
+        first._start_transaction_under_autocommit()
+        with self.assertRaisesMessage(OperationalError, 'database is locked'):
+            second._start_transaction_under_autocommit()
+        first.connection.rollback()
+
+
+# Needs a backend where concurrent transactions wait for each other: row
+# locks, or the write lock BEGIN IMMEDIATE takes on a SQLite file, as the
+# settings give SQLite tests. An in-memory SQLite test database fails them
+# with "table is locked" instead.
+@skipUnlessAnyDBFeature('has_select_for_update', 'serializes_write_transactions')
+class ConcurrentCartTests(TransactionTestCase):
+    ADDS = 40
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('shopper', password='secret')
+        self.item = make_item('Red Shirt', 250, 240)
+
+    def add(self, n):
+        try:
+            cart.add_item(self.user, self.item)
+        finally:
+            connection.close()
+
+    def test_parallel_adds_do_not_lose_increments(self):
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(self.add, range(self.ADDS)))
+
+        order = Order.objects.get(user=self.user, ordered=False)
+        line = order.items.get()
+        self.assertEqual(line.quantity, self.ADDS)
+        self.assertEqual(order.total, self.ADDS * 240)
+
+
+class SessionStorageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('shopper', password='secret')
+        self.client.force_login(self.user)
+        self.item = make_item('Red Shirt', 250)
+
+    def session_queries(self, url):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url)
+        return response, [q['sql'] for q in captured if 'django_session' in q['sql']]
+
+    def test_cached_sessions_skip_the_database(self):
+        self.assertEqual(self.session_queries(reverse('profile'))[1], [])
+        cache.clear()
+        self.assertEqual(len(self.session_queries(reverse('profile'))[1]), 1)
+        self.assertEqual(self.session_queries(reverse('profile'))[1], [])
+
+    def test_flash_messages_do_not_save_the_session(self):
+        response, queries = self.session_queries(reverse('add_to_cart', args=[self.item.slug]))
+        self.assertEqual(queries, [])
+        self.assertIn('was added to your cart', response.cookies['messages'].value)
+
+
+class CartApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('shopper', password='secret')
+        self.client.force_login(self.user)
+        self.shirt = make_item('Red Shirt', 250, 240)
+        self.skates = make_item('Skates', 300)
+
+    def post(self, name, item):
+        return self.client.post(reverse(name, args=[item.slug])).json()
+
+    def test_mutations_return_updated_line_and_totals(self):
+        self.post('api_cart_add', self.shirt)
+        data = self.post('api_cart_add', self.shirt)
+        self.assertEqual(data['line'], {
+            'slug': 'red-shirt', 'title': 'Red Shirt', 'quantity': 2,
+            'unit_price': 240, 'price': 480})
+        self.assertEqual((data['item_count'], data['total']), (1, 480))
+
+        data = self.post('api_cart_add', self.skates)
+        self.assertEqual((data['item_count'], data['total']), (2, 780))
+
+        data = self.post('api_cart_remove_single', self.shirt)
+        self.assertEqual((data['line']['quantity'], data['total']), (1, 540))
+
+        data = self.post('api_cart_remove', self.skates)
+        self.assertEqual(data['line']['quantity'], 0)
+        self.assertEqual((data['item_count'], data['total']), (1, 240))
+
+        data = self.client.get(reverse('api_cart')).json()
+        self.assertEqual([line['slug'] for line in data['lines']], ['red-shirt'])
+
+    def test_errors(self):
+        response = self.client.post(reverse('api_cart_remove', args=['skates']))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(reverse('api_cart_add', args=['skates']))
+        self.assertEqual(response.status_code, 405)
+        self.client.logout()
+        response = self.client.get(reverse('api_cart'))
+        self.assertEqual(response.status_code, 401)
+
+
+class SessionCartTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            'shopper', email='shopper@example.com', password='secret')
+        self.shirt = make_item('Red Shirt', 250, 240)
+        self.skates = make_item('Skates', 300)
+
+    def test_anonymous_cart_lives_in_session(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('add_to_cart', args=[self.shirt.slug]))
+            self.client.get(reverse('add_to_cart', args=[self.shirt.slug]))
+            self.client.get(reverse('add_to_cart', args=[self.skates.slug]))
+            self.client.get(reverse('remove_single_from_cart', args=[self.skates.slug]))
+            self.client.get(reverse('add_to_cart', args=[self.skates.slug]))
+        writes = [q['sql'] for q in queries
+                  if 'catalog_' in q['sql'] and not q['sql'].startswith('SELECT')]
+        self.assertEqual(writes, [])
+        self.assertFalse(Order.objects.exists())
+
+        response = self.client.get(reverse('order_summary'))
+        self.assertEqual(response.context['objects'].get_total(), 780)
+        self.assertEqual(response.context['cart_item_count'], 2)
+
+    def test_merge_on_login(self):
+        cart.add_item(self.user, self.shirt)
+        self.client.get(reverse('add_to_cart', args=[self.shirt.slug]))
+        self.client.get(reverse('add_to_cart', args=[self.skates.slug]))
+
+        self.client.post(reverse('account_login'), {
+            'login': 'shopper', 'password': 'secret'})
+
+        order = Order.objects.get(user=self.user, ordered=False)
+        self.assertEqual(
+            sorted(order.items.values_list('item__slug', 'quantity')),
+            [('red-shirt', 2), ('skates', 1)])
+        self.assertEqual(order.total, 780)
+        self.assertNotIn(cart.SESSION_CART_KEY, self.client.session)
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.shirts = Category.objects.create(name='Shirt')
+        self.shirt = make_item('Red Shirt', 250, 240, self.shirts)
+        make_item('Blue Shirt', 250, 240, self.shirts)
+
+    def catalog_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, [q for q in queries if 'catalog_' in q['sql']]
+
+    def test_anonymous_pages_are_served_from_cache(self):
+        for url in [reverse('home'), reverse('shop'), reverse('shop_list') + '?sort=price',
+                    reverse('detail', args=[self.shirt.slug])]:
+            self.client.get(url)
+            with self.assertNumQueries(0):
+                response = self.client.get(url)
+            self.assertContains(response, 'Red Shirt')
+
+    def test_saves_invalidate_cached_pages(self):
+        self.client.get(reverse('home'))
+        self.shirt.title = 'Green Shirt'
+        self.shirt.save()
+        response = self.client.get(reverse('home'))
+        self.assertContains(response, 'Green Shirt')
+
+        Item.objects.get(title='Blue Shirt').delete()
+        response = self.client.get(reverse('shop'))
+        self.assertNotContains(response, 'Blue Shirt')
+
+    def test_fragments_are_cached_for_logged_in_users(self):
+        user = User.objects.create_user('shopper', password='secret')
+        self.client.force_login(user)
+        for url in [reverse('home'), reverse('detail', args=[self.shirt.slug])]:
+            self.client.get(url)
+            # The navbar cart count is cached per user as well.
+            response, queries = self.catalog_queries(url)
+            self.assertEqual(queries, [])
+            self.assertContains(response, 'Blue Shirt')
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.shirts = Category.objects.create(name='Shirt')
+        self.denim = make_item('Denim Jacket', 500, category=Category.objects.create(name='Jackets'))
+        self.shirt = make_item('Red Shirt', 250, 240, self.shirts)
+        self.skates = make_item('Skates', 300, category=self.shirts)
+        self.skates.description = 'Skates that go with any red shirt'
+        self.skates.save()
+
+    def test_title_matches_rank_first(self):
+        self.assertEqual(search.search('red shirt'), [self.shirt, self.skates])
+
+    def test_every_word_must_match_and_last_is_a_prefix(self):
+        self.assertEqual(search.search('den'), [self.denim])
+        self.assertEqual(search.search('denim sh'), [])
+        self.assertEqual(search.search('the'), [])
+
+    def test_saves_reindex_items(self):
+        self.denim.title = self.denim.description = 'Blue Coat'
+        self.denim.save()
+        self.assertEqual(search.search('denim'), [])
+        self.assertEqual(search.search('coat'), [self.denim])
+
+        self.shirts.name = 'Tops'
+        self.shirts.save()
+        self.assertEqual(search.search('tops'), [self.shirt, self.skates])
+
+    def test_search_page_and_suggestions(self):
+        response = self.client.get(reverse('search'), {'q': 'skat'})
+        self.assertContains(response, 'Skates')
+        self.assertNotContains(response, 'Denim Jacket')
+
+        response = self.client.get(reverse('search_suggest'), {'q': 'red sh'})
+        self.assertEqual(response.json(), {'terms': ['shirt']})
+
+
+def png_upload(name, size=(900, 600), color='red'):
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.item = make_item('Red Shirt', 250)
+
+    def render(self, item):
+        return Template(
+            '{% load image_tags %}{% responsive_image item 130 class="cart-img" %}'
+        ).render(Context({'item': item}))
+
+    def test_uploads_get_hashed_derivatives(self):
+        self.assertEqual(self.item.image_digest, '')
+        self.assertIn('src="/media/default.jpg"', self.render(self.item))
+
+        self.item.image = png_upload('shirt.png')
+        self.item.save()
+        digest = Item.objects.get(pk=self.item.pk).image_digest
+        self.assertEqual(len(digest), images.DIGEST_LENGTH)
+        for width in images.DERIVATIVE_WIDTHS:
+            for fmt in images.DERIVATIVE_FORMATS:
+                name = images.derivative_name(self.item.image.name, digest, width, fmt)
+                self.assertTrue(default_storage.exists(name), name)
+        with default_storage.open(images.derivative_name(
+                self.item.image.name, digest, 160, 'webp')) as f:
+            self.assertEqual(Image.open(f).size, (160, 107))
+
+        html = self.render(self.item)
+        self.assertIn(f'.{digest}.160w.webp 160w', html)
+        self.assertIn(f'.{digest}.320w.jpg 320w', html)
+        self.assertNotIn('640w', html)
+        self.assertIn(f'src="/media/derivatives/product_images/shirt.{digest}.160w.jpg"', html)
+
+        # A new upload renames every derivative.
+        self.item.image = png_upload('shirt.png', color='blue')
+        self.item.save()
+        self.assertNotEqual(self.item.image_digest, digest)
+
+    def test_oversized_uploads_are_saved_without_derivatives(self):
+        self.addCleanup(setattr, Image, 'MAX_IMAGE_PIXELS', Image.MAX_IMAGE_PIXELS)
+        # Over twice the limit: Pillow raises rather than warns.
+        Image.MAX_IMAGE_PIXELS = 1000
+        self.item.image = png_upload('huge.png')
+        with self.assertLogs('catalog.images', 'WARNING'):
+            self.item.save()
+        item = Item.objects.get(pk=self.item.pk)
+        self.assertEqual((item.image.name, item.image_digest), ('product_images/huge.png', ''))
+
+    def test_backfill_command(self):
+        name = default_storage.save('product_images/old.png', png_upload('old.png'))
+        Item.objects.filter(pk=self.item.pk).update(image=name)
+        call_command('generate_image_derivatives', workers=1, stdout=StringIO())
+        self.item.refresh_from_db()
+        self.assertTrue(default_storage.exists(images.derivative_name(
+            name, self.item.image_digest, 80, 'webp')))
+
+
+@tasks.task
+def flaky(fail):
+    if fail:
+        raise ValueError('boom')
+
+
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            'shopper', email='shopper@example.com', password='secret')
+        self.client.force_login(self.user)
+        self.shirt = make_item('Red Shirt', 250, 240)
+
+    def test_payment_queues_confirmation_mail(self):
+        stripe_api = use_fake_stripe(self)
+        self.client.post(reverse('add_to_cart', args=[self.shirt.slug]))
+        response = self.client.post(
+            reverse('payment', args=['stripe']), {'stripeToken': 'tok_visa'})
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        charge, = stripe_api.calls('/v1/charges')
+        self.assertEqual(charge['params']['amount'], '24000')
+
+        order = Order.objects.get(user=self.user)
+        self.assertTrue(order.ordered)
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(
+            sorted(Task.objects.values_list('name', flat=True)),
+            ['record_order_sales', 'send_order_confirmation'])
+
+        call_command('run_tasks', once=True, stdout=StringIO())
+        self.assertEqual(Task.objects.exclude(status=Task.DONE).count(), 0)
+        message, = mail.outbox
+        self.assertEqual(message.to, ['shopper@example.com'])
+        self.assertIn(order.ref_code, message.subject)
+        self.assertIn('1 x Red Shirt  $240', message.body)
+        self.assertIn(order.payment.charge_id, message.attachments[0][1])
+
+    def test_failures_back_off_then_give_up(self):
+        task_row = tasks.enqueue(flaky, max_attempts=2, fail=True)
+        with self.assertLogs('catalog.tasks', 'WARNING'):
+            self.assertEqual(tasks.run_pending(), 1)
+        task_row.refresh_from_db()
+        self.assertEqual((task_row.status, task_row.attempts), (Task.QUEUED, 1))
+        self.assertIn('ValueError: boom', task_row.last_error)
+        # Not due again until the retry delay has passed.
+        self.assertEqual(tasks.run_pending(), 0)
+
+        Task.objects.update(run_after=task_row.created)
+        with self.assertLogs('catalog.tasks', 'WARNING'):
+            tasks.run_pending()
+        task_row.refresh_from_db()
+        self.assertEqual((task_row.status, task_row.attempts), (Task.FAILED, 2))
+
+    def test_claimed_tasks_are_not_run_twice(self):
+        tasks.enqueue(flaky, fail=False)
+        claimed = tasks.claim(10)
+        self.assertEqual(tasks.claim(10), [])
+        Task.objects.update(locked_at=claimed[0].created - timedelta(hours=1))
+        self.assertEqual(tasks.requeue_stale(timedelta(minutes=10)), 1)
+        self.assertEqual(tasks.run_pending(), 1)
+
+
+class OrderFinalizationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('shopper', password='secret')
+        self.client.force_login(self.user)
+        self.items = [make_item(f'Shirt {n}', 100 + n) for n in range(20)]
+
+    def fill_cart(self, count):
+        for item in self.items[:count]:
+            order = cart.add_item(self.user, item)[0]
+        return order
+
+    def test_statement_count_does_not_grow_with_lines(self):
+        counts = []
+        for lines in (2, 20):
+            order = self.fill_cart(lines)
+            with CaptureQueriesContext(connection) as queries:
+                order, created = orders.finalize_order(
+                    order.pk, self.user, f'ch_{lines}', f'key-{lines}')
+            self.assertTrue(created)
+            counts.append(len(queries))
+            self.assertEqual(order.items.filter(ordered=False).count(), 0)
+        self.assertEqual(counts[0], counts[1])
+
+    def test_retries_are_no_ops(self):
+        order = self.fill_cart(3)
+        first, created = orders.finalize_order(order.pk, self.user, 'ch_1', 'key')
+        again, created_again = orders.finalize_order(order.pk, self.user, 'ch_1', 'key')
+        self.assertEqual((created, created_again), (True, False))
+        self.assertEqual(again.ref_code, first.ref_code)
+        self.assertEqual(Payment.objects.count(), 1)
+        # The confirmation mail and the sales rollup update, queued once.
+        self.assertEqual(Task.objects.count(), 2)
+        with self.assertRaises(orders.OrderAlreadyPaid):
+            orders.finalize_order(order.pk, self.user, 'ch_2', 'other-key')
+
+    def test_double_submitted_payment_charges_once(self):
+        stripe_api = use_fake_stripe(self)
+        self.fill_cart(2)
+        for _ in range(2):
+            response = self.client.post(
+                reverse('payment', args=['stripe']), {'stripeToken': 'tok_visa'})
+            self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        charge, = stripe_api.calls('/v1/charges')
+        self.assertEqual(charge['headers']['Idempotency-Key'], 'stripe:tok_visa')
+        self.assertEqual(Payment.objects.get().charge_id, 'ch_2')
+
+    def test_paypal_completion_is_idempotent(self):
+        order = self.fill_cart(2)
+        body = json.dumps({'order_id': order.pk, 'paypal_order_id': 'PAYPAL1'})
+        for _ in range(2):
+            self.client.post(reverse('payment_complete'), body,
+                             content_type='application/json')
+        self.assertEqual(Payment.objects.get().charge_id, 'PAYPAL1')
+
+        body = json.dumps({'order_id': order.pk, 'paypal_order_id': 'PAYPAL2'})
+        response = self.client.post(reverse('payment_complete'), body,
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 409)
+
+
+    def test_key_of_another_order_is_rejected(self):
+        order = self.fill_cart(2)
+        orders.finalize_order(order.pk, self.user, 'PAYPAL1', 'paypal:PAYPAL1')
+        other = User.objects.create_user('other', password='secret')
+        other_order = cart.add_item(other, self.items[0])[0]
+        with self.assertRaises(orders.PaymentAlreadyUsed):
+            orders.finalize_order(other_order.pk, other, 'PAYPAL1', 'paypal:PAYPAL1')
+
+        self.client.force_login(other)
+        body = json.dumps({'order_id': other_order.pk, 'paypal_order_id': 'PAYPAL1'})
+        response = self.client.post(reverse('payment_complete'), body,
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Order.objects.get(pk=other_order.pk).ordered)
+
+
+class StockTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('shopper', password='secret')
+        self.other = User.objects.create_user('rival', password='secret')
+        self.client.force_login(self.user)
+        self.shirt = make_item('Red Shirt', 250)
+        Stock.objects.create(item=self.shirt, on_hand=2)
+
+    def stock(self):
+        return Stock.objects.get(pk=self.shirt.pk)
+
+    def test_cart_holds_units_until_removed(self):
+        cart.add_item(self.user, self.shirt)
+        cart.add_item(self.user, self.shirt)
+        self.assertEqual(self.stock().available, 0)
+        with self.assertRaises(stock.OutOfStock):
+            cart.add_item(self.other, self.shirt)
+
+        cart.remove_item(self.user, self.shirt, quantity=1)
+        self.assertEqual(
+            (self.stock().reserved, Reservation.objects.get().quantity), (1, 1))
+        cart.remove_item(self.user, self.shirt, quantity=None)
+        self.assertEqual(self.stock().reserved, 0)
+        self.assertFalse(Reservation.objects.exists())
+
+    def test_add_to_cart_reports_sold_out(self):
+        Stock.objects.filter(pk=self.shirt.pk).update(reserved=2)
+        response = self.client.get(reverse('add_to_cart', args=[self.shirt.slug]))
+        self.assertRedirects(response, reverse('detail', args=[self.shirt.slug]),
+                             fetch_redirect_response=False)
+        self.assertFalse(Order.objects.filter(items__isnull=False).exists())
+        response = self.client.post(reverse('api_cart_add', args=[self.shirt.slug]))
+        self.assertEqual(response.status_code, 409)
+
+    def test_finalize_consumes_reservations(self):
+        order = cart.add_item(self.user, self.shirt)[0]
+        orders.finalize_order(order.pk, self.user, 'ch_1', 'key')
+        self.assertEqual((self.stock().on_hand, self.stock().reserved), (1, 0))
+        self.assertFalse(Reservation.objects.exists())
+
+    def test_expired_hold_cannot_be_oversold(self):
+        order = cart.add_item(self.user, self.shirt)[0]
+        cart.add_item(self.user, self.shirt)
+        Reservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(stock.release_expired(), 1)
+        self.assertEqual(self.stock().reserved, 0)
+
+        # Someone else buys one while the shopper's cart sat idle.
+        rival_order = cart.add_item(self.other, self.shirt)[0]
+        orders.finalize_order(rival_order.pk, self.other, 'ch_1', 'rival')
+        with self.assertRaises(stock.OutOfStock) as raised:
+            stock.reserve_order(order)
+        self.assertEqual(raised.exception.items, [self.shirt])
+        with self.assertRaises(stock.OutOfStock):
+            orders.finalize_order(order.pk, self.user, 'ch_2', 'key')
+        self.assertEqual((self.stock().on_hand, self.stock().reserved), (1, 0))
+        self.assertFalse(Payment.objects.filter(user=self.user).exists())
+
+    def sell_out_behind_lapsed_hold(self):
+        order = cart.add_item(self.user, self.shirt)[0]
+        Reservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        stock.release_expired()
+        cart.add_item(self.other, self.shirt)
+        rival_order = cart.add_item(self.other, self.shirt)[0]
+        orders.finalize_order(rival_order.pk, self.other, 'ch_rival', 'rival')
+        Task.objects.all().delete()
+        return order
+
+    def test_charge_for_sold_out_order_is_refunded(self):
+        stripe_api = use_fake_stripe(self)
+        self.sell_out_behind_lapsed_hold()
+        # The holds run out again between reserving and finalizing.
+        with mock.patch('catalog.views.reserve_order'):
+            response = self.client.post(
+                reverse('payment', args=['stripe']), {'stripeToken': 'tok_visa'})
+        self.assertRedirects(response, reverse('order_summary'),
+                             fetch_redirect_response=False)
+        message, = get_messages(response.wsgi_request)
+        self.assertIn('will be refunded', str(message))
+        charge, = stripe_api.calls('/v1/charges')
+        self.assertFalse(Payment.objects.filter(user=self.user).exists())
+
+        tasks.run_pending()
+        refund, = stripe_api.calls('/v1/refunds')
+        self.assertEqual(refund['params']['amount'], '25000')
+        self.assertEqual(refund['headers']['Idempotency-Key'], 'refund:ch_2')
+        self.assertEqual(AuditLog.objects.get().action, 'stripe_refund')
+
+    def test_paypal_holds_stock_before_capture(self):
+        order = cart.add_item(self.user, self.shirt)[0]
+        response = self.client.post(reverse('payment_reserve'))
+        self.assertEqual(response.json(), {'total': str(order.get_total())})
+
+        self.sell_out_behind_lapsed_hold()
+        response = self.client.post(reverse('payment_reserve'))
+        self.assertEqual(response.status_code, 409)
+
+    def test_paypal_capture_for_sold_out_order_is_refunded(self):
+        order = self.sell_out_behind_lapsed_hold()
+        body = json.dumps({'order_id': order.pk, 'paypal_order_id': 'PAYPAL1'})
+        with self.assertLogs('catalog.views', 'ERROR'):
+            response = self.client.post(reverse('payment_complete'), body,
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('will be refunded', response.json()['error'])
+        self.assertEqual(
+            json.loads(Task.objects.get(name='refund_charge').payload),
+            {'order_id': order.pk, 'charge_id': 'PAYPAL1', 'amount': 25000})
+        with self.assertLogs('catalog.orders', 'WARNING'):
+            tasks.run_pending()
+        self.assertEqual(AuditLog.objects.get().action, 'refund_skipped')
+
+    def test_reserve_order_renews_holds(self):
+        order = cart.add_item(self.user, self.shirt)[0]
+        Reservation.objects.update(expires_at=timezone.now())
+        stock.reserve_order(order)
+        self.assertGreater(Reservation.objects.get().expires_at, timezone.now())
+        self.assertEqual(self.stock().reserved, 1)
+
+
+class RatingAggregateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.shirt = make_item('Red Shirt', 250)
+        self.skates = make_item('Skates', 300)
+        self.jacket = make_item('Jacket', 400)
+
+    def aggregates(self, item):
+        item.refresh_from_db()
+        return {field: getattr(item, field) for field in reviews.AGGREGATE_FIELDS}
+
+    def assertConsistent(self):
+        self.assertEqual(list(reviews.drifted_items()), [])
+
+    def test_reviews_maintain_aggregates(self):
+        for value in (5, 4, 4):
+            Rating.objects.create(item=self.shirt, value=value)
+        self.assertEqual(self.aggregates(self.shirt), {
+            'rating_count': 3, 'rating_total': 13, 'rating_average': 13 / 3,
+            'rating_1': 0, 'rating_2': 0, 'rating_3': 0, 'rating_4': 2, 'rating_5': 1})
+
+        review = Rating.objects.filter(value=5).get()
+        review.value = 1
+        review.save()
+        review.item = self.skates
+        review.save()
+        self.assertEqual(self.aggregates(self.skates)['rating_1'], 1)
+        self.assertEqual(self.aggregates(self.shirt)['rating_average'], 4)
+        self.assertConsistent()
+
+        Rating.objects.filter(item=self.shirt).first().delete()
+        review.delete()
+        self.assertEqual(self.aggregates(self.skates)['rating_average'], 0)
+        self.assertConsistent()
+
+    def test_reconcile_fixes_drift(self):
+        Rating.objects.create(item=self.shirt, value=3)
+        Rating.objects.filter(item=self.shirt).update(value=5)
+        out = StringIO()
+        call_command('reconcile_ratings', stdout=out)
+        self.assertIn('fixed 1', out.getvalue())
+        self.assertEqual(self.aggregates(self.shirt)['rating_5'], 1)
+        self.assertConsistent()
+
+    def test_shop_sorts_and_filters_by_rating(self):
+        for item, values in ((self.shirt, [4, 5]), (self.skates, [2]), (self.jacket, [5])):
+            for value in values:
+                Rating.objects.create(item=item, value=value)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('shop'), {'sort': '-rating_average', 'size': 2})
+        self.assertNotIn('GROUP BY', ' '.join(q['sql'] for q in queries))
+        self.assertEqual(list(response.context['items']), [self.jacket, self.shirt])
+        response = self.client.get(reverse('shop'), {
+            'sort': '-rating_average', 'size': 2,
+            'after': response.context['page'].next_cursor})
+        self.assertEqual(list(response.context['items']), [self.skates])
+
+        response = self.client.get(reverse('shop'), {'min_rating': 4})
+        self.assertEqual(list(response.context['items']), [self.shirt, self.jacket])
+        self.assertContains(response, 'fa-star-half-alt')
+
+
+class SalesReportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser('admin', password='secret')
+        self.shoppers = [User.objects.create_user(f'shopper{n}') for n in range(2)]
+        category = Category.objects.create(name='Shirt')
+        self.shirt = make_item('Red Shirt', 250, 240, category)
+        self.skates = make_item('Skates', 300)
+        self.coupon = Coupon.objects.create(code='FIRST_TIMER', amount=40)
+
+    def buy(self, user, *items, coupon=None):
+        for item in items:
+            order = cart.add_item(user, item)[0]
+        if coupon:
+            order.apply_coupon(coupon)
+        return orders.finalize_order(order.pk, user, f'ch_{user.pk}', f'key-{user.pk}')[0]
+
+    def rollups(self):
+        return [
+            sorted(model.objects.values_list(*fields))
+            for model, fields in (
+                (DailySales, ['date', 'orders', 'units', 'revenue', 'discount',
+                              'refunds_requested', 'refunds_granted', 'refunded']),
+                (DailyItemSales, ['date', 'item', 'units', 'revenue']),
+                (DailyCategorySales, ['date', 'category', 'units', 'revenue']),
+                (DailyCouponUsage, ['date', 'coupon', 'uses', 'discount']),
+            )
+        ]
+
+    def test_finalized_orders_roll_up_like_a_rebuild(self):
+        first = self.buy(self.shoppers[0], self.shirt, self.shirt, self.skates)
+        self.buy(self.shoppers[1], self.shirt, coupon=self.coupon)
+        tasks.run_pending()
+        tasks.enqueue(reporting.record_order_sales, order_id=first.pk,
+                      day=reporting.today())
+        tasks.run_pending()
+
+        day = timezone.localdate()
+        daily = DailySales.objects.get()
+        self.assertEqual(
+            (daily.date, daily.orders, daily.units, daily.revenue, daily.discount),
+            (day, 2, 4, 780 + 200, 40))
+        self.assertEqual(
+            DailyItemSales.objects.get(item=self.shirt).units, 3)
+        self.assertEqual(
+            DailyCouponUsage.objects.values_list('uses', 'discount').get(), (1, 40))
+
+        incremental = self.rollups()
+        call_command('rebuild_sales_reports', stdout=StringIO())
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_refunds_are_counted(self):
+        use_fake_stripe(self)
+        order = self.buy(self.shoppers[0], self.skates)
+        Order.objects.filter(pk=order.pk).update(refund_requested=True)
+        Refund.objects.create(order=order, email='a@example.com', message='Broken')
+        reporting.refund_requested(order)
+        self.client.force_login(self.admin)
+        self.client.post(reverse('admin:catalog_order_changelist'), {
+            'action': 'refund_accepted', '_selected_action': [order.pk]})
+        tasks.run_pending()
+        self.assertEqual(
+            DailySales.objects.values_list(
+                'refunds_requested', 'refunds_granted', 'refunded').get(),
+            (1, 1, 300))
+
+    def test_refund_request_keeps_the_sale_date(self):
+        order = self.buy(self.shoppers[0], self.skates)
+        paid = timezone.now() - timedelta(days=3)
+        Order.objects.filter(pk=order.pk).update(ordered_date=paid)
+        self.client.post(reverse('request_refund'), {
+            'code': order.ref_code, 'email': 'a@example.com', 'reason': 'Broken'})
+        order.refresh_from_db()
+        self.assertTrue(order.refund_requested)
+        self.assertEqual(order.ordered_date, paid)
+
+    def test_dashboard_reads_only_rollups(self):
+        self.buy(self.shoppers[0], self.shirt)
+        tasks.run_pending()
+        self.client.force_login(self.admin)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('admin:catalog_dailysales_changelist'), {'days': 7})
+        self.assertContains(response, 'Red Shirt')
+        self.assertContains(response, '$240')
+        self.assertFalse([q for q in queries if 'catalog_order' in q['sql']])
+
+    def test_dashboard_needs_view_permission(self):
+        staff = User.objects.create_user('staff', password='secret', is_staff=True)
+        self.client.force_login(staff)
+        url = reverse('admin:catalog_dailysales_changelist')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        staff.user_permissions.add(Permission.objects.get(codename='view_dailysales'))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_order_admin_filters_by_user_without_listing_users(self):
+        for user in self.shoppers:
+            self.buy(user, self.skates)
+        self.client.force_login(self.admin)
+        url = reverse('admin:catalog_order_changelist')
+        response = self.client.get(url)
+        self.assertNotContains(response, 'By user')
+        response = self.client.get(url, {'user': self.shoppers[1].pk})
+        self.assertEqual(
+            list(response.context['cl'].result_list.values_list('user', flat=True)),
+            [self.shoppers[1].pk])
+
+
+def fail_once(order_ids):
+    fail_once.calls += 1
+    if fail_once.calls == 2:
+        raise RuntimeError('worker died')
+
+
+bulk.register(bulk.BulkAction(
+    'test_fail_once', 'Fail on the second chunk', Order, {'received': True},
+    then=fail_once))
+
+
+@override_settings(BULK_ACTION_CHUNK_SIZE=3)
+class BulkActionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.stripe = use_fake_stripe(self)
+        self.admin = User.objects.create_superuser('admin', password='secret')
+        self.client.force_login(self.admin)
+        item = make_item('Skates', 300)
+        self.orders = []
+        for n in range(8):
+            user = User.objects.create_user(f'shopper{n}')
+            order = cart.add_item(user, item)[0]
+            self.orders.append(orders.finalize_order(
+                order.pk, user, f'ch_{n}', f'stripe:tok_{n}')[0])
+        Order.objects.update(refund_requested=True)
+        tasks.run_pending()
+
+    def run_action(self, action, orders_selected):
+        response = self.client.post(reverse('admin:catalog_order_changelist'), {
+            'action': action, '_selected_action': [o.pk for o in orders_selected]})
+        self.assertEqual(response.status_code, 302)
+        return BulkJob.objects.latest('pk')
+
+    def test_refunds_are_granted_in_chunks_and_issued_async(self):
+        Order.objects.filter(pk=self.orders[0].pk).update(refund_granted=True)
+        job = self.run_action('refund_accepted', self.orders)
+        self.assertEqual((job.status, job.total, job.processed), (BulkJob.QUEUED, 8, 0))
+        self.assertFalse(Order.objects.filter(refund_requested=False).exists())
+
+        tasks.run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed, job.changed), (BulkJob.DONE, 8, 7))
+        self.assertEqual(Order.objects.filter(refund_granted=True).count(), 8)
+        self.assertEqual(
+            AuditLog.objects.filter(action='refund_accepted', job=job, actor=self.admin).count(), 7)
+
+        refunds = self.stripe.calls('/v1/refunds')
+        self.assertEqual(len(refunds), 7)
+        self.assertEqual(refunds[0]['params']['amount'], '30000')
+        self.assertEqual(Payment.objects.exclude(refund_id='').count(), 7)
+        self.assertEqual(AuditLog.objects.filter(action='stripe_refund').count(), 7)
+
+        orders.refund_order(self.orders[1].pk)
+        self.assertEqual(len(self.stripe.calls('/v1/refunds')), 7)
+
+    def test_only_requested_refunds_are_granted(self):
+        Order.objects.filter(pk=self.orders[0].pk).update(refund_requested=False)
+        job = self.run_action('refund_accepted', self.orders)
+        tasks.run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.changed), (BulkJob.DONE, 7))
+        self.assertFalse(Order.objects.get(pk=self.orders[0].pk).refund_granted)
+        self.assertEqual(Payment.objects.get(order=self.orders[0]).refund_id, '')
+        self.assertEqual(len(self.stripe.calls('/v1/refunds')), 7)
+
+    def test_paypal_payments_are_not_refunded_through_stripe(self):
+        Payment.objects.filter(order=self.orders[0]).update(charge_id='PAYPAL1')
+        with self.assertLogs('catalog.orders', 'WARNING'):
+            orders.refund_order(self.orders[0].pk)
+        self.assertEqual(self.stripe.calls('/v1/refunds'), [])
+        self.assertEqual(AuditLog.objects.get().action, 'refund_skipped')
+
+    def test_failed_job_resumes_after_last_chunk(self):
+        fail_once.calls = 0
+        job = bulk.start(bulk.ACTIONS['test_fail_once'], Order.objects.all(), self.admin)
+        with self.assertRaises(RuntimeError):
+            bulk.run_bulk_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed), (BulkJob.FAILED, 3))
+        self.assertEqual(Order.objects.filter(received=True).count(), 3)
+        bulk.run_bulk_job(job.pk)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed, job.changed), (BulkJob.DONE, 8, 8))
+        self.assertEqual(AuditLog.objects.filter(job=job).count(), 8)
+
+    def test_audit_log_is_append_only(self):
+        audit.record('note', Order, [self.orders[0].pk], reason='test')
+        entry = AuditLog.objects.get()
+        self.assertEqual(list(audit.history(self.orders[0])), [entry])
+        with self.assertRaises(ValueError):
+            entry.save()
+        with self.assertRaises(ValueError):
+            entry.delete()
+
+
+class TransferTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def export(self, kind, fmt='csv'):
+        stream = StringIO()
+        for _ in transfer.export_catalog(kind, stream, fmt):
+            pass
+        return stream.getvalue()
+
+    def test_export_import_round_trip(self):
+        shoes = Category.objects.create(name='Shoes')
+        make_item('Red Shoe', 300, 250, category=shoes)
+        make_item('Blue Hat', 120)
+        for fmt in transfer.FORMATS:
+            exported = self.export('items', fmt)
+            Item.objects.all().delete()
+            importer = transfer.import_catalog('items', StringIO(exported), fmt)
+            self.assertEqual((importer.created, importer.failed), (2, 0))
+            self.assertEqual(self.export('items', fmt), exported)
+        self.assertEqual(Category.objects.count(), 1)
+        self.assertEqual(search.search('shoe')[0].slug, 'red-shoe')
+
+    def test_rows_are_upserted_by_slug(self):
+        make_item('Red Shoe', 300)
+        rows = (
+            '{"slug": "red-shoe", "title": "Red Shoe", "price": 280}\n'
+            '{"title": "Green Scarf!", "price": "90", "category": "Winter"}\n'
+            '{"title": "Green Scarf!", "price": 85, "category": "Winter"}\n'
+        )
+        importer = transfer.import_catalog('items', StringIO(rows), 'jsonl')
+        self.assertEqual((importer.created, importer.updated), (1, 1))
+        self.assertEqual(Item.objects.get(slug='red-shoe').price, 280)
+        scarf = Item.objects.get(slug='green-scarf')
+        self.assertEqual((scarf.price, scarf.category.name), (85, 'Winter'))
+
+    def test_partial_files_only_update_their_columns(self):
+        shoes = Category.objects.create(name='Shoes')
+        shoe = make_item('Red Shoe', 300, 250, category=shoes)
+        Item.objects.filter(pk=shoe.pk).update(
+            label='S', status='New', image='product_images/shoe.png', image_digest='abc')
+        rows = 'slug,title,price\nred-shoe,Red Running Shoe,280\n,Blue Hat,120\n'
+        importer = transfer.import_catalog('items', StringIO(rows), 'csv')
+        self.assertEqual((importer.created, importer.updated), (1, 1))
+
+        shoe.refresh_from_db()
+        self.assertEqual((shoe.title, shoe.price), ('Red Running Shoe', 280))
+        self.assertEqual(
+            (shoe.discount_price, shoe.description, shoe.category, shoe.label, shoe.status,
+             shoe.image.name, shoe.image_digest),
+            (250, 'Red Shoe', shoes, 'S', 'New', 'product_images/shoe.png', 'abc'))
+        self.assertEqual(search.search('running shoe')[0], shoe)
+        hat = Item.objects.get(slug='blue-hat')
+        self.assertEqual((hat.label, hat.image.name), ('P', Item._meta.get_field('image').default))
+
+    def test_bad_rows_are_reported_and_skipped(self):
+        rows = (
+            'slug,title,price,label\n'
+            ',Good Item,100,\n'
+            ',,100,\n'
+            ',Cheap Item,lots,\n'
+            ',Odd Item,10,X\n'
+        )
+        importer = transfer.import_catalog('items', StringIO(rows), 'csv')
+        self.assertEqual((importer.created, importer.failed), (1, 3))
+        self.assertEqual([line for line, _ in importer.errors], [3, 4, 5])
+        self.assertIn('price must be a whole number', importer.errors[1][1])
+        bad = transfer.import_catalog('coupons', StringIO('{"code": \n'), 'jsonl')
+        self.assertIn('not valid JSON', bad.errors[0][1])
+
+    def test_local_images_are_copied_into_storage(self):
+        source = tempfile.NamedTemporaryFile(suffix='.PNG', delete=False)
+        self.addCleanup(os.remove, source.name)
+        source.write(png_upload('lamp.png').read())
+        source.close()
+        rows = f'{{"title": "Lamp", "price": 40, "image": "{source.name}"}}\n' * 2
+        transfer.import_catalog('items', StringIO(rows), 'jsonl', workers=2)
+        name = Item.objects.get().image.name
+        self.assertRegex(name, r'^product_images/.+-[0-9a-f]{12}\.png$')
+        self.assertTrue(default_storage.exists(name))
+
+    def test_queries_per_batch_are_bounded(self):
+        rows = [f'{{"title": "Item {n}", "price": {n + 1}, "category": "Cat {n % 3}"}}\n'
+                for n in range(60)]
+        with CaptureQueriesContext(connection) as one_batch:
+            transfer.import_catalog('items', StringIO(''.join(rows[:20])), 'jsonl', batch_size=20)
+        Item.objects.all().delete()
+        with CaptureQueriesContext(connection) as three_batches:
+            transfer.import_catalog('items', StringIO(''.join(rows)), 'jsonl', batch_size=20)
+        self.assertLessEqual(len(three_batches), 3 * len(one_batch))
+        self.assertEqual(Item.objects.count(), 60)
+
+    def test_commands(self):
+        path = os.path.join(tempfile.mkdtemp(), 'coupons.csv')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        Coupon.objects.create(code='SAVE10', amount=10)
+        call_command('export_catalog', 'coupons', output=path, stderr=StringIO())
+        Coupon.objects.update(amount=5)
+        out = StringIO()
+        call_command('import_catalog', 'coupons', path, stdout=out, stderr=StringIO())
+        self.assertIn('0 created, 1 updated, 0 failed', out.getvalue())
+        self.assertEqual(Coupon.objects.get().amount, 10)
+
+
+class StorefrontBenchmarkTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.baseline = os.path.join(directory, 'baseline.json')
+
+    def bench(self, **options):
+        out = StringIO()
+        options = {'items': 20, 'users': 2, 'history': 1, 'flows': 2, 'warmup': 1, **options}
+        call_command('bench_storefront', baseline=self.baseline, stdout=out, **options)
+        return out.getvalue()
+
+    def test_flows_run_and_compare_with_baseline(self):
+        self.assertIn('nothing compared', self.bench())
+        self.assertIn('Saved the baseline', self.bench(save_baseline=True))
+        with open(self.baseline) as f:
+            baseline = json.load(f)
+        self.assertEqual(set(baseline['steps']), {step for step, *_ in benchmarks.STOREFRONT_FLOW})
+        self.assertFalse([step for step, stats in baseline['steps'].items() if stats['errors']])
+        self.assertEqual(User.objects.count(), 0)
+
+        self.assertIn('No regressions', self.bench(tolerance=100))
+        baseline['steps']['profile']['queries'] -= 1
+        with open(self.baseline, 'w') as f:
+            json.dump(baseline, f)
+        with self.assertRaisesMessage(CommandError, 'profile: '):
+            self.bench(tolerance=100)
+        with self.assertRaisesMessage(CommandError, 'was recorded at'):
+            self.bench(flows=3)
+
+
+class StripeGatewayTests(TestCase):
+    def setUp(self):
+        self.stripe_api = use_fake_stripe(self)
+        self.sleeps = []
+        self.now = [0]
+        self.gateway = payments.StripeGateway(
+            'sk_test', api_base=self.stripe_api.url, max_retries=2,
+            breaker=payments.CircuitBreaker(
+                threshold=3, reset_timeout=30, clock=lambda: self.now[0]),
+            sleep=self.sleeps.append)
+
+    def test_connections_are_reused(self):
+        self.gateway.create_customer(email='a@example.com')
+        self.gateway.create_charge(amount=100, currency='usd')
+        self.assertEqual(
+            len({call['client_address'] for call in self.stripe_api.calls()}), 1)
+
+    def test_rate_limits_are_retried_with_the_same_key(self):
+        self.stripe_api.fail(429, times=2)
+        charge = self.gateway.create_charge(amount=100, currency='usd')
+        self.assertEqual(charge.amount, 100)
+        keys = {call['headers']['Idempotency-Key'] for call in self.stripe_api.calls()}
+        self.assertEqual((len(self.stripe_api.calls()), len(keys)), (3, 1))
+        self.assertEqual(len(self.sleeps), 2)
+        self.assertTrue(all(0 <= delay <= 0.5 for delay in self.sleeps))
+
+    def test_declines_and_server_errors_are_not_retried(self):
+        with self.assertRaises(stripe.error.CardError):
+            self.gateway.create_charge(
+                amount=100, currency='usd', source='tok_chargeDeclined')
+        self.stripe_api.fail(500)
+        with self.assertRaises(stripe.error.APIError):
+            self.gateway.create_charge(amount=100, currency='usd')
+        self.assertEqual(len(self.stripe_api.calls()), 2)
+
+    def test_deadline_bounds_slow_responses(self):
+        self.stripe_api.delay = 1
+        self.gateway.deadline = 0.2
+        start = time.monotonic()
+        with self.assertRaises(stripe.error.APIConnectionError):
+            self.gateway.create_customer(email='a@example.com')
+        self.assertLess(time.monotonic() - start, 0.9)
+
+    def test_circuit_breaker_fails_fast_then_recovers(self):
+        self.stripe_api.fail(503, times=3)
+        for _ in range(3):
+            with self.assertRaises(stripe.error.APIError):
+                self.gateway.create_charge(amount=100, currency='usd')
+        with self.assertRaises(payments.CircuitOpenError):
+            self.gateway.create_charge(amount=100, currency='usd')
+        self.assertEqual(len(self.stripe_api.calls()), 3)
+
+        self.now[0] += 31
+        self.gateway.create_charge(amount=100, currency='usd')
+        self.assertFalse(self.gateway.breaker.is_open)
+
+    def test_trial_call_failing_outside_stripe_does_not_stick(self):
+        self.stripe_api.fail(503, times=3)
+        for _ in range(3):
+            with self.assertRaises(stripe.error.APIError):
+                self.gateway.create_charge(amount=100, currency='usd')
+
+        def broken_deadline(at):
+            raise ValueError('bad parameters')
+
+        self.now[0] += 31
+        self.gateway.client.deadline = broken_deadline
+        with self.assertRaises(ValueError):
+            self.gateway.create_charge(amount=100, currency='usd')
+        del self.gateway.client.deadline
+        self.assertFalse(self.gateway.breaker.trial_running)
+
+        self.now[0] += 31
+        self.gateway.create_charge(amount=100, currency='usd')
+        self.assertFalse(self.gateway.breaker.is_open)
+
+    def test_checkout_reports_declines(self):
+        user = User.objects.create_user('shopper', password='secret')
+        self.client.force_login(user)
+        cart.add_item(user, make_item('Red Shirt', 250))
+        response = self.client.post(
+            reverse('payment', args=['stripe']), {'stripeToken': 'tok_chargeDeclined'},
+            follow=True)
+        self.assertContains(response, 'Your card was declined.')
+        self.assertFalse(Order.objects.get(user=user).ordered)
+
+
+@override_settings(METRICS_SAMPLE_RATE=1, METRICS_TOKEN='scrape-me')
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(setattr, metrics, 'REGISTRY', metrics.REGISTRY)
+        metrics.REGISTRY = metrics.Registry()
+        make_item('Red Shirt', 250)
+
+    def scrape(self):
+        response = self.client.get(
+            reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape-me')
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_requests_are_measured_per_url_name(self):
+        self.client.get(reverse('shop'))
+        self.client.get(reverse('shop'))
+        self.client.get('/no-such-page/')
+        text = self.scrape()
+        self.assertIn('ecom_http_requests_total{view="shop",status="200"} 2.0', text)
+        self.assertIn('ecom_http_requests_total{view="<unresolved>",status="404"} 1.0', text)
+        self.assertIn('ecom_http_request_duration_seconds_count{view="shop"} 2', text)
+        self.assertIn('ecom_http_request_duration_seconds_bucket{view="shop",le="+Inf"} 2', text)
+        self.assertIn('ecom_cache_requests_total{view="shop",cache="page",result="hit"} 1.0', text)
+        self.assertIn('ecom_cache_requests_total{view="shop",cache="page",result="miss"} 1.0', text)
+        queries = metrics.REGISTRY.counters['ecom_db_queries_total'][(('view', 'shop'),)]
+        self.assertGreater(queries, 0)
+        self.assertGreater(
+            metrics.REGISTRY.counters['ecom_template_render_seconds_total'][(('view', 'shop'),)], 0)
+        # Timed by the template backend, not by patching Django.
+        self.assertEqual(Template.render.__module__, 'django.template.base')
+
+    def test_unsampled_requests_are_only_counted(self):
+        with self.settings(METRICS_SAMPLE_RATE=0):
+            self.client.get(reverse('shop'))
+        self.assertEqual(
+            metrics.REGISTRY.counters['ecom_http_requests_total'],
+            {(('view', 'shop'), ('status', 200)): 1})
+        self.assertNotIn('ecom_db_queries_total', metrics.REGISTRY.counters)
+
+    @override_settings(METRICS_REPEATED_QUERY_WARNING=1)
+    def test_sampled_requests_are_logged(self):
+        with self.assertLogs('catalog.metrics', 'WARNING') as logs:
+            self.client.get(reverse('shop'))
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual((entry['view'], entry['status'], entry['cache_misses']), ('shop', 200, 2))
+        self.assertEqual(entry['repeated_query']['count'], 1)
+        self.assertGreater(entry['queries'], 0)
+
+    def test_duplicate_queries_are_counted(self):
+        stats = metrics.RequestStats()
+        with connection.execute_wrapper(stats):
+            for _ in range(2):
+                list(Item.objects.filter(slug='red-shirt'))
+        self.assertEqual((stats.queries, stats.duplicate_queries), (2, 1))
+
+    def test_endpoint_needs_token_or_staff(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+        self.assertEqual(self.client.get(
+            reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code, 404)
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+
+
+@override_settings(DATABASE_REPLICA='replica')
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        self.item = make_item('Red Shirt', 250)
+        cache.clear()
+        self.routes = {}
+
+        @routers.replica_reads
+        def view(request):
+            self.routes = {
+                'item': router.db_for_read(Item),
+                'order': router.db_for_read(Order),
+                'write': router.db_for_write(Item),
+            }
+            return HttpResponse()
+
+        self.view = view
+
+    def get(self, **cookies):
+        request = RequestFactory().get('/')
+        request.COOKIES.update(cookies)
+        return routers.ReplicaPinningMiddleware(self.view)(request)
+
+    def test_catalog_reads_go_to_the_replica(self):
+        response = self.get()
+        self.assertEqual(self.routes, {'item': 'replica', 'order': 'default', 'write': 'default'})
+        self.assertEqual(response.cookies[routers.PIN_COOKIE]['max-age'], 5)
+        self.assertEqual(router.db_for_read(Item), 'default')
+
+    def test_recent_writers_and_catalog_changes_stay_on_primary(self):
+        self.get(**{routers.PIN_COOKIE: '1'})
+        self.assertEqual(self.routes['item'], 'default')
+        self.item.save()
+        self.get()
+        self.assertEqual(self.routes['item'], 'default')
+        cache.delete(CATALOG_CHANGED_KEY)
+        self.get()
+        self.assertEqual(self.routes['item'], 'replica')
+
+    def test_only_requests_that_write_are_pinned(self):
+        user = User.objects.create_user('shopper')
+        self.client.force_login(user)
+        response = self.client.get(reverse('add_to_cart', args=[self.item.slug]))
+        self.assertIn(routers.PIN_COOKIE, response.cookies)
+        response = self.client.get(reverse('profile'))
+        self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+
+
+class CachedCatalogPagesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.shirt = make_item('Red Shirt', 250, 240)
+        self.django_calls = []
+
+        async def django_app(scope, receive, send):
+            self.django_calls.append(scope['path'])
+            await send({'type': 'http.response.start', 'status': 404, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b''})
+
+        self.application = CachedCatalogPages(django_app)
+
+    def asgi_get(self, path, cookie=None):
+        scope = loadtest.asgi_scope(path)
+        if cookie:
+            scope['headers'].append((b'cookie', cookie.encode()))
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        async_to_sync(self.application)(scope, receive, send)
+        return messages
+
+    def test_cached_pages_skip_django(self):
+        url = reverse('shop_list') + '?sort=price'
+        self.assertEqual(self.asgi_get(url)[0]['status'], 404)
+        expected = self.client.get(url)
+
+        start, body = self.asgi_get(url)
+        self.assertEqual(start['status'], 200)
+        self.assertEqual(body['body'], expected.content)
+        self.assertIn((b'content-type', expected['Content-Type'].encode()), start['headers'])
+        self.assertEqual(self.django_calls, [reverse('shop_list')])
+
+    def test_visitors_with_a_session_reach_django(self):
+        url = reverse('home')
+        self.client.get(url)
+        self.asgi_get(url, cookie='sessionid=abc')
+        self.asgi_get(url, cookie='messages=xyz')
+        self.assertEqual(self.django_calls, [url, url])
+        self.assertEqual(self.asgi_get(url, cookie='theme=dark')[0]['status'], 200)
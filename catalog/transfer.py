@@ -0,0 +1,355 @@
+"""
+Streaming catalog import and export as CSV or JSON lines, behind the
+import_catalog and export_catalog commands.
+
+Both sides work a batch at a time. Exports iterate a server-side cursor
+where the backend has one. Imports read, parse and upsert BATCH_SIZE rows
+per transaction with bulk_create and bulk_update, so memory stays flat
+however long the file is.
+"""
+import csv
+import hashlib
+import json
+import os
+import posixpath
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from urllib.parse import urlsplit
+from urllib.request import urlopen
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils.text import slugify
+
+from .caching import bump_catalog_version
+from .models import LABEL_CHOICES, Category, Coupon, Item
+from .search import index_items
+
+FORMATS = ('csv', 'jsonl')
+BATCH_SIZE = 1000
+EXPORT_CHUNK_SIZE = 2000
+IMAGE_TIMEOUT = 30
+MAX_KEPT_ERRORS = 100
+LABELS = {code for code, _ in LABEL_CHOICES}
+
+
+class RowError(ValueError):
+    pass
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def read_rows(stream, fmt):
+    """Yield ``(line number, row dict)`` from a text stream."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for number, line in enumerate(stream, 1):
+        if line.strip():
+            try:
+                row = json.loads(line)
+            except ValueError as exc:
+                row = exc
+            yield number, row
+
+
+def write_rows(stream, fmt, fields, rows):
+    if fmt == 'csv':
+        writer = csv.writer(stream)
+        writer.writerow(fields)
+        for row in rows:
+            writer.writerow(['' if value is None else value for value in row])
+            yield
+    else:
+        for row in rows:
+            stream.write(json.dumps(dict(zip(fields, row))) + '\n')
+            yield
+
+
+def text(row, field, required=False, max_length=None):
+    value = row.get(field)
+    value = '' if value is None else str(value).strip()
+    if required and not value:
+        raise RowError(f'{field} is required')
+    if max_length and len(value) > max_length:
+        raise RowError(f'{field} is longer than {max_length} characters')
+    return value
+
+
+def number(row, field, required=False):
+    value = row.get(field)
+    if value is None or value == '':
+        if required:
+            raise RowError(f'{field} is required')
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise RowError(f'{field} must be a whole number, not {value!r}')
+
+
+def item_slug(title):
+    # What ItemAdmin's prepopulated slug field produces from the title.
+    return slugify(title)[:Item._meta.get_field('slug').max_length].strip('-')
+
+
+def store_image(source, upload_to, storage=default_storage):
+    """
+    Copy a local file or download a URL into ``upload_to`` and return its
+    storage name. The name carries a digest of the bytes, so importing the
+    same file again reuses it. Anything else is taken to be a storage name
+    already.
+    """
+    if source.startswith(('http://', 'https://')):
+        with urlopen(source, timeout=IMAGE_TIMEOUT) as response:
+            data = response.read()
+    elif os.path.isfile(source):
+        with open(source, 'rb') as f:
+            data = f.read()
+    else:
+        return source
+    stem, ext = posixpath.splitext(posixpath.basename(urlsplit(source).path))
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    name = f'{upload_to}/{slugify(stem) or "image"}-{digest}{ext.lower() or ".jpg"}'
+    if not storage.exists(name):
+        name = storage.save(name, ContentFile(data))
+    return name
+
+
+class Importer:
+    """
+    Upsert one model from parsed rows, matched on ``key``. Subclasses
+    define ``parse`` (row dict -> field dict, raising RowError) and may
+    add per-batch work in ``prepare`` and ``saved``.
+
+    New rows get every field in ``fields``, defaults included. Existing rows
+    only get the fields whose column the row has, so a file with a few
+    columns leaves the others as they are. ``derived`` names fields filled
+    from another field's column.
+    """
+    model = None
+    key = None
+    fields = []
+    derived = {}
+
+    def __init__(self, pool=None):
+        self.pool = pool
+        self.created = self.updated = self.failed = 0
+        self.errors = []
+
+    def parse(self, row):
+        raise NotImplementedError
+
+    def prepare(self, values):
+        pass
+
+    def saved(self, objs):
+        pass
+
+    def updated_fields(self, row):
+        return tuple(field for field in self.fields if self.derived.get(field, field) in row)
+
+    def existing(self, keys):
+        ids = {}
+        for key, pk in self.model.objects.filter(**{f'{self.key}__in': keys}) \
+                .order_by('pk').values_list(self.key, 'pk'):
+            ids.setdefault(key, pk)
+        return ids
+
+    def import_batch(self, rows):
+        values, updated_fields = {}, {}
+        for line, row in rows:
+            try:
+                if isinstance(row, Exception):
+                    raise RowError(f'not valid JSON: {row}')
+                parsed = self.parse(row)
+            except RowError as exc:
+                self.failed += 1
+                if len(self.errors) < MAX_KEPT_ERRORS:
+                    self.errors.append((line, str(exc)))
+                continue
+            # A key repeated in the file is upserted with its last row.
+            values[parsed[self.key]] = parsed
+            updated_fields[parsed[self.key]] = self.updated_fields(row)
+        if not values:
+            return
+        self.prepare(values)
+
+        with transaction.atomic():
+            ids = self.existing(list(values))
+            objs = [self.model(pk=ids.get(key), **fields) for key, fields in values.items()]
+            new = [obj for obj in objs if obj.pk is None]
+            old = [obj for obj in objs if obj.pk is not None]
+            # One UPDATE per distinct set of columns, usually a single one.
+            updates = {}
+            for obj in old:
+                updates.setdefault(updated_fields[getattr(obj, self.key)], []).append(obj)
+            for fields, group in updates.items():
+                if fields:
+                    self.model.objects.bulk_update(group, fields)
+            if new:
+                self.model.objects.bulk_create(new)
+                # Not every backend returns the new primary keys.
+                created = self.existing([getattr(obj, self.key) for obj in new])
+                for obj in new:
+                    obj.pk = created[getattr(obj, self.key)]
+            self.saved(objs)
+        self.created += len(new)
+        self.updated += len(old)
+
+
+class CategoryImporter(Importer):
+    model = Category
+    key = 'name'
+    fields = ['thumbnail', 'thumbnail_digest']
+    derived = {'thumbnail_digest': 'thumbnail'}
+
+    def parse(self, row):
+        return {
+            'name': text(row, 'name', required=True, max_length=200),
+            'thumbnail': text(row, 'thumbnail') or Category._meta.get_field('thumbnail').default,
+            'thumbnail_digest': '',
+        }
+
+    def prepare(self, values):
+        import_images(self.pool, values, 'thumbnail', 'static/cat_imgs')
+
+
+class CouponImporter(Importer):
+    model = Coupon
+    key = 'code'
+    fields = ['amount']
+
+    def parse(self, row):
+        return {'code': text(row, 'code', required=True, max_length=20),
+                'amount': number(row, 'amount', required=True)}
+
+
+class ItemImporter(Importer):
+    model = Item
+    key = 'slug'
+    fields = ['title', 'price', 'discount_price', 'description', 'category',
+              'label', 'status', 'image', 'image_digest']
+    derived = {'image_digest': 'image'}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Names seen so far; a catalog has far fewer categories than items.
+        self.categories = {}
+
+    def parse(self, row):
+        title = text(row, 'title', required=True, max_length=150)
+        slug = text(row, 'slug') or item_slug(title)
+        if not slug:
+            raise RowError('slug is required when the title has no letters or digits')
+        if slug != slugify(slug):
+            raise RowError(f'slug {slug!r} may only hold letters, digits, _ and -')
+        label = text(row, 'label') or 'P'
+        if label not in LABELS:
+            raise RowError(f"label must be one of {', '.join(sorted(LABELS))}")
+        values = {
+            'slug': slug,
+            'title': title,
+            'price': number(row, 'price', required=True),
+            'discount_price': number(row, 'discount_price'),
+            'description': text(row, 'description'),
+            'category': text(row, 'category', max_length=200) or None,
+            'label': label,
+            'status': text(row, 'status', max_length=150) or None,
+            'image': text(row, 'image') or Item._meta.get_field('image').default,
+            'image_digest': '',
+        }
+        return values
+
+    def prepare(self, values):
+        names = {fields['category'] for fields in values.values()} - {None}
+        missing = names - set(self.categories)
+        if missing:
+            found = {}
+            for category in Category.objects.filter(name__in=missing).order_by('pk'):
+                found.setdefault(category.name, category)
+            Category.objects.bulk_create(
+                [Category(name=name) for name in missing - set(found)])
+            found.update({
+                category.name: category
+                for category in Category.objects.filter(name__in=missing - set(found))})
+            self.categories.update(found)
+        for fields in values.values():
+            fields['category'] = self.categories.get(fields['category'])
+        import_images(self.pool, values, 'image', 'product_images')
+
+    def saved(self, objs):
+        # Reloaded, as updated rows keep the columns the file left out.
+        index_items(Item.objects.select_related('category').filter(
+            pk__in=[obj.pk for obj in objs]))
+
+
+def import_images(pool, values, field, upload_to):
+    """Fetch or copy every distinct image source of a batch in parallel."""
+    sources = {fields[field] for fields in values.values() if fields.get(field)}
+    if not sources:
+        return
+    sources = sorted(sources)
+    names = dict(zip(sources, pool.map(
+        lambda source: safe_store_image(source, upload_to), sources)))
+    for fields in values.values():
+        if fields.get(field):
+            fields[field] = names[fields[field]]
+
+
+def safe_store_image(source, upload_to):
+    try:
+        return store_image(source, upload_to)
+    except (OSError, ValueError):
+        # The row is still imported, pointing at the source as given; the
+        # derivative pass skips files it cannot open.
+        return source
+
+
+IMPORTERS = {
+    'categories': CategoryImporter,
+    'coupons': CouponImporter,
+    'items': ItemImporter,
+}
+
+EXPORTS = {
+    'categories': (Category, ['name', 'thumbnail'], ['name', 'thumbnail']),
+    'coupons': (Coupon, ['code', 'amount'], ['code', 'amount']),
+    'items': (Item, ['slug', 'title', 'price', 'discount_price', 'description',
+                     'category__name', 'label', 'status', 'image'],
+              ['slug', 'title', 'price', 'discount_price', 'description',
+               'category', 'label', 'status', 'image']),
+}
+
+
+def import_catalog(kind, stream, fmt, batch_size=BATCH_SIZE, workers=8, progress=None):
+    """Import ``kind`` rows from ``stream``; returns the Importer with its counts."""
+    with ThreadPoolExecutor(workers) as pool:
+        importer = IMPORTERS[kind](pool)
+        start = time.perf_counter()
+        rows = 0
+        for batch in batched(read_rows(stream, fmt), batch_size):
+            importer.import_batch(batch)
+            rows += len(batch)
+            if progress:
+                progress(rows, time.perf_counter() - start)
+    bump_catalog_version()
+    return importer
+
+
+def export_catalog(kind, stream, fmt, chunk_size=EXPORT_CHUNK_SIZE):
+    """Write every ``kind`` row to ``stream``; yields once per row written."""
+    model, columns, fields = EXPORTS[kind]
+    rows = model.objects.order_by('pk').values_list(*columns).iterator(chunk_size=chunk_size)
+    return write_rows(stream, fmt, fields, rows)
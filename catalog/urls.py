@@ -7,13 +7,20 @@ from .views import (
     CheckOutView,
     CouponView,
     RefundView,
+    SearchView,
     ShopBlockView,
     ShopListView,
     add_to_cart,
+    cart_api,
+    cart_api_add,
+    cart_api_remove,
+    metrics,
     payment_complete,
+    payment_reserve,
     profile,
     remove_from_cart,
     remove_single_from_cart,
+    search_suggest,
     # Cart
 )
 
@@ -24,6 +31,8 @@ urlpatterns = [
     path('profile/', profile, name='profile'),
     path('shop/', ShopBlockView.as_view(), name='shop'),
     path('shop-list/', ShopListView.as_view(), name='shop_list'),
+    path('search/', SearchView.as_view(), name='search'),
+    path('search/suggest/', search_suggest, name='search_suggest'),
     path('request-refund', RefundView.as_view(), name='request_refund'),
     path('detail/<slug>/', ProductDetailView.as_view(), name='detail'),
     path('add-to-cart/<slug>/', add_to_cart, name='add_to_cart'),
@@ -33,5 +42,13 @@ urlpatterns = [
          remove_single_from_cart, name='remove_single_from_cart'),
     path('order-summary/', OrderSummaryView.as_view(), name='order_summary'),
     path('checkout/', CheckOutView.as_view(), name='checkout'),
-    path('payment-complete', payment_complete, name='payment_complete')
+    path('payment-reserve', payment_reserve, name='payment_reserve'),
+    path('payment-complete', payment_complete, name='payment_complete'),
+    path('metrics', metrics, name='metrics'),
+    path('api/cart/', cart_api, name='api_cart'),
+    path('api/cart/<slug>/add/', cart_api_add, name='api_cart_add'),
+    path('api/cart/<slug>/remove-single/',
+         cart_api_remove, name='api_cart_remove_single'),
+    path('api/cart/<slug>/remove/', cart_api_remove,
+         {'quantity': None}, name='api_cart_remove'),
 ]
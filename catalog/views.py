@@ -1,39 +1,57 @@
 from django.conf import settings
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse
 from django.shortcuts import render, get_object_or_404, redirect, reverse
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib import messages
 from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import require_GET, require_POST
 from django.views.generic import ListView, DetailView, View
 from .models import (
     Item, OrderItem, Order, Address, Payment, Coupon,
     Refund, Category, Wishlist, Rating
 )
-from .forms import AddressForm, CouponForm, RefundForm
+from .forms import (
+    AddressForm, CouponForm, RefundForm, ShopFilterForm, SHOP_PAGE_SIZE,
+    SHOP_MAX_PAGE_SIZE
+)
+from .caching import cache_catalog_page, get_or_set_catalog
+from .pagination import KeysetPaginator
+from .routers import replica_reads
+from . import search as catalog_search
+from . import cart
+from . import metrics as catalog_metrics
+from . import reporting
+from .cart import get_cart_item_count, invalidate_cart_item_count
+from .orders import (
+    OrderAlreadyPaid, PaymentAlreadyUsed, finalize_order, paid_order, refund_unfinalized
+)
+from .payments import get_gateway
+from .stock import OutOfStock, reserve_order
 
+import hashlib
+import hmac
 import json
+import logging
 import stripe
-import string
-import random
-import smtplib
-import imghdr
-from email.message import EmailMessage
-
 
-def create_ref_code():
-    return ''.join(random.choices(string.ascii_lowercase + string.digits, k=20))
 
-
-stripe.api_key = settings.STRIPE_SECRET_KEY
+logger = logging.getLogger(__name__)
 
 
+@method_decorator(cache_catalog_page, name='dispatch')
+@method_decorator(replica_reads, name='dispatch')
 class HomeView(View):
     def get(self, *args, **kwargs):
+        # Lazy querysets: they only run when the home_sections fragment in
+        # index.html is not cached.
         categories = Category.objects.all()[0:3]
-        shirts = Item.objects.filter(category__name="Shirt")
-        new_products = Item.objects.filter(category__name="New Products")
+        shirts = Item.objects.filter(
+            category__name="Shirt").select_related('category')
+        new_products = Item.objects.filter(
+            category__name="New Products").select_related('category')
         context = {
             'categories': categories,
             'shirts': shirts,
@@ -42,10 +60,17 @@ class HomeView(View):
         return render(self.request, 'index.html', context)
 
 
+@method_decorator(cache_catalog_page, name='dispatch')
+@method_decorator(replica_reads, name='dispatch')
 class ProductDetailView(DetailView):
-    model = Item
+    queryset = Item.objects.select_related('category')
     template_name = 'product.html'
 
+    def get_object(self, queryset=None):
+        return get_or_set_catalog(
+            ('item', self.kwargs['slug']),
+            lambda: super(ProductDetailView, self).get_object(queryset))
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context.update({
@@ -63,26 +88,103 @@ class Cart(View):
         return render(self.request, 'cart.html')
 
 
+def page_query(request, **cursor):
+    params = request.GET.copy()
+    params.pop('after', None)
+    params.pop('before', None)
+    params.update(cursor)
+    return params.urlencode()
+
+
+@method_decorator(cache_catalog_page, name='dispatch')
+@method_decorator(replica_reads, name='dispatch')
 class ShopBlockView(View):
+    template_name = 'shop.html'
+
     def get(self, *args, **kwargs):
+        form = ShopFilterForm(self.request.GET)
+        form.is_valid()
+        filters = form.cleaned_data
+
+        items = Item.objects.all()
+        if filters.get('category') is not None:
+            items = items.filter(category_id=filters['category'])
+        if filters.get('label'):
+            items = items.filter(label=filters['label'])
+        if filters.get('min_price') is not None:
+            items = items.filter(price__gte=filters['min_price'])
+        if filters.get('max_price') is not None:
+            items = items.filter(price__lte=filters['max_price'])
+        if filters.get('min_rating') is not None:
+            items = items.filter(rating_average__gte=filters['min_rating'])
+
+        paginator = KeysetPaginator(
+            items, filters.get('size') or SHOP_PAGE_SIZE, filters.get('sort') or 'id')
+        page = get_or_set_catalog(
+            ('shop', hashlib.md5(repr(sorted(filters.items())).encode()).hexdigest()),
+            lambda: paginator.page(
+                after=filters.get('after'), before=filters.get('before')))
         context = {
-            'items': Item.objects.all()
+            'items': page,
+            'page': page,
+            'filter_form': form,
         }
-        return render(self.request, 'shop.html', context)
+        if page.has_next():
+            context['next_query'] = page_query(
+                self.request, after=page.next_cursor)
+        if page.has_previous():
+            context['previous_query'] = page_query(
+                self.request, before=page.previous_cursor)
+        return render(self.request, self.template_name, context)
+
+
+class ShopListView(ShopBlockView):
+    template_name = 'shop_list.html'
 
 
-class ShopListView(View):
+@method_decorator(cache_catalog_page, name='dispatch')
+@method_decorator(replica_reads, name='dispatch')
+class SearchView(View):
+    template_name = 'shop.html'
+
     def get(self, *args, **kwargs):
+        query = self.request.GET.get('q', '').strip()
+        items = get_or_set_catalog(
+            ('search', hashlib.md5(query.encode()).hexdigest()),
+            lambda: catalog_search.search(query, limit=SHOP_MAX_PAGE_SIZE))
         context = {
-            'items': Item.objects.all()
+            'items': items,
+            'query': query,
         }
-        return render(self.request, 'shop_list.html', context)
+        return render(self.request, self.template_name, context)
+
+
+@require_GET
+def search_suggest(request):
+    query = request.GET.get('q', '')
+    return JsonResponse({
+        'terms': get_or_set_catalog(
+            ('suggest', hashlib.md5(query.encode()).hexdigest()),
+            lambda: catalog_search.suggest(query)),
+    })
+
+
+@require_GET
+def metrics(request):
+    token = settings.METRICS_TOKEN
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if not request.user.is_staff and not (
+            token and hmac.compare_digest(authorization, f'Bearer {token}')):
+        raise Http404
+    return HttpResponse(catalog_metrics.REGISTRY.render(),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
-class CheckOutView(View):
+class CheckOutView(LoginRequiredMixin, View):
     def get(self, *args, **kwargs):
         try:
-            order = Order.objects.get(user=self.request.user, ordered=False)
+            order = Order.objects.with_details().get(
+                user=self.request.user, ordered=False)
             form = AddressForm()
             coupon_form = CouponForm()
             context = {
@@ -117,7 +219,7 @@ class CheckOutView(View):
                 )
                 address.save()
                 order.address = address
-                order.save()
+                order.save(update_fields=['address'])
 
                 save_info = form.cleaned_data.get('save_info')
                 if save_info:
@@ -131,7 +233,7 @@ class CheckOutView(View):
                     if address_qs.exists():
                         address = address_qs[0]
                         order.address = address
-                        order.save()
+                        order.save(update_fields=['address'])
                 # return redirect('checkout')
                 payment_option = form.cleaned_data.get('payment_option')
                 if payment_option == 'S':
@@ -147,10 +249,11 @@ class CheckOutView(View):
             return redirect('order_summary')
 
 
-class PaymentView(View):
+class PaymentView(LoginRequiredMixin, View):
     def get(self, *args, **kwargs):
         try:
-            order = Order.objects.get(user=self.request.user, ordered=False)
+            order = Order.objects.with_details().get(
+                user=self.request.user, ordered=False)
             if order.address is not None:
                 context = {
                     'order': order,
@@ -166,74 +269,41 @@ class PaymentView(View):
             return redirect('order_summary')
 
     def post(self, *args, **kwargs):
-        to_email = self.request.user.email
-        print('customer email -->', to_email)
+        # Stripe tokens are single use, so the token names this attempt: a
+        # double submitted form finds the finished order instead of paying
+        # again, and Stripe dedupes the charge itself under the same key.
+        token = self.request.POST.get('stripeToken', '')
+        idempotency_key = f'stripe:{token}'
+        if token and paid_order(idempotency_key, user=self.request.user) is not None:
+            messages.success(
+                self.request, 'Your payment was successful. Go to you profile to view the deilvery status')
+            return redirect('home')
+
         order = Order.objects.get(user=self.request.user, ordered=False)
+        gateway = get_gateway()
+        charge = None
         try:
-            customer = stripe.Customer.create(
+            # Hold every unit before charging so a sold out item fails here
+            # and not after the customer has paid.
+            reserve_order(order)
+            customer = gateway.create_customer(
                 name=self.request.user,
                 email=self.request.user.email,
                 source=self.request.POST['stripeToken']
 
             )
             amount = int(order.get_total() * 100)
-            charge = stripe.Charge.create(
+            charge = gateway.create_charge(
                 amount=amount,
                 currency="usd",
-                customer=customer,
-                description="My first own test"
+                customer=customer['id'],
+                description="My first own test",
+                idempotency_key=idempotency_key,
             )
-            payment = Payment()
-            payment.charge_id = charge['id']
-            payment.user = self.request.user
-            payment.amount = order.get_total()
-            payment.save()
-
-            order_items = order.items.all()
-            order_items.update(ordered=True)
-            for item in order_items:
-                print(item.item.title)
-                print(item.item.discount_price)
-                item.save()
-
-            order.ordered = True
-            order.payment = payment
-            order.ref_code = create_ref_code()
-            order.save()
-
-            # msg = EmailMessage()
-            # msg['Subject'] = f'Your order{item.item.title}'
-            # msg['From'] = "Butek's Online <buteksonline@gmail.com>"
-            # msg['To'] = to_email
-            # msg.set_content(
-            #     f"Testing{item.item.title} for {item.item.discount_price} to be shipped to {order.address.street_address} the new feature of buteks online {item.item.image.url}")
-
-            # msg.add_alternative(
-            #     """
-            #     <!DOCTYPE html>
-            #     <html lang="en">
-            #         <body>
-            #             <h1 style="color:gray;">Helloh</h1>
-            #             <img src='catalog/img.jpg' alt="itemimg">
-            #         </body>
-            #     </html>
-            #     """
-            # , subtype='html')
-
-            # with open(f'media/{item.item.image}', 'rb') as f:
-            #     file_data = f.read()
-            #     file_type = imghdr.what(f.name)
-            #     file_name = f.name
-
-            # msg.add_attachment(file_data, maintype='image',
-            #                    subtype=file_type, filename=file_name)
-
-            # with smtplib.SMTP_SSL('smtp.gmail.com', 465) as smtp:
-            #     username = ""
-            #     password = ""
-            #     smtp.login(username, password)
-
-            #     smtp.send_message(msg)
+            # Mail and receipts are rendered and sent by the task worker
+            # (manage.py run_tasks), not in this request.
+            finalize_order(order.pk, self.request.user, charge['id'], idempotency_key)
+            invalidate_cart_item_count(self.request.user)
 
             messages.success(
                 self.request, 'Your payment was successful. Go to you profile to view the deilvery status')
@@ -244,10 +314,6 @@ class PaymentView(View):
             err = body.get('error', {})
             messages.info(self.request, f"{err.get('message')}")
             return redirect('/')
-        except stripe.error.RateLimitError as e:
-            # Too many requests made to the API too quickly
-            messages.info(self.request, "Rate limit error")
-            return redirect('/')
         except stripe.error.InvalidRequestError as e:
             # Invalid parameters were supplied to Stripe's API
             messages.info(self.request, "Invalid parameters")
@@ -257,29 +323,57 @@ class PaymentView(View):
             # (maybe you changed API keys recently)
             messages.info(self.request, "Not authenticated")
             return redirect('/')
-        except stripe.error.APIConnectionError as e:
-            # Network communication with Stripe failed
+        except (stripe.error.APIConnectionError, stripe.error.RateLimitError):
+            # Stripe is slow, overloaded or unreachable and the gateway gave
+            # up retrying (or its circuit breaker is open).
+            logger.warning('Stripe unavailable during checkout', exc_info=True)
             messages.info(
-                self.request, "Connection error...Please check your connection")
+                self.request, "Our payment provider is not responding right now. Please try again in a minute")
             return redirect('/')
+        except OrderAlreadyPaid:
+            messages.info(
+                self.request, "This order was already paid. Please contact us about the second charge.")
+            return redirect('profile')
+        except PaymentAlreadyUsed:
+            logger.error('Charge %s was already used for another order', charge['id'])
+            messages.info(
+                self.request, "This payment was already used for another order. Please contact us.")
+            return redirect('order_summary')
+        except OutOfStock as e:
+            if charge is None:
+                messages.info(self.request, f"Sorry, {e} sold out before you could check out")
+                return redirect('order_summary')
+            # The holds lapsed between reserving and finalizing and someone
+            # else bought the last units meanwhile.
+            refund_unfinalized(order, charge['id'])
+            messages.info(
+                self.request, f"Sorry, {e} sold out while your payment went through. "
+                "Your card will be refunded.")
+            return redirect('order_summary')
         except stripe.error.StripeError as e:
             # Display a very generic error to the user, and maybe send
             # yourself an email
             messages.info(
                 self.request, "Something went wrong, You were not charged. Please try again")
             return redirect('/')
-        except Exception as e:
-            # Send an e-mail to ourselves
-            print(e)
+        except Exception:
+            logger.exception('Checkout failed')
             messages.info(
                 self.request, "A serious error occurred, We were notified and are handling it.")
             return redirect('/')
 
 
-class OrderSummaryView(LoginRequiredMixin, View):
+class OrderSummaryView(View):
     def get(self, *args, **kwargs):
+        if not self.request.user.is_authenticated:
+            session_cart = cart.SessionCart(self.request.session)
+            if not session_cart:
+                messages.info(self.request, "You don't have an active order!")
+                return redirect('home')
+            return render(self.request, 'cart.html', {'objects': session_cart})
         try:
-            order = Order.objects.get(user=self.request.user, ordered=False)
+            order = Order.objects.with_details().get(
+                user=self.request.user, ordered=False)
             context = {
                 'objects': order
             }
@@ -289,7 +383,7 @@ class OrderSummaryView(LoginRequiredMixin, View):
             return redirect('home')
 
 
-class CouponView(View):
+class CouponView(LoginRequiredMixin, View):
     def post(self, *args, **kwargs):
         coupon_form = CouponForm(self.request.POST or None)
         if coupon_form.is_valid():
@@ -297,8 +391,7 @@ class CouponView(View):
                 code = coupon_form.cleaned_data.get('code')
                 order = Order.objects.get(
                     user=self.request.user, ordered=False)
-                order.coupon = Coupon.objects.get(code=code)
-                order.save()
+                order.apply_coupon(Coupon.objects.get(code=code))
                 messages.success(self.request, 'Successfully added coupon!')
                 return redirect('checkout')
             except ObjectDoesNotExist:
@@ -324,13 +417,16 @@ class RefundView(View):
                 code = form.cleaned_data.get('code')
                 order = Order.objects.get(ref_code=code, ordered=True)
                 order.refund_requested = True
-                order.save()
+                # Not save(): ordered_date is auto_now and dates the sale in
+                # the sales reports.
+                order.save(update_fields=['refund_requested'])
 
                 refund = Refund()
                 refund.order = order
                 refund.email = email
                 refund.message = reason
                 refund.save()
+                reporting.refund_requested(order)
                 messages.success(
                     self.request, "You refund request has been received and is being processed!")
                 return redirect('home')
@@ -343,116 +439,159 @@ class RefundView(View):
         return redirect('request_refund')
 
 
+@login_required
+@require_POST
+def payment_reserve(request):
+    # Called before PayPal takes the money, so a sold out item fails here.
+    order = get_object_or_404(Order, user=request.user, ordered=False)
+    try:
+        reserve_order(order)
+    except OutOfStock as e:
+        return JsonResponse({'error': f'Sorry, {e} sold out.'}, status=409)
+    return JsonResponse({'total': str(order.get_total())})
+
+
+@login_required
+@require_POST
 def payment_complete(request):
     body = json.loads(request.body)
-    order = Order.objects.get(
-        user=request.user, ordered=False, id=body['order_id'])
-
-    # create the payment
-    payment = Payment()
-    payment.charge_id = create_ref_code()
-    payment.user = request.user
-    payment.amount = order.get_total()
-    payment.save()
-
-    order_items = order.items.all()
-    order_items.update(ordered=True)
-    for item in order_items:
-        item.save()
-
-    # assign the payment to the order
-    order.ordered = True
-    order.payment = payment
-    order.ref_code = create_ref_code()
-    order.save()
+    # PayPal's order id identifies the capture; retried calls for it are
+    # no-ops.
+    paypal_id = str(body.get('paypal_order_id') or f"order-{body['order_id']}")
+    try:
+        finalize_order(body['order_id'], request.user, paypal_id, f'paypal:{paypal_id}')
+    except ObjectDoesNotExist:
+        raise Http404("No such order")
+    except OrderAlreadyPaid:
+        return JsonResponse({'error': 'This order has already been paid.'}, status=409)
+    except PaymentAlreadyUsed:
+        return JsonResponse(
+            {'error': 'This payment was already used for another order.'}, status=409)
+    except OutOfStock as e:
+        logger.error('Order %s was paid but %s sold out', body['order_id'], e)
+        refund_unfinalized(
+            Order.objects.get(pk=body['order_id'], user=request.user), paypal_id)
+        return JsonResponse(
+            {'error': f'Sorry, {e} sold out while your payment went through. '
+                      'Your payment will be refunded.'}, status=409)
+    invalidate_cart_item_count(request.user)
     messages.success(
         request, 'Your payment was successful. Go to you profile to view the deilvery status')
     return redirect('home')
 
 
+@login_required
 def profile(request):
     context = {
-        'orders': Order.objects.filter(user=request.user).order_by('-ordered_date')
+        'orders': Order.objects.with_details().filter(
+            user=request.user).order_by('-ordered_date')
     }
     return render(request, 'profile.html', context)
 
 
-@login_required
 def add_to_cart(request, slug):
     item = get_object_or_404(Item, slug=slug)
-    order_item, created = OrderItem.objects.get_or_create(
-        item=item,
-        user=request.user,
-        ordered=False,
-    )
-    order_qs = Order.objects.filter(user=request.user, ordered=False)
-    if order_qs.exists():
-        order = order_qs[0]
-        if order.items.filter(item__slug=item.slug).exists():
-            order_item.quantity += 1
-            order_item.save()
-            messages.success(request, f"{item}'s quantity was updated")
-            return redirect('order_summary')
-        else:
-            order.items.add(order_item)
-            messages.success(request, f"{item} was added to your cart")
-            return redirect('order_summary')
+    if request.user.is_authenticated:
+        try:
+            quantity = cart.add_item(request.user, item)[1].quantity
+        except OutOfStock:
+            messages.info(request, f"Sorry, {item} is sold out")
+            return redirect('detail', slug=slug)
+    else:
+        quantity = cart.SessionCart(request.session).add(item)
+    if quantity > 1:
+        messages.success(request, f"{item}'s quantity was updated")
     else:
-        # ordered_date = timezone.now()
-        order = Order.objects.create(
-            user=request.user, ordered=False)  # ordered_date=ordered_date)
-        order.items.add(order_item)
         messages.success(request, f"{item} was added to your cart")
-        return redirect('order_summary')
+    return redirect('order_summary')
 
 
-@login_required
-def remove_single_from_cart(request, slug):
+def remove_from_cart_view(request, slug, quantity, message):
     item = get_object_or_404(Item, slug=slug)
-    order_qs = Order.objects.filter(user=request.user, ordered=False)
-    if order_qs.exists():
-        order = order_qs[0]
-        if order.items.filter(item__slug=item.slug).exists():
-            order_item = OrderItem.objects.filter(
-                item=item,
-                user=request.user,
-                ordered=False)[0]
-            if order_item.quantity > 1:
-                order_item.quantity -= 1
-                order_item.save()
-            else:
-                order.items.remove(order_item)
-                order.save()
-            messages.success(request, f"{item}'s quantity was updated!")
-            return redirect('order_summary')
-
+    try:
+        if request.user.is_authenticated:
+            cart.remove_item(request.user, item, quantity)
         else:
-            messages.success(request, f"{item} was not in your cart")
-            return redirect('detail', slug=slug)
-    else:
+            cart.SessionCart(request.session).remove(item, quantity)
+        messages.success(request, message.format(item=item))
+        return redirect('order_summary')
+    except cart.ItemNotInCart:
+        messages.success(request, f"{item} was not in your cart")
+        return redirect('detail', slug=slug)
+    except cart.NoActiveOrder:
         messages.success(request, "You do not have an active order")
         return redirect('detail', slug=slug)
 
 
-@login_required
+def remove_single_from_cart(request, slug):
+    return remove_from_cart_view(
+        request, slug, 1, "{item}'s quantity was updated!")
+
+
 def remove_from_cart(request, slug):
+    return remove_from_cart_view(
+        request, slug, None, "{item} was removed from your cart!")
+
+
+def api_login_required(view):
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'Authentication required'}, status=401)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def line_json(line, item):
+    return {
+        'slug': item.slug,
+        'title': item.title,
+        'quantity': line.quantity,
+        'unit_price': item.get_final_price(),
+        'price': line.quantity * item.get_final_price(),
+    }
+
+
+def cart_json(user, order, **extra):
+    return dict(
+        item_count=get_cart_item_count(user),
+        subtotal=order.subtotal if order else 0,
+        discount=order.discount if order else 0,
+        total=order.total if order else 0,
+        **extra
+    )
+
+
+@require_GET
+@api_login_required
+def cart_api(request):
+    order = Order.objects.with_details().filter(
+        user=request.user, ordered=False).first()
+    lines = order.items.all() if order else []
+    return JsonResponse(cart_json(
+        request.user, order, lines=[line_json(line, line.item) for line in lines]))
+
+
+@require_POST
+@api_login_required
+def cart_api_add(request, slug):
     item = get_object_or_404(Item, slug=slug)
-    order_qs = Order.objects.filter(user=request.user, ordered=False)
-    if order_qs.exists():
-        order = order_qs[0]
-        if order.items.filter(item__slug=item.slug).exists():
-            order_item = OrderItem.objects.filter(
-                item=item,
-                user=request.user,
-                ordered=False)[0]
-
-            order.items.remove(order_item)
-            messages.success(request, f"{item} was removed from your cart!")
-            return redirect('order_summary')
+    try:
+        order, order_item = cart.add_item(request.user, item)
+    except OutOfStock:
+        return JsonResponse({'error': f"{item} is sold out"}, status=409)
+    return JsonResponse(cart_json(
+        request.user, order, line=line_json(order_item, item)))
 
-        else:
-            messages.success(request, f"{item} was not in your cart")
-            return redirect('detail', slug=slug)
-    else:
-        messages.success(request, "You do not have an active order")
-        return redirect('detail', slug=slug)
+
+@require_POST
+@api_login_required
+def cart_api_remove(request, slug, quantity=1):
+    item = get_object_or_404(Item, slug=slug)
+    try:
+        order, order_item = cart.remove_item(request.user, item, quantity)
+    except cart.ItemNotInCart:
+        return JsonResponse({'error': f"{item} was not in your cart"}, status=404)
+    except cart.NoActiveOrder:
+        return JsonResponse({'error': "You do not have an active order"}, status=404)
+    return JsonResponse(cart_json(
+        request.user, order, line=line_json(order_item, item)))
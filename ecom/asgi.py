@@ -13,4 +13,10 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecom.settings')
 
-application = get_asgi_application()
+# Plain Django, every request through the sync handler.
+django_application = get_asgi_application()
+
+# Imported once the app registry is ready.
+from catalog.asgi import CachedCatalogPages  # noqa: E402
+
+application = CachedCatalogPages(django_application)
@@ -2,6 +2,16 @@ import os
 from decouple import config
 
 STRIPE_SECRET_KEY = config('STRIPE_SECRET_KEY')
+# catalog.payments.StripeGateway: seconds per socket connect/read, for the
+# whole call including retries, and when to stop calling a failing Stripe.
+STRIPE_API_BASE = config('STRIPE_API_BASE', default='https://api.stripe.com')
+STRIPE_CONNECT_TIMEOUT = config('STRIPE_CONNECT_TIMEOUT', default=3.05, cast=float)
+STRIPE_READ_TIMEOUT = config('STRIPE_READ_TIMEOUT', default=10, cast=float)
+STRIPE_DEADLINE = config('STRIPE_DEADLINE', default=20, cast=float)
+STRIPE_MAX_RETRIES = config('STRIPE_MAX_RETRIES', default=2, cast=int)
+STRIPE_POOL_SIZE = config('STRIPE_POOL_SIZE', default=10, cast=int)
+STRIPE_BREAKER_THRESHOLD = config('STRIPE_BREAKER_THRESHOLD', default=5, cast=int)
+STRIPE_BREAKER_RESET = config('STRIPE_BREAKER_RESET', default=30, cast=float)
 USERNAME = config('USERNAME')
 PASSWORD = config('PASSWORD')
 
@@ -33,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'catalog.metrics.InstrumentationMiddleware',
+    'catalog.routers.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -46,7 +58,8 @@ ROOT_URLCONF = 'ecom.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, timing renders for catalog.metrics.
+        'BACKEND': 'catalog.metrics.TimedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -55,6 +68,8 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'catalog.context_processors.cart',
+                'catalog.context_processors.catalog',
             ],
         },
     },
@@ -62,12 +77,57 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'ecom.wsgi.application'
 
+# The SQLite file next to manage.py, in WAL mode with immediate write
+# transactions (see catalog.backends.sqlite3), unless DB_ENGINE and friends
+# point elsewhere. SQLite still runs one write at a time; a busy shop wants
+# e.g. django.db.backends.postgresql.
+#
+# WAL is stored in the database file: the first connection, manage.py
+# commands included, switches the bundled db.sqlite3 over for good (like
+# any write, this shows up in git status) and SQLite keeps -wal and -shm
+# files beside it while it is open. To keep a file in rollback journal
+# mode, set DB_ENGINE=django.db.backends.sqlite3 before first use.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'ENGINE': config('DB_ENGINE', default='catalog.backends.sqlite3'),
+        'NAME': config('DB_NAME', default=os.path.join(BASE_DIR, 'db.sqlite3')),
+        'USER': config('DB_USER', default=''),
+        'PASSWORD': config('DB_PASSWORD', default=''),
+        'HOST': config('DB_HOST', default=''),
+        'PORT': config('DB_PORT', default=''),
+        # Seconds a connection is reused across requests, 0 to close it after
+        # each one.
+        'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=0, cast=int),
     }
 }
+if DATABASES['default']['ENGINE'].endswith('sqlite3'):
+    # A file rather than Django's in-memory default, so the tests run on
+    # SQLite as served: concurrent writers wait for each other.
+    DATABASES['default']['TEST'] = {
+        'NAME': config('DB_TEST_NAME', default=os.path.join(BASE_DIR, 'test_db.sqlite3')),
+    }
+# Ping persistent connections when a request starts and reconnect if the
+# server dropped them.
+DATABASE_HEALTH_CHECKS = config('DB_HEALTH_CHECKS', default=False, cast=bool)
+
+# A read-only copy of the default database (a streaming replica, or another
+# SQLite file locally) for catalog pages, see catalog.routers. Tests read it
+# through the default database.
+if config('DB_REPLICA_NAME', default=''):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': config('DB_REPLICA_NAME'),
+        'USER': config('DB_REPLICA_USER', default=DATABASES['default']['USER']),
+        'PASSWORD': config('DB_REPLICA_PASSWORD', default=DATABASES['default']['PASSWORD']),
+        'HOST': config('DB_REPLICA_HOST', default=DATABASES['default']['HOST']),
+        'PORT': config('DB_REPLICA_PORT', default=DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_REPLICA = 'replica' if 'replica' in DATABASES else None
+DATABASE_ROUTERS = ['catalog.routers.ReplicaRouter']
+# Seconds a visitor reads only from the default database after writing, and
+# every catalog page after a catalog change: longer than the replica lag.
+DATABASE_REPLICA_PIN_SECONDS = config('DB_REPLICA_PIN_SECONDS', default=5, cast=int)
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -117,3 +177,85 @@ CRISPY_TEMPLATE_PACK = 'bootstrap4'
 ACCOUNT_AUTHENTICATION_METHOD = 'username'
 ACCOUNT_EMAIL_REQUIRED = True
 ACCOUNT_EMAIL_VERIFICATION = 'none'
+
+# Order mail goes out from the task worker (manage.py run_tasks). Point
+# EMAIL_HOST/EMAIL_PORT at a local stub such as `python -m smtpd -n -c
+# DebuggingServer localhost:1025` to watch it in development.
+EMAIL_BACKEND = config(
+    'EMAIL_BACKEND', default='django.core.mail.backends.console.EmailBackend')
+EMAIL_HOST = config('EMAIL_HOST', default='localhost')
+EMAIL_PORT = config('EMAIL_PORT', default=25, cast=int)
+EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
+EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
+EMAIL_USE_SSL = config('EMAIL_USE_SSL', default=False, cast=bool)
+EMAIL_TIMEOUT = 10
+DEFAULT_FROM_EMAIL = config(
+    'DEFAULT_FROM_EMAIL', default="Butek's Online <buteksonline@gmail.com>")
+
+# CACHE_BACKEND picks one of these, CACHE_LOCATION is its address: e.g.
+# memcached with 127.0.0.1:11211, redis with redis://127.0.0.1:6379/1, file
+# with a directory. locmem is private to each process, so run anything with
+# more than one worker on a shared cache.
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'memcached': 'django.core.cache.backends.memcached.MemcachedCache',
+    'pylibmc': 'django.core.cache.backends.memcached.PyLibMCCache',
+    # Needs the django-redis package.
+    'redis': 'django_redis.cache.RedisCache',
+}
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[config('CACHE_BACKEND', default='locmem')],
+        'LOCATION': config('CACHE_LOCATION', default=''),
+        'KEY_PREFIX': config('CACHE_KEY_PREFIX', default='ecom'),
+    }
+}
+
+# cached_db reads sessions from the cache and only queries the database on a
+# miss. signed_cookies keeps them in the browser and off the server
+# entirely, at the cost of a cookie capped near 4KB; cache alone loses them
+# whenever the cache is flushed.
+SESSION_ENGINE = 'django.contrib.sessions.backends.' + config(
+    'SESSION_BACKEND', default='cached_db')
+# Flash messages ride in a cookie, so the cart views' messages.success()
+# never saves the session.
+MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
+
+# Seconds cached catalog pages, fragments and lookups live. Saving or
+# deleting an Item, Category or Rating retires all of them straight away.
+CATALOG_CACHE_TIMEOUT = 60 * 15
+
+# Seconds stock reserved for a cart is held before manage.py
+# release_reservations hands it back.
+STOCK_RESERVATION_TIMEOUT = 60 * 15
+
+# Rows changed per transaction by bulk admin actions, see catalog.bulk.
+BULK_ACTION_CHUNK_SIZE = 500
+
+# catalog.metrics.InstrumentationMiddleware counts and times every request.
+# This share of them also has its SQL queries, template rendering and cache
+# lookups measured, and is logged as a JSON line to catalog.metrics at INFO,
+# or at WARNING when one statement ran METRICS_REPEATED_QUERY_WARNING times.
+METRICS_SAMPLE_RATE = config('METRICS_SAMPLE_RATE', default=0.1, cast=float)
+METRICS_REPEATED_QUERY_WARNING = config('METRICS_REPEATED_QUERY_WARNING', default=10, cast=int)
+# Bearer token Prometheus sends to scrape /metrics. Staff can always see it.
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'metrics': {'class': 'logging.StreamHandler', 'formatter': 'message'},
+    },
+    'loggers': {
+        'catalog.metrics': {
+            'handlers': ['metrics'],
+            'level': config('METRICS_LOG_LEVEL', default='WARNING'),
+            'propagate': False,
+        },
+    },
+}